@@ -0,0 +1,42 @@
+-- migrations/005_reference_tracks_upsert_key.sql
+-- Chiave di idempotenza per l'ingest a blocchi (tools/ingest_reference_tracks.py):
+-- upsert ON CONFLICT (profile_key, source, source_id).
+
+-- In un indice unique i NULL non vanno mai in conflitto: source e source_id
+-- devono essere sempre valorizzati, altrimenti ogni ingest duplica la riga.
+UPDATE reference_tracks
+  SET source = 'local'
+  WHERE source IS NULL;
+
+-- Le reference locali senza id esterno ricevono un source_id derivato (local:<hash>).
+-- Stessa normalizzazione di _local_source_id nello script: trim di spazi/tab/CR/LF,
+-- lowercase, md5 di "artista|titolo", primi 16 caratteri esadecimali.
+UPDATE reference_tracks
+  SET source_id = 'local:' || substr(md5(
+        lower(btrim(coalesce(track_artist, ''), E' \t\r\n')) || '|' ||
+        lower(btrim(coalesce(track_title, ''), E' \t\r\n'))
+      ), 1, 16)
+  WHERE source_id IS NULL;
+
+-- Elimina i duplicati già presenti, tenendo per ogni chiave la riga più recente
+-- (created_at, a parità l'id più alto)
+DELETE FROM reference_tracks
+  WHERE id IN (
+    SELECT id FROM (
+      SELECT id,
+             row_number() OVER (
+               PARTITION BY profile_key, source, source_id
+               ORDER BY created_at DESC NULLS LAST, id DESC
+             ) AS rn
+        FROM reference_tracks
+    ) ranked
+    WHERE ranked.rn > 1
+  );
+
+ALTER TABLE reference_tracks
+  ALTER COLUMN source SET DEFAULT 'local',
+  ALTER COLUMN source SET NOT NULL,
+  ALTER COLUMN source_id SET NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS reference_tracks_profile_source_uidx
+  ON reference_tracks (profile_key, source, source_id);
@@ -8,6 +8,7 @@ import json
 import math
 import os
 import subprocess
+import sys
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
@@ -16,6 +17,16 @@ import numpy as np
 
 
 def load_audio_ffmpeg(path: str, sr: int = 44100):
+    """PCM stereo [2, n]; passa dalla cache PCM di V3 se importabile (--repo)."""
+    try:
+        from tekkin_analyzer_v3.utils.pcm_cache import cached_pcm
+    except ImportError:
+        return _decode_ffmpeg(path, sr).T, sr
+    audio, _ = cached_pcm(path, sr, lambda: _decode_ffmpeg(path, sr))
+    return audio.T, sr
+
+
+def _decode_ffmpeg(path: str, sr: int) -> np.ndarray:
     ffmpeg = os.environ.get("FFMPEG_BIN", "ffmpeg")
     cmd = [
         ffmpeg,
@@ -54,8 +65,7 @@ def load_audio_ffmpeg(path: str, sr: int = 44100):
     if audio.size % 2 != 0:
         audio = audio[: audio.size - 1]
 
-    stereo = audio.reshape(-1, 2).T  # shape [2, n]
-    return stereo, sr
+    return audio.reshape(-1, 2)  # shape [n, 2]
 
 
 def import_core(core_path: Path):
@@ -155,8 +165,58 @@ def update_track_row_with_stereo(row: Dict[str, Any], stereo_payload: Any, *, ov
     return row2
 
 
+# Frame per chunk nelle STFT/sound field: limita la memoria dei temporanei
+# (bins x frames) complex128 prodotti da rfft (~16 MB per canale a n_fft=2048).
+STFT_CHUNK_FRAMES = 1024
+
+
+def _frame_view(x: np.ndarray, frame_len: int, hop: int) -> np.ndarray:
+    """
+    Vista strided (senza copia) di x in frame: shape (n_frames, frame_len).
+    Solo i frame completi, come il loop originale range(0, n - frame_len + 1, hop).
+    """
+    n_frames = 1 + (x.size - frame_len) // hop
+    if n_frames <= 0:
+        return np.empty((0, frame_len), dtype=x.dtype)
+    x = np.ascontiguousarray(x)
+    step = x.strides[0]
+    return np.lib.stride_tricks.as_strided(
+        x, shape=(n_frames, frame_len), strides=(hop * step, step), writeable=False
+    )
+
+
+def _iter_stft_lr_chunks(
+    xL: np.ndarray,
+    xR: np.ndarray,
+    n_fft: int,
+    hop: int,
+    *,
+    chunk_frames: int = STFT_CHUNK_FRAMES,
+):
+    """
+    Genera (i0, i1, stftL_chunk, stftR_chunk) con stft_* shape (n_bins, i1 - i0) complex64.
+    Un solo rfft batched per chunk e canale.
+    """
+    win = np.hanning(n_fft).astype(np.float32)
+    framesL = _frame_view(xL, n_fft, hop)
+    framesR = _frame_view(xR, n_fft, hop)
+    n_frames = min(framesL.shape[0], framesR.shape[0])
+    chunk_frames = max(1, int(chunk_frames))
+
+    for i0 in range(0, n_frames, chunk_frames):
+        i1 = min(n_frames, i0 + chunk_frames)
+        specL = np.fft.rfft(framesL[i0:i1] * win, axis=1).astype(np.complex64).T
+        specR = np.fft.rfft(framesR[i0:i1] * win, axis=1).astype(np.complex64).T
+        yield i0, i1, specL, specR
+
+
 def _stft_lr_np(
-    stereo: np.ndarray, sr: int, n_fft: int = 2048, hop: int = 512
+    stereo: np.ndarray,
+    sr: int,
+    n_fft: int = 2048,
+    hop: int = 512,
+    *,
+    chunk_frames: int = STFT_CHUNK_FRAMES,
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
     stereo: shape (2, n_samples)
@@ -172,21 +232,16 @@ def _stft_lr_np(
     if xL.size < n_fft or xR.size < n_fft:
         raise ValueError("audio troppo corto per n_fft")
 
-    win = np.hanning(n_fft).astype(np.float32)
-    n_frames = 1 + (xL.size - n_fft) // hop
+    n_frames = 1 + (min(xL.size, xR.size) - n_fft) // hop
     if n_frames <= 0:
         raise ValueError("n_frames <= 0")
 
     stftL = np.empty((n_fft // 2 + 1, n_frames), dtype=np.complex64)
     stftR = np.empty((n_fft // 2 + 1, n_frames), dtype=np.complex64)
 
-    for i in range(n_frames):
-        a = i * hop
-        b = a + n_fft
-        fL = xL[a:b] * win
-        fR = xR[a:b] * win
-        stftL[:, i] = np.fft.rfft(fL).astype(np.complex64)
-        stftR[:, i] = np.fft.rfft(fR).astype(np.complex64)
+    for i0, i1, cL, cR in _iter_stft_lr_chunks(xL, xR, n_fft, hop, chunk_frames=chunk_frames):
+        stftL[:, i0:i1] = cL
+        stftR[:, i0:i1] = cR
 
     freqs_hz = np.fft.rfftfreq(n_fft, d=1.0 / float(sr))
     return stftL, stftR, freqs_hz
@@ -200,6 +255,7 @@ def compute_sound_field_from_lr(
     win: int = 2048,
     hop: int = 1024,
     n_bins: int = 6,
+    chunk_frames: int = STFT_CHUNK_FRAMES,
 ) -> Dict[str, Any]:
     """
     Restituisce un sound field polar:
@@ -225,27 +281,32 @@ def compute_sound_field_from_lr(
     sums = np.zeros(n_bins, dtype=np.float64)
     counts = np.zeros(n_bins, dtype=np.int64)
 
-    for start in range(0, n - win + 1, hop):
-        wL = xL[start : start + win]
-        wR = xR[start : start + win]
+    framesL = _frame_view(xL, win, hop)
+    framesR = _frame_view(xR, win, hop)
+    n_frames = framesL.shape[0]
+    chunk_frames = max(1, int(chunk_frames))
 
-        rmsL = float(np.sqrt(np.mean(wL * wL) + eps))
-        rmsR = float(np.sqrt(np.mean(wR * wR) + eps))
+    for i0 in range(0, n_frames, chunk_frames):
+        wL = framesL[i0 : i0 + chunk_frames]
+        wR = framesR[i0 : i0 + chunk_frames]
+
+        rmsL = np.sqrt(np.mean(wL * wL, axis=1, dtype=np.float64) + eps)
+        rmsR = np.sqrt(np.mean(wR * wR, axis=1, dtype=np.float64) + eps)
 
         pan = (rmsR - rmsL) / (rmsR + rmsL + eps)
 
         mid = 0.5 * (wL + wR)
         side = 0.5 * (wL - wR)
-        rmsM = float(np.sqrt(np.mean(mid * mid) + eps))
-        rmsS = float(np.sqrt(np.mean(side * side) + eps))
+        rmsM = np.sqrt(np.mean(mid * mid, axis=1, dtype=np.float64) + eps)
+        rmsS = np.sqrt(np.mean(side * side, axis=1, dtype=np.float64) + eps)
         width = rmsS / (rmsM + rmsS + eps)
 
         angle = 180.0 * (pan + 1.0)
-        b = int(np.floor((angle / 360.0) * n_bins))
-        b = max(0, min(n_bins - 1, b))
+        b = np.floor((angle / 360.0) * n_bins).astype(np.int64)
+        b = np.clip(b, 0, n_bins - 1)
 
-        sums[b] += width
-        counts[b] += 1
+        sums += np.bincount(b, weights=width, minlength=n_bins)
+        counts += np.bincount(b, minlength=n_bins)
 
     step = 360 // n_bins
     angle_deg = [i * step for i in range(n_bins)] + [360]
@@ -301,16 +362,6 @@ def compute_stereo_metrics_fallback(
     lr_balance_db = float(20.0 * np.log10((rmsR + eps) / (rmsL + eps)))
     lr_balance_db = max(-60.0, min(60.0, lr_balance_db))
 
-    stftL, stftR, freqs_hz = _stft_lr_np(stereo, sr=int(sr), n_fft=2048, hop=512)
-    SL = (np.abs(stftL) ** 2).astype(np.float64, copy=False)
-    SR = (np.abs(stftR) ** 2).astype(np.float64, copy=False)
-
-    mid_power = 0.5 * (SL + SR)
-    side_power = np.maximum(0.0, 0.5 * (SL + SR) - np.sqrt(SL * SR))
-    width_tf = side_power / (mid_power + side_power + eps)
-
-    corr_tf = (2.0 * np.sqrt(SL * SR)) / (SL + SR + eps)
-
     if bands_hz is None:
         bands_hz = [
             ("sub", 20.0, 60.0),
@@ -322,18 +373,49 @@ def compute_stereo_metrics_fallback(
             ("air", 12000.0, 20000.0),
         ]
 
+    n_fft = 2048
+    hop = 512
+    freqs_hz = np.fft.rfftfreq(n_fft, d=1.0 / float(sr))
+    band_idx = [
+        (name, np.where((freqs_hz >= f0) & (freqs_hz < f1))[0]) for name, f0, f1 in bands_hz
+    ]
+
+    # Somme per bin accumulate chunk per chunk: le matrici (bins x frames)
+    # di width/correlazione non vengono mai materializzate per intero.
+    width_row_sums = np.zeros(freqs_hz.size, dtype=np.float64)
+    corr_row_sums = np.zeros(freqs_hz.size, dtype=np.float64)
+    n_frames = 0
+
+    for i0, i1, stftL, stftR in _iter_stft_lr_chunks(xL, xR, n_fft, hop):
+        SL = (np.abs(stftL) ** 2).astype(np.float64, copy=False)
+        SR = (np.abs(stftR) ** 2).astype(np.float64, copy=False)
+
+        total = SL + SR
+        cross = np.sqrt(SL * SR, out=SL)
+        mid_power = 0.5 * total
+        side_power = np.maximum(0.0, mid_power - cross, out=SR)
+
+        # width = side / (mid + side), corr = 2 * sqrt(L*R) / (L + R)
+        width_tf = side_power / (mid_power + side_power + eps)
+        total += eps
+        corr_tf = np.divide(2.0 * cross, total, out=total)
+
+        width_row_sums += np.sum(width_tf, axis=1)
+        corr_row_sums += np.sum(corr_tf, axis=1)
+        n_frames += i1 - i0
+
     width_by_band: Dict[str, float] = {}
     correlation_by_band: Dict[str, float] = {}
 
-    for name, f0, f1 in bands_hz:
-        idx = np.where((freqs_hz >= f0) & (freqs_hz < f1))[0]
-        if idx.size == 0:
+    for name, idx in band_idx:
+        if idx.size == 0 or n_frames == 0:
             width_by_band[name] = 0.0
             correlation_by_band[name] = 0.0
             continue
 
-        w = float(np.mean(width_tf[idx, :]))
-        c = float(np.mean(corr_tf[idx, :]))
+        count = float(idx.size * n_frames)
+        w = float(np.sum(width_row_sums[idx])) / count
+        c = float(np.sum(corr_row_sums[idx])) / count
         width_by_band[name] = max(0.0, min(1.0, w))
         correlation_by_band[name] = max(0.0, min(1.0, c))
 
@@ -348,7 +430,7 @@ def compute_stereo_metrics_fallback(
         "width_by_band": width_by_band,
         "correlation_by_band": correlation_by_band,
         "sound_field": sound_field,
-        "meta": {"sr": int(sr), "n_fft": 2048, "hop": 512},
+        "meta": {"sr": int(sr), "n_fft": n_fft, "hop": hop},
     }
 
 
@@ -571,6 +653,8 @@ def main():
     args = p.parse_args()
 
     repo = Path(args.repo).resolve()
+    if str(repo) not in sys.path:
+        sys.path.insert(0, str(repo))
     ref_dir = (repo / args.reference_models_dir).resolve()
     core = import_core((repo / args.core_path).resolve())
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del pool di algoritmi Essentia (tekkin_analyzer_v3/utils/es_pool.py).
+
+1. costo di costruzione vs reset() per ogni algoritmo usato dai blocchi
+2. tempo per richiesta dei blocchi V3 (+ analyze_track del core) con pool
+   disattivato e attivo: la prima richiesta a pool attivo paga le costruzioni,
+   le successive solo i reset.
+
+Uso (dalla root del repo):
+    python -m scripts.bench_es_pool --seconds 30 --requests 3
+    python -m scripts.bench_es_pool --audio path/traccia.wav
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from tekkin_analyzer_v3.utils import es_pool
+
+
+def load_stereo(path: str) -> Tuple[np.ndarray, int]:
+    import soundfile as sf
+
+    data, sr = sf.read(path, dtype="float32", always_2d=True)
+    if data.shape[1] == 1:
+        data = np.concatenate([data, data], axis=1)
+    return np.ascontiguousarray(data[:, :2]), int(sr)
+
+
+def synthetic_stereo(seconds: float, sr: int = 44100, bpm: float = 126.0) -> Tuple[np.ndarray, int]:
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sr * seconds)) / sr
+    beat = (t * bpm / 60.0) % 1.0
+    kick = np.sin(2 * np.pi * (50 + 100 * np.exp(-beat * 30)) * beat) * np.exp(-beat * 8)
+    pad = 0.1 * (np.sin(2 * np.pi * 220 * t) + np.sin(2 * np.pi * 277.2 * t) + np.sin(2 * np.pi * 329.6 * t))
+    left = 0.5 * kick + pad + 0.02 * rng.standard_normal(t.size)
+    right = 0.5 * kick + pad + 0.02 * rng.standard_normal(t.size)
+    return np.stack([left, right], axis=1).astype(np.float32), sr
+
+
+def request_fns() -> List[Tuple[str, Callable[[np.ndarray, int], Any]]]:
+    from tekkin_analyzer_v3.blocks.extra import analyze_extra
+    from tekkin_analyzer_v3.blocks.loudness import analyze_loudness
+    from tekkin_analyzer_v3.blocks.rhythm import analyze_rhythm
+    from tekkin_analyzer_v3.blocks.stereo import analyze_stereo
+    from tekkin_analyzer_v3.blocks.timbre_spectrum import analyze_timbre_spectrum
+    from tekkin_analyzer_v3.blocks.transients import analyze_transients
+    from tekkin_analyzer_core import analyze_track
+
+    def core(audio: np.ndarray, sr: int) -> Any:
+        return analyze_track(
+            project_id="bench", version_id="bench", profile_key="", mode="master", sr=sr, audio_stereo=audio.T
+        )
+
+    return [
+        ("loudness", analyze_loudness),
+        ("timbre_spectrum", analyze_timbre_spectrum),
+        ("stereo", analyze_stereo),
+        ("transients", analyze_transients),
+        ("rhythm", analyze_rhythm),
+        ("extra", analyze_extra),
+        ("core.analyze_track", core),
+    ]
+
+
+def run_request(fns, audio: np.ndarray, sr: int) -> float:
+    t0 = time.perf_counter()
+    for name, fn in fns:
+        try:
+            fn(audio=audio, sr=sr)
+        except Exception as e:
+            print(f"  [{name}] errore: {type(e).__name__}: {e}")
+    return time.perf_counter() - t0
+
+
+def bench_construction(used: Dict[str, Dict[str, float]]) -> None:
+    print("== Costruzione vs reset (media per istanza) ==")
+    print(f"{'algoritmo':<22} {'costruzioni':>11} {'build ms':>9} {'riusi':>6} {'reset ms':>9}")
+    for name, s in sorted(used.items(), key=lambda kv: -kv[1]["build_ms"]):
+        build = s["build_ms"] / s["built"] if s["built"] else 0.0
+        reset = s["reset_ms"] / s["reused"] if s["reused"] else 0.0
+        print(f"{name:<22} {int(s['built']):>11} {build:>9.3f} {int(s['reused']):>6} {reset:>9.4f}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark pool algoritmi Essentia")
+    ap.add_argument("--audio", default=None, help="file audio (default: segnale sintetico)")
+    ap.add_argument("--seconds", type=float, default=30.0, help="durata del segnale sintetico")
+    ap.add_argument("--requests", type=int, default=3, help="richieste per modalità")
+    args = ap.parse_args()
+
+    audio, sr = load_stereo(args.audio) if args.audio else synthetic_stereo(args.seconds)
+    fns = request_fns()
+    print(f"audio: {audio.shape[0] / sr:.1f} s @ {sr} Hz, richieste per modalità: {args.requests}")
+
+    # import/JIT fuori dalla misura
+    run_request(fns, audio[: sr * 5], sr)
+
+    es_pool.POOL_ENABLED = False
+    es_pool.clear_pool()
+    es_pool.pool_stats(reset=True)
+    off = [run_request(fns, audio, sr) for _ in range(args.requests)]
+    stats_off = es_pool.pool_stats(reset=True)
+    build_off = sum(s["build_ms"] for s in stats_off.values()) / max(1, args.requests)
+
+    es_pool.POOL_ENABLED = True
+    es_pool.clear_pool()
+    on = [run_request(fns, audio, sr) for _ in range(args.requests)]
+    stats_on = es_pool.pool_stats(reset=True)
+
+    bench_construction(stats_on)
+    print("")
+    print("== Tempo per richiesta ==")
+    print(f"pool off : media {np.mean(off) * 1000:8.1f} ms   costruzioni {build_off:7.1f} ms/richiesta ({build_off / 1000.0 / np.mean(off) * 100:.1f}%)")
+    print(f"pool on  : prima {on[0] * 1000:8.1f} ms   successive media {np.mean(on[1:]) * 1000 if len(on) > 1 else float('nan'):8.1f} ms")
+    print(f"algoritmi nel pool (processo): {es_pool.pool_size()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Benchmark riproducibile di tutti gli engine dell'analyzer su audio sintetico
+deterministico (scripts/synth_audio.py).
+
+Engine misurati (tempo wall e CPU: mediana di --repeat esecuzioni; picco di
+memoria incrementale: un'esecuzione a parte, RSS dopo malloc_trim oppure
+tracemalloc con --mem):
+- v3                 analyze_v3 completo da file WAV (decode ffmpeg incluso)
+- v3.<blocco>        ogni blocco di V3_BLOCKS sul buffer già decodificato
+- core.analyze_track analyzer legacy usato dall'API
+- v4_extras          tools/tekkin_analyzer_v4_extras.analyze_v4_extras
+- v1                 pipeline di tools/tekkin_analyzer_v1 (loudness, stems,
+                     spettro, stereo, bpm, struttura, issues)
+- analyze_to_text    report testuale di tools/analyze_master_web
+
+Ogni run viene aggiunto allo storico JSON (--history) con commit git, host e
+versioni; compare confronta un run con la baseline e segnala le regressioni
+(uscita 1 se ce ne sono, utile in CI).
+
+Uso (dalla root del repo):
+    python -m scripts.bench_suite run --lengths 1,5 --repeat 3
+    python -m scripts.bench_suite run --kinds kickhat --lengths 1 --engines v3.,core
+    python -m scripts.bench_suite baseline            # ultimo run -> baseline
+    python -m scripts.bench_suite compare             # ultimo run vs baseline
+    python -m scripts.bench_suite list
+Lunghezze disponibili: 1, 5, 15, 60 minuti (60 minuti richiedono diversi GB).
+"""
+from __future__ import annotations
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _p in (REPO_ROOT, os.path.join(REPO_ROOT, "tools")):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+# analyze_master_web / API leggono il secret all'import; il benchmark non lo usa
+os.environ.setdefault("TEKKIN_ANALYZER_SECRET", "bench")
+# si misura sempre il calcolo completo: niente riuso da cache PCM o block store
+os.environ["TEKKIN_PCM_CACHE_MB"] = "0"
+os.environ["TEKKIN_BLOCK_STORE"] = "0"
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from scripts.synth_audio import KINDS, generate
+from tekkin_analyzer_v3.utils.resources import measure
+
+LENGTHS_MIN = (1, 5, 15, 60)
+DEFAULT_HISTORY = os.path.join(REPO_ROOT, "benchmarks", "history.json")
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmarks", "baseline.json")
+PROFILE_KEY = "minimal_deep_tech"
+
+
+class Case:
+    """Un input del benchmark: buffer (n, 2) float32 + WAV temporaneo per gli engine da file."""
+
+    def __init__(self, kind: str, minutes: float, sr: int, tmp_dir: str):
+        self.kind = kind
+        self.minutes = minutes
+        self.sr = sr
+        self.audio = generate(kind, minutes, sr)
+        self.key = f"{kind}_{minutes:g}m"
+        self._tmp_dir = tmp_dir
+        self._wav: Optional[str] = None
+
+    @property
+    def wav_path(self) -> str:
+        if self._wav is None:
+            import soundfile as sf
+
+            self._wav = os.path.join(self._tmp_dir, f"{self.key}.wav")
+            sf.write(self._wav, self.audio, self.sr, subtype="FLOAT")
+        return self._wav
+
+    def cleanup(self) -> None:
+        if self._wav and os.path.exists(self._wav):
+            os.remove(self._wav)
+
+
+# ---------------------------------------------------------------------------
+# engine
+# ---------------------------------------------------------------------------
+
+def _engine_v3(case: Case) -> Any:
+    from tekkin_analyzer_v3.analyze_v3 import analyze_v3
+
+    return analyze_v3(case.wav_path, profile_key=PROFILE_KEY)
+
+
+def _engine_v3_block(fn: Callable) -> Callable[[Case], Any]:
+    def run(case: Case) -> Any:
+        return fn(audio=case.audio, sr=case.sr)
+
+    return run
+
+
+def _engine_core(case: Case) -> Any:
+    from tekkin_analyzer_core import analyze_track
+
+    return analyze_track(
+        project_id="bench",
+        version_id=case.key,
+        profile_key=PROFILE_KEY,
+        mode="master",
+        sr=case.sr,
+        audio_stereo=np.ascontiguousarray(case.audio.T),
+    )
+
+
+def _engine_v4_extras(case: Case) -> Any:
+    from tekkin_analyzer_v4_extras import analyze_v4_extras
+
+    stereo = np.ascontiguousarray(case.audio.T)
+    return analyze_v4_extras(y_mono=stereo.mean(axis=0), y_stereo=stereo, sr=case.sr)
+
+
+def _engine_v1(case: Case) -> Any:
+    import tekkin_analyzer_v1 as v1
+
+    stereo = np.ascontiguousarray(case.audio.T)
+    mono = stereo.mean(axis=0)
+    cache = v1.SpectrogramCache(case.sr)
+    loud = v1.analyze_loudness(mono, case.sr)
+    stems = v1.analyze_stems_balance(mono, case.sr, cache)
+    spec = v1.analyze_spectrum(mono, case.sr, PROFILE_KEY, cache)
+    stereo_m = v1.analyze_stereo(stereo, case.sr, cache)
+    bpm = v1.estimate_bpm(mono, case.sr)
+    struct = v1.analyze_structure(mono, case.sr, bpm)
+    return v1.build_issues_v1(PROFILE_KEY, loud, stems, spec, stereo_m, struct)
+
+
+def _engine_text(case: Case) -> Any:
+    from analyze_master_web import analyze_to_text
+
+    return analyze_to_text(
+        "it",
+        PROFILE_KEY,
+        "master",
+        case.key + ".wav",
+        preloaded_audio=case.audio,
+        preloaded_sr=case.sr,
+    )
+
+
+def engines() -> Dict[str, Callable[[Case], Any]]:
+    from tekkin_analyzer_v3.analyze_v3 import V3_BLOCKS
+
+    out: Dict[str, Callable[[Case], Any]] = {"v3": _engine_v3}
+    for name, fn in V3_BLOCKS:
+        out[f"v3.{name}"] = _engine_v3_block(fn)
+    out["core.analyze_track"] = _engine_core
+    out["v4_extras"] = _engine_v4_extras
+    out["v1"] = _engine_v1
+    out["analyze_to_text"] = _engine_text
+    return out
+
+
+def _select(all_engines: Dict[str, Callable], spec: Optional[str]) -> Dict[str, Callable]:
+    """--engines: lista di prefissi separati da virgola (es. "v3.,core")."""
+    if not spec:
+        return all_engines
+    prefixes = [p.strip() for p in spec.split(",") if p.strip()]
+    return {k: v for k, v in all_engines.items() if any(k == p or k.startswith(p) for p in prefixes)}
+
+
+# ---------------------------------------------------------------------------
+# run
+# ---------------------------------------------------------------------------
+
+def _release_memory() -> None:
+    """Restituisce al sistema la memoria libera dell'allocatore, così il picco RSS parte da una base pulita."""
+    import gc
+
+    gc.collect()
+    try:
+        import ctypes
+
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except Exception:
+        pass
+
+
+def measure_engine(fn: Callable[[Case], Any], case: Case, repeat: int, mem: str) -> Dict[str, Any]:
+    """Tempi su `repeat` esecuzioni senza misura di memoria, poi un passaggio a parte per il picco."""
+    walls: List[float] = []
+    cpus: List[float] = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        try:
+            fn(case)
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+        walls.append((time.perf_counter() - t0) * 1000.0)
+        cpus.append((time.process_time() - c0) * 1000.0)
+
+    peak = None
+    if mem != "off":
+        _release_memory()
+        with measure(mem) as res:
+            fn(case)
+        peak = res.get("peak_mem_mb")
+    return {
+        "wall_ms": round(statistics.median(walls), 1),
+        "wall_ms_min": round(min(walls), 1),
+        "cpu_ms": round(statistics.median(cpus), 1),
+        "peak_mem_mb": peak,
+        "x_realtime": round(case.minutes * 60000.0 / max(1e-6, statistics.median(walls)), 1),
+        "repeat": repeat,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10
+        )
+        commit = out.stdout.strip() or None
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT, capture_output=True, text=True, timeout=30
+        ).stdout.strip()
+        return f"{commit}-dirty" if commit and dirty else commit
+    except Exception:
+        return None
+
+
+def _host() -> Dict[str, Any]:
+    info: Dict[str, Any] = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+    try:
+        import essentia
+
+        info["essentia"] = getattr(essentia, "__version__", None)
+    except Exception:
+        info["essentia"] = None
+    return info
+
+
+def run_suite(
+    kinds: List[str],
+    lengths: List[float],
+    engine_spec: Optional[str],
+    repeat: int,
+    sr: int,
+    mem: str,
+) -> Dict[str, Any]:
+    selected = _select(engines(), engine_spec)
+    if not selected:
+        raise SystemExit(f"nessun engine corrisponde a {engine_spec!r}")
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory(prefix="tekkin_bench_") as tmp:
+        # warm-up: import, pool Essentia e cache fuori dalla misura
+        warm = Case("kickhat", 5.0 / 60.0, sr, tmp)
+        for name, fn in selected.items():
+            try:
+                fn(warm)
+            except Exception as e:
+                print(f"[warm-up] {name}: {type(e).__name__}: {e}")
+        warm.cleanup()
+
+        for minutes in lengths:
+            for kind in kinds:
+                t_gen = time.perf_counter()
+                case = Case(kind, minutes, sr, tmp)
+                print(f"== {case.key} (generato in {time.perf_counter() - t_gen:.1f} s)")
+                row: Dict[str, Any] = {}
+                for name, fn in selected.items():
+                    row[name] = measure_engine(fn, case, repeat, mem)
+                    r = row[name]
+                    if "error" in r:
+                        print(f"   {name:<26} ERRORE {r['error']}")
+                    else:
+                        print(
+                            f"   {name:<26} {r['wall_ms']:>10.1f} ms  cpu {r['cpu_ms']:>10.1f} ms  "
+                            f"mem {r['peak_mem_mb'] if r['peak_mem_mb'] is not None else '-':>7} MB  x{r['x_realtime']}"
+                        )
+                results[case.key] = row
+                case.cleanup()
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "host": _host(),
+        "config": {"kinds": kinds, "lengths_min": lengths, "repeat": repeat, "sr": sr, "mem": mem, "engines": sorted(selected)},
+        "results": results,
+    }
+
+
+# ---------------------------------------------------------------------------
+# storico, baseline, confronto
+# ---------------------------------------------------------------------------
+
+def load_history(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else []
+
+
+def save_json(path: str, data: Any) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _pick_run(history: List[Dict[str, Any]], ref: str) -> Dict[str, Any]:
+    """ref: "latest", indice (anche negativo) o prefisso di commit."""
+    if not history:
+        raise SystemExit("storico vuoto: lancia prima `run`")
+    if ref == "latest":
+        return history[-1]
+    try:
+        return history[int(ref)]
+    except (ValueError, IndexError):
+        pass
+    for run in reversed(history):
+        if str(run.get("commit") or "").startswith(ref):
+            return run
+    raise SystemExit(f"run {ref!r} non trovato nello storico")
+
+
+def compare_runs(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    time_threshold: float,
+    mem_threshold: float,
+    min_ms: float,
+    min_mb: float,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Ritorna (righe, regressioni). Regressione = peggioramento oltre soglia relativa e assoluta."""
+    rows: List[Dict[str, Any]] = []
+    regressions: List[Dict[str, Any]] = []
+    for case_key, engines_now in (current.get("results") or {}).items():
+        engines_base = (baseline.get("results") or {}).get(case_key) or {}
+        for name, now in engines_now.items():
+            base = engines_base.get(name)
+            if not base or "error" in base:
+                continue
+            row: Dict[str, Any] = {"case": case_key, "engine": name, "flags": []}
+            if "error" in now:
+                row["flags"].append("error")
+                row["error"] = now["error"]
+                rows.append(row)
+                regressions.append(row)
+                continue
+            row["wall_base"], row["wall_now"] = base["wall_ms"], now["wall_ms"]
+            row["wall_delta"] = (now["wall_ms"] - base["wall_ms"]) / max(1e-6, base["wall_ms"])
+            if row["wall_delta"] > time_threshold and now["wall_ms"] - base["wall_ms"] > min_ms:
+                row["flags"].append("time")
+            pb, pn = base.get("peak_mem_mb"), now.get("peak_mem_mb")
+            if pb is not None and pn is not None:
+                row["mem_base"], row["mem_now"] = pb, pn
+                row["mem_delta"] = (pn - pb) / max(1.0, pb)
+                if row["mem_delta"] > mem_threshold and pn - pb > min_mb:
+                    row["flags"].append("memory")
+            rows.append(row)
+            if row["flags"]:
+                regressions.append(row)
+    return rows, regressions
+
+
+def print_compare(baseline: Dict[str, Any], current: Dict[str, Any], rows: List[Dict[str, Any]]) -> None:
+    print(f"baseline: {baseline.get('timestamp')} ({baseline.get('commit')})")
+    print(f"corrente: {current.get('timestamp')} ({current.get('commit')})")
+    if baseline.get("host", {}).get("platform") != current.get("host", {}).get("platform"):
+        print("ATTENZIONE: host diverso dalla baseline, i tempi non sono confrontabili")
+    print("")
+    print(f"{'caso':<14} {'engine':<26} {'base ms':>10} {'ora ms':>10} {'Δ':>7} {'base MB':>8} {'ora MB':>8}  flag")
+    for r in rows:
+        if "error" in r:
+            print(f"{r['case']:<14} {r['engine']:<26} ERRORE {r['error']}")
+            continue
+        mem_b = f"{r['mem_base']:.1f}" if "mem_base" in r else "-"
+        mem_n = f"{r['mem_now']:.1f}" if "mem_now" in r else "-"
+        print(
+            f"{r['case']:<14} {r['engine']:<26} {r['wall_base']:>10.1f} {r['wall_now']:>10.1f} "
+            f"{r['wall_delta'] * 100:>+6.1f}% {mem_b:>8} {mem_n:>8}  {','.join(r['flags'])}"
+        )
+
+
+def _parse_lengths(text: str) -> List[float]:
+    if text.strip() == "all":
+        return [float(x) for x in LENGTHS_MIN]
+    return [float(x) for x in text.split(",") if x.strip()]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark suite degli engine Tekkin Analyzer")
+    ap.add_argument("--history", default=DEFAULT_HISTORY, help="storico JSON dei run")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE, help="file della baseline")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="esegue il benchmark e lo aggiunge allo storico")
+    p_run.add_argument("--kinds", default=",".join(KINDS), help=f"tipi di segnale ({','.join(KINDS)})")
+    p_run.add_argument("--lengths", default="1,5", help="durate in minuti (es. 1,5,15) oppure all = 1,5,15,60")
+    p_run.add_argument("--engines", default=None, help="prefissi degli engine (es. v3.,core); default tutti")
+    p_run.add_argument("--repeat", type=int, default=3, help="ripetizioni per engine (mediana)")
+    p_run.add_argument("--sr", type=int, default=44100)
+    p_run.add_argument("--mem", choices=("rss", "tracemalloc", "off"), default="rss")
+    p_run.add_argument("--no-save", action="store_true", help="non scrive lo storico")
+
+    p_base = sub.add_parser("baseline", help="salva un run dello storico come baseline")
+    p_base.add_argument("--run", default="latest", help="latest | indice | prefisso di commit")
+
+    p_cmp = sub.add_parser("compare", help="confronta un run con la baseline")
+    p_cmp.add_argument("--run", default="latest", help="latest | indice | prefisso di commit")
+    p_cmp.add_argument("--time-threshold", type=float, default=0.10, help="regressione di tempo relativa (0.10 = +10%%)")
+    p_cmp.add_argument("--mem-threshold", type=float, default=0.20, help="regressione di memoria relativa")
+    p_cmp.add_argument("--min-ms", type=float, default=20.0, help="ignora peggioramenti sotto questi ms")
+    p_cmp.add_argument("--min-mb", type=float, default=10.0, help="ignora peggioramenti sotto questi MB")
+    p_cmp.add_argument("--json", action="store_true")
+
+    sub.add_parser("list", help="elenca i run dello storico")
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+        unknown = [k for k in kinds if k not in KINDS]
+        if unknown:
+            raise SystemExit(f"tipi sconosciuti: {unknown}")
+        run = run_suite(kinds, _parse_lengths(args.lengths), args.engines, max(1, args.repeat), args.sr, args.mem)
+        if not args.no_save:
+            history = load_history(args.history)
+            history.append(run)
+            save_json(args.history, history)
+            print(f"\nrun #{len(history) - 1} salvato in {args.history}")
+        return
+
+    history = load_history(args.history)
+    if args.cmd == "list":
+        for i, run in enumerate(history):
+            cfg = run.get("config") or {}
+            print(f"#{i:<3} {run.get('timestamp')}  {run.get('commit')}  casi={len(run.get('results') or {})}  engine={len(cfg.get('engines') or [])}")
+        return
+
+    if args.cmd == "baseline":
+        run = _pick_run(history, args.run)
+        save_json(args.baseline, run)
+        print(f"baseline = run {run.get('timestamp')} ({run.get('commit')}) -> {args.baseline}")
+        return
+
+    if args.cmd == "compare":
+        if not os.path.exists(args.baseline):
+            raise SystemExit(f"baseline assente ({args.baseline}): lancia `baseline`")
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        current = _pick_run(history, args.run)
+        rows, regressions = compare_runs(
+            baseline, current, args.time_threshold, args.mem_threshold, args.min_ms, args.min_mb
+        )
+        if args.json:
+            print(json.dumps({"rows": rows, "regressions": regressions}, indent=2))
+        else:
+            print_compare(baseline, current, rows)
+            print(f"\nregressioni: {len(regressions)}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+"""
+Harness di equivalenza: confronta l'output di due implementazioni dell'analyzer
+campo per campo, con tolleranze per campo, su un corpus di audio locale.
+
+Lati confrontabili (--baseline / --candidate):
+- golden        output salvati in --golden-dir (vedi `seed`)
+- current       il working tree corrente
+- ref:<git-ref> un commit (checkout temporaneo con `git worktree`)
+- tree:<path>   un altro checkout del repo
+Ogni lato gira in un sottoprocesso con le sue variabili (--baseline-env /
+--candidate-env KEY=VAL), così engine scelti via env a import-time
+(TEKKIN_TEMPO_ENGINE, TEKKIN_ES_POOL, ...) non si mescolano.
+
+Golden:
+    # dump di .tekkin-debug (risposte /analyze salvate dal sito in dev) + audio locale
+    python -m scripts.golden_compare seed --debug-dir .tekkin-debug --audio-dir ~/tracks
+    # oppure snapshot dell'implementazione corrente su un corpus / audio sintetico
+    python -m scripts.golden_compare seed --corpus ~/tracks
+    python -m scripts.golden_compare seed --synthetic 1
+I dump di .tekkin-debug sono indicizzati per version_id: l'audio va trovato in
+--audio-dir (file <version_id>.*) o con --audio-map (JSON {version_id: path}).
+
+Confronto:
+    python -m scripts.golden_compare run                                  # golden vs current
+    python -m scripts.golden_compare run --baseline ref:HEAD~1 --corpus ~/tracks
+    python -m scripts.golden_compare run --baseline current --candidate current \\
+        --candidate-env TEKKIN_TEMPO_ENGINE=fast --corpus ~/tracks
+    python -m scripts.golden_compare diff a.json b.json
+
+Tolleranze (DEFAULT_RULES, sovrascrivibili con --rules file.json): la prima
+regola il cui pattern (glob sul path puntato, indici di lista esclusi) combacia
+vince. Scalari: ok se |Δ| <= abs oppure |Δ|/|golden| <= rel. Curve (liste di
+numeri, o di dict con campi numerici -> una curva per campo): stessa lunghezza
+e RMSE <= rmse oppure RMSE/range(golden) <= nrmse. Stringhe e bool: uguali.
+Report JSON con --report; uscita 1 se ci sono campi fuori tolleranza.
+"""
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import glob
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_GOLDEN_DIR = os.path.join(REPO_ROOT, ".tekkin-golden")
+DEFAULT_PROFILE_KEY = "minimal_deep_tech"
+AUDIO_EXTS = (".wav", ".aiff", ".aif", ".flac", ".mp3", ".m4a", ".ogg")
+
+# campi confrontati per engine (il resto della risposta API è contorno: waveform, path, id)
+ENGINE_SCOPE = {
+    "v3": ("blocks", "meta.duration_sec", "meta.sr", "meta.samples"),
+    "legacy": (
+        "bpm", "key", "spectral", "stereo_width", "loudness_stats", "confidence",
+        "essentia_features", "band_energy_norm", "analysis_pro", "model_match",
+    ),
+}
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    # misure di costo, non di contenuto
+    {"path": "*took_ms*", "ignore": True},
+    {"path": "*.cpu_ms", "ignore": True},
+    {"path": "*.peak_mem_mb", "ignore": True},
+    {"path": "*.output_bytes", "ignore": True},
+    {"path": "*.output_json_bytes", "ignore": True},
+    # loudness: scalari ±0.05 LU, curve RMSE 0.1 LU
+    {"path": "*lufs*", "kind": "curve", "rmse": 0.1},
+    {"path": "*lufs*", "abs": 0.05},
+    {"path": "*loudness*percentiles.*", "abs": 0.05},
+    {"path": "*.lra", "abs": 0.1},
+    {"path": "*peak_db", "abs": 0.05},
+    # bilanciamento tonale / larghezza per banda: 1% relativo (soglia assoluta per bande quasi vuote)
+    {"path": "*bands_norm.*", "rel": 0.01, "abs": 1e-4},
+    {"path": "*band_energy_norm.*", "rel": 0.01, "abs": 1e-4},
+    {"path": "*width_by_band.*", "rel": 0.01, "abs": 1e-4},
+    # spettro e curve in dB
+    {"path": "*_db", "kind": "curve", "rmse": 0.25},
+    {"path": "*_db", "abs": 0.1},
+    # ritmo
+    {"path": "*bpm", "abs": 0.05},
+    {"path": "*beat_times*", "kind": "curve", "rmse": 0.02},
+    # default
+    {"path": "*", "kind": "curve", "nrmse": 0.01},
+    {"path": "*", "rel": 1e-3, "abs": 1e-6},
+]
+
+
+# ---------------------------------------------------------------------------
+# diff
+# ---------------------------------------------------------------------------
+
+def _is_number(x: Any) -> bool:
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+
+def _numeric_curve(values: List[Any]) -> Optional[np.ndarray]:
+    if values and all(_is_number(v) or v is None for v in values):
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    return None
+
+
+def _dict_curves(values: List[Any]) -> Optional[Dict[str, np.ndarray]]:
+    """Lista di dict con gli stessi campi numerici -> una curva per campo."""
+    if not values or not all(isinstance(v, dict) for v in values):
+        return None
+    keys = sorted(k for k, v in values[0].items() if _is_number(v))
+    if not keys:
+        return None
+    try:
+        return {k: np.array([float(v.get(k)) for v in values], dtype=np.float64) for k in keys}
+    except (TypeError, ValueError):
+        return None
+
+
+def _rule_for(path: str, kind: str, rules: List[Dict[str, Any]]) -> Dict[str, Any]:
+    for rule in rules:
+        if not fnmatch.fnmatchcase(path, rule["path"]):
+            continue
+        if rule.get("ignore"):
+            return rule
+        rule_kind = rule.get("kind", "scalar")
+        if rule_kind == "any" or rule_kind == kind:
+            return rule
+    return {"path": "*", "rel": 0.0, "abs": 0.0}
+
+
+def _cmp_scalar(path: str, a: float, b: float, rule: Dict[str, Any]) -> Dict[str, Any]:
+    if math.isnan(a) and math.isnan(b):
+        return {"path": path, "ok": True, "kind": "scalar", "golden": a, "candidate": b}
+    diff = abs(b - a)
+    rel = diff / abs(a) if a != 0 else (0.0 if diff == 0 else math.inf)
+    ok = (diff <= float(rule.get("abs", 0.0))) or (rel <= float(rule.get("rel", 0.0)))
+    return {"path": path, "ok": bool(ok), "kind": "scalar", "golden": a, "candidate": b, "abs_diff": diff, "rel_diff": rel, "rule": rule["path"]}
+
+
+def _cmp_curve(path: str, a: np.ndarray, b: np.ndarray, rule: Dict[str, Any]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"path": path, "kind": "curve", "len_golden": int(a.size), "len_candidate": int(b.size), "rule": rule["path"]}
+    if a.size != b.size:
+        out.update(ok=False, reason="length mismatch")
+        return out
+    if a.size == 0:
+        out.update(ok=True)
+        return out
+    mask = ~(np.isnan(a) | np.isnan(b))
+    if not np.array_equal(np.isnan(a), np.isnan(b)):
+        out.update(ok=False, reason="null pattern differs")
+        return out
+    if not mask.any():
+        out.update(ok=True)
+        return out
+    d = b[mask] - a[mask]
+    rmse = float(np.sqrt(np.mean(d * d)))
+    span = float(np.max(a[mask]) - np.min(a[mask]))
+    nrmse = rmse / span if span > 0 else (0.0 if rmse == 0 else math.inf)
+    ok = False
+    if "rmse" in rule and rmse <= float(rule["rmse"]):
+        ok = True
+    if "nrmse" in rule and nrmse <= float(rule["nrmse"]):
+        ok = True
+    out.update(ok=ok, rmse=rmse, nrmse=nrmse, max_abs_diff=float(np.max(np.abs(d))))
+    return out
+
+
+def diff_outputs(golden: Any, candidate: Any, rules: List[Dict[str, Any]], path: str = "") -> List[Dict[str, Any]]:
+    """Confronto ricorsivo; una riga per foglia (scalare, stringa, curva)."""
+    rows: List[Dict[str, Any]] = []
+
+    def _ignored(p: str) -> bool:
+        return bool(_rule_for(p, "scalar", rules).get("ignore"))
+
+    if isinstance(golden, dict) and isinstance(candidate, dict):
+        for k in golden:
+            p = f"{path}.{k}" if path else str(k)
+            if _ignored(p):
+                continue
+            if k not in candidate:
+                rows.append({"path": p, "ok": False, "kind": "missing"})
+                continue
+            rows.extend(diff_outputs(golden[k], candidate[k], rules, p))
+        for k in candidate:
+            p = f"{path}.{k}" if path else str(k)
+            if k not in golden and not _ignored(p):
+                rows.append({"path": p, "ok": True, "kind": "added"})
+        return rows
+
+    if isinstance(golden, list) and isinstance(candidate, list):
+        ca, cb = _numeric_curve(golden), _numeric_curve(candidate)
+        if ca is not None and cb is not None:
+            rows.append(_cmp_curve(path, ca, cb, _rule_for(path, "curve", rules)))
+            return rows
+        da, db = _dict_curves(golden), _dict_curves(candidate)
+        if da is not None and db is not None:
+            for k in da:
+                p = f"{path}.{k}"
+                if k not in db:
+                    rows.append({"path": p, "ok": False, "kind": "missing"})
+                else:
+                    rows.append(_cmp_curve(p, da[k], db[k], _rule_for(p, "curve", rules)))
+            return rows
+        if len(golden) != len(candidate):
+            rows.append({"path": path, "ok": False, "kind": "list", "reason": "length mismatch", "len_golden": len(golden), "len_candidate": len(candidate)})
+            return rows
+        for a, b in zip(golden, candidate):
+            rows.extend(diff_outputs(a, b, rules, path))
+        return rows
+
+    if _is_number(golden) and _is_number(candidate):
+        rows.append(_cmp_scalar(path, float(golden), float(candidate), _rule_for(path, "scalar", rules)))
+        return rows
+
+    ok = golden == candidate
+    rows.append({"path": path, "ok": bool(ok), "kind": "exact", "golden": golden, "candidate": candidate})
+    return rows
+
+
+def scoped(output: Dict[str, Any], engine: str) -> Dict[str, Any]:
+    """Solo i campi di contenuto dell'engine (ENGINE_SCOPE)."""
+    out: Dict[str, Any] = {}
+    for key in ENGINE_SCOPE.get(engine, ()):
+        node: Any = output
+        parts = key.split(".")
+        for part in parts:
+            node = node.get(part) if isinstance(node, dict) else None
+        if node is None:
+            continue
+        dst = out
+        for part in parts[:-1]:
+            dst = dst.setdefault(part, {})
+        dst[parts[-1]] = node
+    return out
+
+
+def detect_engine(output: Dict[str, Any]) -> Optional[str]:
+    if output.get("version") == "v3" and isinstance(output.get("blocks"), dict):
+        return "v3"
+    if "loudness_stats" in output or "essentia_features" in output:
+        return "legacy"
+    return None
+
+
+# ---------------------------------------------------------------------------
+# esecuzione di un lato (sottoprocesso)
+# ---------------------------------------------------------------------------
+
+_DUMP_SNIPPET = r'''
+import json, os, sys
+tree, audio, out, engine, decoder, profile_key = sys.argv[1:7]
+sys.path[:0] = [tree, os.path.join(tree, "tools")]
+os.environ.setdefault("TEKKIN_ANALYZER_SECRET", "golden")
+# ogni lato calcola tutto da sé (la chiave della cache PCM non include il decoder)
+os.environ["TEKKIN_PCM_CACHE_MB"] = "0"
+os.environ["TEKKIN_BLOCK_STORE"] = "0"
+import numpy as np
+
+def _default(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, (np.floating, np.integer)):
+        return o.item()
+    return str(o)
+
+if engine == "v3":
+    import tekkin_analyzer_v3.analyze_v3 as v3
+    if decoder == "soundfile":
+        def _load(path, sr, max_seconds=None, ffmpeg_bin="ffmpeg"):
+            import soundfile as sf
+            from scipy.signal import resample_poly
+            x, fs = sf.read(path, dtype="float32", always_2d=True)
+            if fs != sr:
+                x = resample_poly(x, sr, fs, axis=0).astype(np.float32)
+            return x, sr
+        v3.load_audio_ffmpeg = _load
+    res = v3.analyze_v3(audio, profile_key=profile_key)
+else:
+    import soundfile as sf
+    from tekkin_analyzer_core import analyze_track
+    x, sr = sf.read(audio, dtype="float32", always_2d=True)
+    res = analyze_track(project_id="golden", version_id="golden", profile_key=profile_key,
+                        mode="master", sr=int(sr), audio_stereo=np.ascontiguousarray(x.T[:2]))
+with open(out, "w", encoding="utf-8") as f:
+    json.dump(res, f, default=_default)
+'''
+
+
+class Side:
+    def __init__(self, spec: str, env: List[str], tmp_root: str):
+        self.spec = spec
+        self.env = dict(e.split("=", 1) for e in env)
+        self._worktree: Optional[str] = None
+        if spec == "current":
+            self.tree = REPO_ROOT
+        elif spec.startswith("tree:"):
+            self.tree = os.path.abspath(os.path.expanduser(spec[5:]))
+        elif spec.startswith("ref:"):
+            self._worktree = os.path.join(tmp_root, "worktree_" + "".join(c if c.isalnum() else "_" for c in spec[4:]))
+            subprocess.run(["git", "worktree", "add", "--detach", self._worktree, spec[4:]], cwd=REPO_ROOT, check=True, capture_output=True)
+            self.tree = self._worktree
+        elif spec == "golden":
+            self.tree = ""
+        else:
+            raise SystemExit(f"lato non valido: {spec!r} (golden | current | ref:<git-ref> | tree:<path>)")
+
+    @property
+    def label(self) -> str:
+        env = " ".join(f"{k}={v}" for k, v in sorted(self.env.items()))
+        return f"{self.spec} {env}".strip()
+
+    def run(self, audio: str, engine: str, decoder: str, profile_key: str, out_path: str) -> Dict[str, Any]:
+        env = dict(os.environ)
+        env.update(self.env)
+        proc = subprocess.run(
+            [sys.executable, "-c", _DUMP_SNIPPET, self.tree, audio, out_path, engine, decoder, profile_key],
+            cwd=self.tree, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"{self.label}: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'exit ' + str(proc.returncode)}")
+        with open(out_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def close(self) -> None:
+        if self._worktree:
+            subprocess.run(["git", "worktree", "remove", "--force", self._worktree], cwd=REPO_ROOT, capture_output=True)
+
+
+# ---------------------------------------------------------------------------
+# golden store
+# ---------------------------------------------------------------------------
+
+def load_golden(golden_dir: str) -> List[Dict[str, Any]]:
+    entries = []
+    for path in sorted(glob.glob(os.path.join(golden_dir, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        entry["_path"] = path
+        entries.append(entry)
+    return entries
+
+
+def save_golden(golden_dir: str, name: str, audio: str, engine: str, profile_key: str, output: Dict[str, Any], source: str) -> str:
+    os.makedirs(golden_dir, exist_ok=True)
+    path = os.path.join(golden_dir, f"{name}.json")
+    entry = {"name": name, "audio": os.path.abspath(audio), "engine": engine, "profile_key": profile_key, "source": source, "output": scoped(output, engine)}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+    return path
+
+
+def _find_audio(version_id: str, audio_dir: Optional[str], audio_map: Dict[str, str]) -> Optional[str]:
+    if version_id in audio_map and os.path.isfile(audio_map[version_id]):
+        return audio_map[version_id]
+    if audio_dir:
+        for ext in AUDIO_EXTS:
+            cand = os.path.join(audio_dir, version_id + ext)
+            if os.path.isfile(cand):
+                return cand
+    return None
+
+
+def _corpus(paths: Iterable[str]) -> List[str]:
+    files: List[str] = []
+    for p in paths:
+        p = os.path.expanduser(p)
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                files.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(AUDIO_EXTS))
+        elif os.path.isfile(p):
+            files.append(p)
+    return files
+
+
+def _synthetic_corpus(minutes: float, out_dir: str) -> List[str]:
+    import soundfile as sf
+
+    from scripts.synth_audio import KINDS, generate
+
+    os.makedirs(out_dir, exist_ok=True)
+    files = []
+    for kind in KINDS:
+        path = os.path.join(out_dir, f"synth_{kind}_{minutes:g}m.wav")
+        if not os.path.exists(path):
+            sf.write(path, generate(kind, minutes), 44100, subtype="FLOAT")
+        files.append(path)
+    return files
+
+
+def cmd_seed(args: argparse.Namespace) -> None:
+    n = 0
+    if args.debug_dir:
+        audio_map: Dict[str, str] = {}
+        if args.audio_map:
+            with open(args.audio_map, "r", encoding="utf-8") as f:
+                audio_map = json.load(f)
+        for path in sorted(glob.glob(os.path.join(args.debug_dir, "analyze_*.json"))):
+            version_id = os.path.basename(path)[len("analyze_"):-len(".json")]
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    output = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                print(f"[skip] {version_id}: JSON non leggibile")
+                continue
+            engine = detect_engine(output) if isinstance(output, dict) else None
+            if engine is None:
+                print(f"[skip] {version_id}: non è un output di analisi")
+                continue
+            audio = _find_audio(version_id, args.audio_dir, audio_map)
+            if audio is None:
+                print(f"[skip] {version_id}: audio non trovato")
+                continue
+            profile_key = output.get("profile_key") or DEFAULT_PROFILE_KEY
+            save_golden(args.golden_dir, version_id, audio, engine, profile_key, output, f"debug:{os.path.basename(path)}")
+            n += 1
+
+    files = _corpus(args.corpus or [])
+    if args.synthetic:
+        files += _synthetic_corpus(args.synthetic, os.path.join(args.golden_dir, "audio"))
+    if files:
+        with tempfile.TemporaryDirectory(prefix="tekkin_golden_") as tmp:
+            side = Side("current", args.env or [], tmp)
+            for audio in files:
+                name = os.path.splitext(os.path.basename(audio))[0]
+                try:
+                    output = side.run(audio, args.engine, args.decoder, args.profile_key, os.path.join(tmp, "out.json"))
+                except RuntimeError as e:
+                    print(f"[skip] {name}: {e}")
+                    continue
+                save_golden(args.golden_dir, f"{name}.{args.engine}", audio, args.engine, args.profile_key, output, "current")
+                n += 1
+    print(f"{n} golden salvati in {args.golden_dir}")
+
+
+# ---------------------------------------------------------------------------
+# run / report
+# ---------------------------------------------------------------------------
+
+def _summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    failed = [r for r in rows if not r.get("ok")]
+    return {"fields": len(rows), "failed": len(failed), "added": sum(1 for r in rows if r.get("kind") == "added")}
+
+
+def _fmt_row(r: Dict[str, Any]) -> str:
+    if r.get("kind") == "scalar":
+        return f"{r['path']}: {r['golden']:.6g} -> {r['candidate']:.6g} (|Δ| {r['abs_diff']:.3g}, rel {r['rel_diff']:.3g}; regola {r['rule']})"
+    if r.get("kind") == "curve":
+        if r.get("reason"):
+            return f"{r['path']}: {r['reason']} ({r['len_golden']} vs {r['len_candidate']})"
+        return f"{r['path']}: rmse {r['rmse']:.4g}, nrmse {r['nrmse']:.3g}, max {r['max_abs_diff']:.4g} (regola {r['rule']})"
+    if r.get("kind") == "missing":
+        return f"{r['path']}: assente nel candidato"
+    if r.get("kind") == "list":
+        return f"{r['path']}: {r['reason']} ({r['len_golden']} vs {r['len_candidate']})"
+    return f"{r['path']}: {r.get('golden')!r} -> {r.get('candidate')!r}"
+
+
+def cmd_run(args: argparse.Namespace) -> None:
+    rules = DEFAULT_RULES
+    if args.rules:
+        with open(args.rules, "r", encoding="utf-8") as f:
+            rules = json.load(f) + DEFAULT_RULES
+
+    with tempfile.TemporaryDirectory(prefix="tekkin_golden_") as tmp:
+        baseline = Side(args.baseline, args.baseline_env or [], tmp)
+        candidate = Side(args.candidate, args.candidate_env or [], tmp)
+        if candidate.spec == "golden":
+            raise SystemExit("--candidate non può essere golden")
+
+        # casi: (nome, audio, engine, profile_key, output golden o None)
+        cases: List[Tuple[str, str, str, str, Optional[Dict[str, Any]]]] = []
+        if baseline.spec == "golden":
+            for entry in load_golden(args.golden_dir):
+                if args.engine and entry.get("engine") != args.engine:
+                    continue
+                cases.append((entry["name"], entry["audio"], entry["engine"], entry.get("profile_key") or DEFAULT_PROFILE_KEY, entry["output"]))
+        else:
+            files = _corpus(args.corpus or [])
+            if args.synthetic:
+                files += _synthetic_corpus(args.synthetic, os.path.join(tmp, "audio"))
+            for audio in files:
+                cases.append((os.path.splitext(os.path.basename(audio))[0], audio, args.engine or "v3", args.profile_key, None))
+        if not cases:
+            raise SystemExit("nessun caso da confrontare (golden vuoto o corpus assente)")
+
+        print(f"baseline : {baseline.label}")
+        print(f"candidate: {candidate.label}")
+        report: Dict[str, Any] = {"baseline": baseline.label, "candidate": candidate.label, "cases": []}
+        total_failed = 0
+        try:
+            for name, audio, engine, profile_key, golden in cases:
+                case: Dict[str, Any] = {"name": name, "audio": audio, "engine": engine}
+                try:
+                    if not os.path.isfile(audio):
+                        raise RuntimeError(f"audio assente: {audio}")
+                    if golden is None:
+                        golden = scoped(baseline.run(audio, engine, args.decoder, profile_key, os.path.join(tmp, "a.json")), engine)
+                    cand = scoped(candidate.run(audio, engine, args.decoder, profile_key, os.path.join(tmp, "b.json")), engine)
+                except RuntimeError as e:
+                    case["error"] = str(e)
+                    report["cases"].append(case)
+                    total_failed += 1
+                    print(f"\n== {name} [{engine}] ERRORE {e}")
+                    continue
+                rows = diff_outputs(golden, cand, rules)
+                case["summary"] = _summarize(rows)
+                case["failed"] = [r for r in rows if not r.get("ok")]
+                case["rows"] = rows if args.full else None
+                report["cases"].append(case)
+                total_failed += case["summary"]["failed"]
+                s = case["summary"]
+                print(f"\n== {name} [{engine}] campi {s['fields']}, fuori tolleranza {s['failed']}, nuovi {s['added']}")
+                for r in case["failed"][: args.show]:
+                    print("   " + _fmt_row(r))
+                if len(case["failed"]) > args.show:
+                    print(f"   ... altri {len(case['failed']) - args.show}")
+        finally:
+            baseline.close()
+            candidate.close()
+
+    report["failed_total"] = total_failed
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+        print(f"\nreport: {args.report}")
+    print(f"\ncasi: {len(cases)}, campi fuori tolleranza: {total_failed}")
+    sys.exit(1 if total_failed else 0)
+
+
+def cmd_diff(args: argparse.Namespace) -> None:
+    with open(args.golden, "r", encoding="utf-8") as f:
+        a = json.load(f)
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        b = json.load(f)
+    a = a.get("output", a)
+    b = b.get("output", b)
+    engine = args.engine or detect_engine(a) or "v3"
+    rows = diff_outputs(scoped(a, engine) or a, scoped(b, engine) or b, DEFAULT_RULES)
+    failed = [r for r in rows if not r.get("ok")]
+    for r in failed[: args.show]:
+        print(_fmt_row(r))
+    print(f"campi {len(rows)}, fuori tolleranza {len(failed)}")
+    sys.exit(1 if failed else 0)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Equivalenza output golden / engine candidati")
+    ap.add_argument("--golden-dir", default=DEFAULT_GOLDEN_DIR)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    def _common(p: argparse.ArgumentParser) -> None:
+        p.add_argument("--corpus", nargs="*", help="file o cartelle audio")
+        p.add_argument("--synthetic", type=float, default=None, help="aggiunge audio sintetico di N minuti (scripts/synth_audio)")
+        p.add_argument("--decoder", choices=("ffmpeg", "soundfile"), default="ffmpeg", help="decoder per V3 (soundfile se ffmpeg manca)")
+        p.add_argument("--profile-key", default=DEFAULT_PROFILE_KEY)
+
+    p_seed = sub.add_parser("seed", help="crea output golden")
+    _common(p_seed)
+    p_seed.add_argument("--debug-dir", default=None, help="cartella con analyze_<version_id>.json (es. .tekkin-debug)")
+    p_seed.add_argument("--audio-dir", default=None, help="audio come <version_id>.<ext>")
+    p_seed.add_argument("--audio-map", default=None, help="JSON {version_id: path audio}")
+    p_seed.add_argument("--engine", choices=("v3", "legacy"), default="v3", help="engine per gli snapshot da --corpus")
+    p_seed.add_argument("--env", action="append", help="KEY=VAL per lo snapshot")
+
+    p_run = sub.add_parser("run", help="confronta baseline e candidato")
+    _common(p_run)
+    p_run.add_argument("--baseline", default="golden", help="golden | current | ref:<git-ref> | tree:<path>")
+    p_run.add_argument("--candidate", default="current", help="current | ref:<git-ref> | tree:<path>")
+    p_run.add_argument("--baseline-env", action="append", help="KEY=VAL (ripetibile)")
+    p_run.add_argument("--candidate-env", action="append", help="KEY=VAL (ripetibile)")
+    p_run.add_argument("--engine", choices=("v3", "legacy"), default=None)
+    p_run.add_argument("--rules", default=None, help="JSON con regole aggiuntive (hanno precedenza)")
+    p_run.add_argument("--report", default=None, help="report JSON")
+    p_run.add_argument("--full", action="store_true", help="nel report anche i campi in tolleranza")
+    p_run.add_argument("--show", type=int, default=15, help="campi fuori tolleranza stampati per caso")
+
+    p_diff = sub.add_parser("diff", help="confronta due JSON di output")
+    p_diff.add_argument("golden")
+    p_diff.add_argument("candidate")
+    p_diff.add_argument("--engine", choices=("v3", "legacy"), default=None)
+    p_diff.add_argument("--show", type=int, default=30)
+
+    args = ap.parse_args()
+    if args.cmd == "seed":
+        cmd_seed(args)
+    elif args.cmd == "run":
+        cmd_run(args)
+    else:
+        cmd_diff(args)
+
+
+if __name__ == "__main__":
+    main()
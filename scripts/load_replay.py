@@ -0,0 +1,706 @@
+#!/usr/bin/env python3
+"""
+Load test offline di /analyze: rigioca AnalyzeRequest registrate (o ne sintetizza
+a un rate dato) contro un analyzer locale, con un server HTTP di appoggio che
+serve l'audio e imita l'endpoint di upload di Supabase Storage.
+
+Sorgenti delle richieste:
+- --requests log.jsonl   una richiesta per riga: il body di /analyze, oppure
+                         {"at": <sec dall'inizio>, "body": {...}} per rigiocare
+                         anche i tempi (--timing recorded, --speed 2 = il doppio)
+- --from-debug DIR       ricostruite dai dump analyze_<version_id>.json di
+                         .tekkin-debug (version_id, project_id, profile_key, mode)
+- nessuna delle due      --count richieste sintetiche
+audio_url viene sempre sostituito con un file del corpus locale (--audio, o
+--synthetic N minuti da scripts/synth_audio), scelto in modo stabile per
+version_id; audio_sha256 viene tolto (lo stand-in non è l'audio originale).
+
+Server di appoggio (thread nel processo, o da solo con `serve`):
+    GET  /audio/<file>                        file del corpus
+    POST /storage/v1/object/<bucket>/<path>   upload JSON: conta e scarta (--upload-delay-ms)
+    GET  /stats                               contatori
+L'analyzer deve avere SUPABASE_URL=<server di appoggio>: con --spawn lo avvia
+lo script (tekkin_analyzer_server.py) con le env giuste, altrimenti le stampa.
+
+Carico:
+- closed loop (default): --concurrency richieste sempre in volo
+- open loop: --rate R arrivi/s (Poisson, seedato), in volo al massimo --concurrency;
+  la latenza si misura dall'istante previsto (include l'attesa lato client)
+
+Uso:
+    python -m scripts.load_replay run --spawn --workers 2 --synthetic 1 --count 40 --concurrency 4
+    python -m scripts.load_replay run --target http://127.0.0.1:8000 --server-pid 1234 \\
+        --from-debug .tekkin-debug --audio ~/tracks --rate 0.5 --duration 300 --report /tmp/load.json
+    python -m scripts.load_replay serve --audio ~/tracks --port 8766
+
+Report: throughput, latenza p50/p95/p99, errori per status (429 a parte),
+RSS del server (processo + figli) nel tempo, a finestre di --window secondi.
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import httpx
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO_EXTS = (".wav", ".aiff", ".aif", ".flac", ".mp3", ".m4a", ".ogg")
+DEFAULT_PROFILE_KEY = "minimal_deep_tech"
+SERVICE_KEY = "load-replay"
+
+
+# ---------------------------------------------------------------------------
+# server di appoggio (audio + storage)
+# ---------------------------------------------------------------------------
+
+class StandInServer:
+    def __init__(self, files: List[str], host: str = "127.0.0.1", port: int = 0, upload_delay_ms: float = 0.0):
+        self.files = {os.path.basename(p): p for p in files}
+        self.upload_delay_ms = upload_delay_ms
+        self.stats: Dict[str, Any] = {"audio_gets": 0, "audio_bytes": 0, "uploads": 0, "upload_bytes": 0, "not_found": 0}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, fmt: str, *args: Any) -> None:
+                return None
+
+            def _send(self, code: int, body: bytes, ctype: str = "application/json") -> None:
+                self.send_response(code)
+                self.send_header("content-type", ctype)
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                if self.path == "/stats":
+                    with server._lock:
+                        body = json.dumps(server.stats).encode("utf-8")
+                    self._send(200, body)
+                    return
+                if self.path.startswith("/audio/"):
+                    path = server.files.get(unquote(self.path[len("/audio/"):].split("?", 1)[0]))
+                    if path and os.path.isfile(path):
+                        size = os.path.getsize(path)
+                        self.send_response(200)
+                        self.send_header("content-type", "application/octet-stream")
+                        self.send_header("content-length", str(size))
+                        self.end_headers()
+                        with open(path, "rb") as f:
+                            shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+                        with server._lock:
+                            server.stats["audio_gets"] += 1
+                            server.stats["audio_bytes"] += size
+                        return
+                with server._lock:
+                    server.stats["not_found"] += 1
+                self._send(404, b'{"error":"not found"}')
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("content-length") or 0)
+                remaining = length
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                if not self.path.startswith("/storage/v1/object/"):
+                    self._send(404, b'{"error":"not found"}')
+                    return
+                if server.upload_delay_ms > 0:
+                    time.sleep(server.upload_delay_ms / 1000.0)
+                with server._lock:
+                    server.stats["uploads"] += 1
+                    server.stats["upload_bytes"] += length
+                key = self.path[len("/storage/v1/object/"):]
+                self._send(200, json.dumps({"Key": key}).encode("utf-8"))
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def audio_url(self, path: str) -> str:
+        return f"{self.base_url}/audio/{quote(os.path.basename(path))}"
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stand-in", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# ---------------------------------------------------------------------------
+# corpus e richieste
+# ---------------------------------------------------------------------------
+
+def _corpus(paths: List[str]) -> List[str]:
+    files: List[str] = []
+    for p in paths:
+        p = os.path.expanduser(p)
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                files.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(AUDIO_EXTS))
+        elif os.path.isfile(p):
+            files.append(p)
+    return files
+
+
+def _synthetic_corpus(minutes: float, out_dir: str) -> List[str]:
+    import soundfile as sf
+
+    from scripts.synth_audio import KINDS, generate
+
+    files = []
+    for kind in KINDS:
+        path = os.path.join(out_dir, f"synth_{kind}_{minutes:g}m.wav")
+        sf.write(path, generate(kind, minutes), 44100, subtype="FLOAT")
+        files.append(path)
+    return files
+
+
+def load_request_log(path: str) -> List[Tuple[Optional[float], Dict[str, Any]]]:
+    out: List[Tuple[Optional[float], Dict[str, Any]]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(item, dict) and isinstance(item.get("body"), dict):
+                at = item.get("at")
+                out.append((float(at) if at is not None else None, item["body"]))
+            elif isinstance(item, dict):
+                out.append((None, item))
+    return out
+
+
+def requests_from_debug(debug_dir: str) -> List[Dict[str, Any]]:
+    out = []
+    for path in sorted(glob.glob(os.path.join(debug_dir, "analyze_*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                dump = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if not isinstance(dump, dict) or "detail" in dump:
+            continue
+        version_id = dump.get("version_id") or os.path.basename(path)[len("analyze_"):-len(".json")]
+        out.append({
+            "project_id": dump.get("project_id") or "load-replay",
+            "version_id": version_id,
+            "profile_key": dump.get("profile_key") or DEFAULT_PROFILE_KEY,
+            "mode": dump.get("mode") or "master",
+            "upload_arrays_blob": dump.get("version") == "v3",
+            "analyzer_version": "v3" if dump.get("version") == "v3" else None,
+        })
+    return out
+
+
+def synthetic_request(i: int, profile_key: str, rng: random.Random, bulk_share: float) -> Dict[str, Any]:
+    return {
+        "project_id": "load-replay",
+        "version_id": f"load-{i:05d}-{uuid.UUID(int=rng.getrandbits(128)).hex[:8]}",
+        "profile_key": profile_key,
+        "mode": "master",
+        "upload_arrays_blob": True,
+        "analyzer_version": "v3",
+        "priority": "bulk" if rng.random() < bulk_share else "interactive",
+    }
+
+
+def with_stand_in(body: Dict[str, Any], files: List[str], server: StandInServer) -> Dict[str, Any]:
+    body = dict(body)
+    body.pop("audio_sha256", None)
+    key = str(body.get("version_id") or "")
+    body["audio_url"] = server.audio_url(files[zlib.crc32(key.encode("utf-8")) % len(files)])
+    body.setdefault("project_id", "load-replay")
+    body.setdefault("profile_key", DEFAULT_PROFILE_KEY)
+    return body
+
+
+# ---------------------------------------------------------------------------
+# RSS del server (processo + discendenti, da /proc)
+# ---------------------------------------------------------------------------
+
+def _children(pid: int) -> List[int]:
+    kids = []
+    for d in os.listdir("/proc"):
+        if not d.isdigit():
+            continue
+        try:
+            with open(f"/proc/{d}/stat", "r") as f:
+                stat = f.read()
+            if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+                kids.append(int(d))
+        except (OSError, ValueError, IndexError):
+            continue
+    return kids
+
+
+def tree_rss_mb(pid: int) -> Optional[float]:
+    page_mb = os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    total, seen, stack = 0.0, False, [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            with open(f"/proc/{p}/statm", "r") as f:
+                total += int(f.read().split()[1]) * page_mb
+            seen = True
+        except (OSError, ValueError, IndexError):
+            continue
+        stack.extend(_children(p))
+    return total if seen else None
+
+
+class RssSampler:
+    def __init__(self, pid: Optional[int], interval_sec: float):
+        self.pid = pid
+        self.interval = interval_sec
+        self.samples: List[Tuple[float, float]] = []
+        self._stop = threading.Event()
+        self._t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def start(self, t0: float) -> "RssSampler":
+        self._t0 = t0
+        if self.pid:
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            v = tree_rss_mb(self.pid) if self.pid else None
+            if v is not None:
+                self.samples.append((time.perf_counter() - self._t0, v))
+            self._stop.wait(self.interval)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+
+
+# ---------------------------------------------------------------------------
+# carico
+# ---------------------------------------------------------------------------
+
+def _send(client: httpx.Client, target: str, secret: str, body: Dict[str, Any], scheduled: float, t0: float) -> Dict[str, Any]:
+    sent = time.perf_counter()
+    rec: Dict[str, Any] = {
+        "version_id": body.get("version_id"),
+        "priority": body.get("priority", "interactive"),
+        "scheduled_sec": round(scheduled - t0, 3),
+        "sent_sec": round(sent - t0, 3),
+    }
+    try:
+        r = client.post(f"{target.rstrip('/')}/analyze", json=body, headers={"x-analyzer-secret": secret})
+        rec["status"] = r.status_code
+        rec["bytes"] = len(r.content)
+        if r.status_code >= 400:
+            rec["error"] = r.text[:200]
+    except httpx.HTTPError as e:
+        rec["status"] = 0
+        rec["error"] = f"{type(e).__name__}: {e}"
+    done = time.perf_counter()
+    rec["done_sec"] = round(done - t0, 3)
+    rec["latency_ms"] = round((done - scheduled) * 1000.0, 1)
+    rec["service_ms"] = round((done - sent) * 1000.0, 1)
+    return rec
+
+
+def run_load(
+    target: str,
+    secret: str,
+    bodies: List[Dict[str, Any]],
+    *,
+    concurrency: int,
+    rate: Optional[float],
+    offsets: Optional[List[float]],
+    duration: Optional[float],
+    seed: int,
+    timeout: float,
+) -> Tuple[List[Dict[str, Any]], float, float]:
+    """Ritorna (record per richiesta, t0, durata del run)."""
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+    client = httpx.Client(timeout=timeout, limits=httpx.Limits(max_connections=concurrency + 4))
+    t0 = time.perf_counter()
+    deadline = t0 + duration if duration else None
+
+    def _record(rec: Dict[str, Any]) -> None:
+        with lock:
+            results.append(rec)
+        done = len(results)
+        if done % max(1, len(bodies) // 10) == 0:
+            print(f"  {done}/{len(bodies)} completate ({time.perf_counter() - t0:.0f}s)")
+
+    try:
+        if rate is None and offsets is None:
+            # closed loop: ogni worker prende la prossima richiesta appena finisce
+            it = iter(bodies)
+            it_lock = threading.Lock()
+
+            def _worker() -> None:
+                while True:
+                    if deadline and time.perf_counter() >= deadline:
+                        return
+                    with it_lock:
+                        body = next(it, None)
+                    if body is None:
+                        return
+                    now = time.perf_counter()
+                    _record(_send(client, target, secret, body, now, t0))
+
+            threads = [threading.Thread(target=_worker, daemon=True) for _ in range(concurrency)]
+            for th in threads:
+                th.start()
+            for th in threads:
+                th.join()
+        else:
+            # open loop: arrivi a istanti prefissati, in volo al massimo `concurrency`
+            if offsets is None:
+                rnd = np.random.default_rng(seed)
+                offsets = list(np.cumsum(rnd.exponential(1.0 / float(rate), size=len(bodies))))
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for body, off in zip(bodies, offsets):
+                    scheduled = t0 + float(off)
+                    if deadline and scheduled >= deadline:
+                        break
+                    wait = scheduled - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                    pool.submit(lambda b=body, s=scheduled: _record(_send(client, target, secret, b, s, t0)))
+    finally:
+        client.close()
+    return results, t0, time.perf_counter() - t0
+
+
+# ---------------------------------------------------------------------------
+# report
+# ---------------------------------------------------------------------------
+
+def _pct(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    a = np.asarray(values, dtype=np.float64)
+    return {
+        "p50": round(float(np.percentile(a, 50)), 1),
+        "p95": round(float(np.percentile(a, 95)), 1),
+        "p99": round(float(np.percentile(a, 99)), 1),
+        "max": round(float(a.max()), 1),
+        "mean": round(float(a.mean()), 1),
+    }
+
+
+def build_report(results: List[Dict[str, Any]], elapsed: float, rss: List[Tuple[float, float]], window: float) -> Dict[str, Any]:
+    ok = [r for r in results if 200 <= int(r["status"]) < 300]
+    status: Dict[str, int] = {}
+    for r in results:
+        status[str(r["status"])] = status.get(str(r["status"]), 0) + 1
+    n = len(results) or 1
+
+    by_lane: Dict[str, Any] = {}
+    for lane in sorted({str(r["priority"]) for r in results}):
+        lane_ok = [r["latency_ms"] for r in ok if r["priority"] == lane]
+        by_lane[lane] = {"requests": sum(1 for r in results if r["priority"] == lane), "ok": len(lane_ok), "latency_ms": _pct(lane_ok)}
+
+    timeline = []
+    if results:
+        end = max(r["done_sec"] for r in results)
+        w = 0.0
+        while w < end + 1e-9:
+            in_w = [r for r in results if w <= r["done_sec"] < w + window]
+            rss_w = [v for t, v in rss if w <= t < w + window]
+            timeline.append({
+                "t_sec": round(w, 1),
+                "completed": len(in_w),
+                "ok": sum(1 for r in in_w if 200 <= int(r["status"]) < 300),
+                "errors": sum(1 for r in in_w if not 200 <= int(r["status"]) < 300),
+                "p95_ms": _pct([r["latency_ms"] for r in in_w])["p95"],
+                "rss_max_mb": round(max(rss_w), 1) if rss_w else None,
+            })
+            w += window
+
+    error_samples: List[str] = []
+    for r in results:
+        msg = f"{r['status']}: {r.get('error')}" if r.get("error") else None
+        if msg and msg not in error_samples and len(error_samples) < 5:
+            error_samples.append(msg)
+
+    rss_values = [v for _, v in rss]
+    return {
+        "requests": len(results),
+        "elapsed_sec": round(elapsed, 2),
+        "throughput_rps": round(len(results) / elapsed, 3) if elapsed > 0 else None,
+        "ok_rps": round(len(ok) / elapsed, 3) if elapsed > 0 else None,
+        "status_codes": status,
+        "error_rate": round(1.0 - len(ok) / n, 4),
+        "rejected_429_rate": round(status.get("429", 0) / n, 4),
+        "latency_ms": _pct([r["latency_ms"] for r in ok]),
+        "service_ms": _pct([r["service_ms"] for r in ok]),
+        "lanes": by_lane,
+        "error_samples": error_samples,
+        "rss_mb": {
+            "start": round(rss_values[0], 1) if rss_values else None,
+            "end": round(rss_values[-1], 1) if rss_values else None,
+            "max": round(max(rss_values), 1) if rss_values else None,
+            "mean": round(float(np.mean(rss_values)), 1) if rss_values else None,
+        },
+        "timeline": timeline,
+    }
+
+
+def print_report(rep: Dict[str, Any]) -> None:
+    lat, svc, rss = rep["latency_ms"], rep["service_ms"], rep["rss_mb"]
+    print("")
+    print(f"richieste {rep['requests']} in {rep['elapsed_sec']}s: {rep['throughput_rps']} req/s ({rep['ok_rps']} ok/s)")
+    print(f"status {rep['status_codes']}  errori {rep['error_rate'] * 100:.1f}%  429 {rep['rejected_429_rate'] * 100:.1f}%")
+    print(f"latenza ok (ms)  p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    print(f"servizio (ms)    p50 {svc['p50']}  p95 {svc['p95']}  p99 {svc['p99']}")
+    for lane, st in rep["lanes"].items():
+        print(f"  {lane:<12} {st['ok']}/{st['requests']} ok  p50 {st['latency_ms']['p50']}  p95 {st['latency_ms']['p95']}")
+    for msg in rep["error_samples"]:
+        print(f"  errore {msg}")
+    if rss["max"] is not None:
+        print(f"RSS server (MB)  start {rss['start']}  max {rss['max']}  end {rss['end']}")
+    print("")
+    print(f"{'t':>7} {'done':>5} {'ok':>5} {'err':>5} {'p95 ms':>9} {'RSS MB':>8}")
+    for w in rep["timeline"]:
+        p95 = f"{w['p95_ms']:.0f}" if w["p95_ms"] is not None else "-"
+        r = f"{w['rss_max_mb']:.0f}" if w["rss_max_mb"] is not None else "-"
+        print(f"{w['t_sec']:>6.0f}s {w['completed']:>5} {w['ok']:>5} {w['errors']:>5} {p95:>9} {r:>8}")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def _spawn_analyzer(port: int, workers: int, stand_in: StandInServer, secret: str, extra_env: List[str], log_path: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "SUPABASE_URL": stand_in.base_url,
+        "SUPABASE_SERVICE_ROLE_KEY": SERVICE_KEY,
+        "TEKKIN_ANALYZER_SECRET": secret,
+        "TEKKIN_WORKERS": str(workers),
+    })
+    env.update(dict(e.split("=", 1) for e in extra_env))
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "tekkin_analyzer_server.py"), "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+    )
+
+
+def _wait_ready(target: str, proc: Optional[subprocess.Popen], timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f"analyzer uscito con codice {proc.returncode}")
+        try:
+            if httpx.get(f"{target.rstrip('/')}/readyz", timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"analyzer non pronto dopo {timeout:.0f}s: {target}")
+
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return int(s.getsockname()[1])
+
+
+def cmd_run(args: argparse.Namespace) -> None:
+    tmp = tempfile.mkdtemp(prefix="tekkin_load_")
+    files = _corpus(args.audio or [])
+    if args.synthetic:
+        files += _synthetic_corpus(args.synthetic, tmp)
+    if not files:
+        raise SystemExit("nessun audio: usa --audio e/o --synthetic")
+
+    offsets: Optional[List[float]] = None
+    if args.requests:
+        log = load_request_log(args.requests)
+        bodies = [b for _, b in log]
+        if args.timing == "recorded":
+            if any(at is None for at, _ in log):
+                raise SystemExit("--timing recorded richiede righe con \"at\"")
+            first = min(at for at, _ in log)
+            offsets = [(at - first) / args.speed for at, _ in log]
+    elif args.from_debug:
+        bodies = requests_from_debug(args.from_debug)
+    else:
+        rng = random.Random(args.seed)
+        bodies = [synthetic_request(i, args.profile_key, rng, args.bulk_share) for i in range(args.count or 20)]
+    if not bodies:
+        raise SystemExit("nessuna richiesta da inviare")
+    if args.count and (args.requests or args.from_debug):
+        if args.count <= len(bodies):
+            bodies = bodies[: args.count]
+        elif offsets is None:
+            # ripete il log fino a --count richieste (version_id distinti)
+            bodies = [dict(bodies[i % len(bodies)], version_id=f"{bodies[i % len(bodies)].get('version_id')}-{i}") for i in range(args.count)]
+        if offsets is not None:
+            offsets = offsets[: len(bodies)]
+
+    stand_in = StandInServer(files, port=args.stub_port, upload_delay_ms=args.upload_delay_ms).start()
+    bodies = [with_stand_in(b, files, stand_in) for b in bodies]
+
+    proc: Optional[subprocess.Popen] = None
+    target, pid = args.target, args.server_pid
+    if args.spawn:
+        port = _free_port()
+        target = f"http://127.0.0.1:{port}"
+        log_path = os.path.join(tmp, "analyzer.log")
+        proc = _spawn_analyzer(port, args.workers, stand_in, args.secret, args.server_env or [], log_path)
+        pid = proc.pid
+        print(f"analyzer avviato (pid {pid}, {args.workers} worker), log: {log_path}")
+    elif not target:
+        raise SystemExit("serve --target URL oppure --spawn")
+    else:
+        print(f"l'analyzer deve avere SUPABASE_URL={stand_in.base_url} SUPABASE_SERVICE_ROLE_KEY={SERVICE_KEY}")
+
+    try:
+        _wait_ready(target, proc, args.ready_timeout)
+        mode = f"open loop {args.rate}/s" if args.rate else ("timing registrato" if offsets is not None else "closed loop")
+        print(f"{len(bodies)} richieste su {len(files)} file audio, {mode}, concorrenza {args.concurrency} -> {target}")
+        sampler = RssSampler(pid, args.rss_interval)
+        t_start = time.perf_counter()
+        sampler.start(t_start)
+        results, _, elapsed = run_load(
+            target, args.secret, bodies,
+            concurrency=args.concurrency, rate=args.rate, offsets=offsets,
+            duration=args.duration, seed=args.seed, timeout=args.timeout,
+        )
+        sampler.stop()
+    finally:
+        if proc is not None:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+                proc.wait(timeout=30)
+            except (OSError, subprocess.TimeoutExpired):
+                os.killpg(proc.pid, signal.SIGKILL)
+        stand_in.stop()
+
+    rep = build_report(results, elapsed, sampler.samples, args.window)
+    rep["stand_in"] = dict(stand_in.stats)
+    rep["config"] = {
+        "target": target, "concurrency": args.concurrency, "rate": args.rate,
+        "requests_planned": len(bodies), "audio_files": len(files), "workers": args.workers if args.spawn else None,
+    }
+    print_report(rep)
+    print(f"\nstand-in: {rep['stand_in']}")
+    if args.report:
+        rep["results"] = results
+        rep["rss_samples"] = [[round(t, 2), round(v, 1)] for t, v in sampler.samples]
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(rep, f, indent=2)
+        print(f"report: {args.report}")
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def cmd_serve(args: argparse.Namespace) -> None:
+    tmp = tempfile.mkdtemp(prefix="tekkin_load_")
+    files = _corpus(args.audio or [])
+    if args.synthetic:
+        files += _synthetic_corpus(args.synthetic, tmp)
+    server = StandInServer(files, host=args.host, port=args.port, upload_delay_ms=args.upload_delay_ms)
+    print(f"stand-in su {server.base_url} ({len(files)} file)")
+    for p in files:
+        print(f"  {server.audio_url(p)}")
+    print(f"analyzer: SUPABASE_URL={server.base_url} SUPABASE_SERVICE_ROLE_KEY={SERVICE_KEY}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Replay / load test offline di /analyze")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    def _audio(p: argparse.ArgumentParser) -> None:
+        p.add_argument("--audio", nargs="*", help="file o cartelle audio usati come stand-in")
+        p.add_argument("--synthetic", type=float, default=None, help="aggiunge audio sintetico di N minuti")
+        p.add_argument("--upload-delay-ms", type=float, default=0.0, help="latenza simulata dell'upload su storage")
+
+    p_run = sub.add_parser("run", help="genera carico")
+    _audio(p_run)
+    p_run.add_argument("--target", default=None, help="URL dell'analyzer (es. http://127.0.0.1:8000)")
+    p_run.add_argument("--spawn", action="store_true", help="avvia tekkin_analyzer_server.py in locale")
+    p_run.add_argument("--workers", type=int, default=1, help="worker con --spawn")
+    p_run.add_argument("--server-env", action="append", help="KEY=VAL per l'analyzer avviato con --spawn")
+    p_run.add_argument("--server-pid", type=int, default=None, help="pid dell'analyzer per l'RSS (senza --spawn)")
+    p_run.add_argument("--secret", default=os.environ.get("TEKKIN_ANALYZER_SECRET", "load-replay"))
+    p_run.add_argument("--requests", default=None, help="log JSONL di AnalyzeRequest")
+    p_run.add_argument("--from-debug", default=None, help="cartella con i dump analyze_*.json")
+    p_run.add_argument("--timing", choices=("none", "recorded"), default="none", help="rispetta i tempi \"at\" del log")
+    p_run.add_argument("--speed", type=float, default=1.0, help="fattore di accelerazione con --timing recorded")
+    p_run.add_argument("--count", type=int, default=None, help="richieste sintetiche (default 20), o log ripetuto/troncato")
+    p_run.add_argument("--profile-key", default=DEFAULT_PROFILE_KEY)
+    p_run.add_argument("--bulk-share", type=float, default=0.0, help="quota di richieste sintetiche in lane bulk")
+    p_run.add_argument("--concurrency", type=int, default=2)
+    p_run.add_argument("--rate", type=float, default=None, help="open loop: arrivi al secondo")
+    p_run.add_argument("--duration", type=float, default=None, help="stop dopo N secondi")
+    p_run.add_argument("--timeout", type=float, default=600.0, help="timeout per richiesta (s)")
+    p_run.add_argument("--ready-timeout", type=float, default=180.0)
+    p_run.add_argument("--rss-interval", type=float, default=1.0)
+    p_run.add_argument("--window", type=float, default=10.0, help="finestra della timeline (s)")
+    p_run.add_argument("--stub-port", type=int, default=0, help="porta del server di appoggio (0 = libera)")
+    p_run.add_argument("--seed", type=int, default=0)
+    p_run.add_argument("--report", default=None, help="report JSON (con i record per richiesta)")
+
+    p_serve = sub.add_parser("serve", help="solo il server di appoggio")
+    _audio(p_serve)
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8766)
+
+    args = ap.parse_args()
+    if args.cmd == "run":
+        if args.requests and args.from_debug:
+            raise SystemExit("--requests e --from-debug sono alternativi")
+        if args.timing == "recorded" and not args.requests:
+            raise SystemExit("--timing recorded richiede --requests")
+        cmd_run(args)
+    else:
+        cmd_serve(args)
+
+
+if __name__ == "__main__":
+    main()
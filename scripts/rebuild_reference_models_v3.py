@@ -837,6 +837,7 @@ def main() -> int:
     ap.add_argument("--max-tracks", type=int, default=0, help="Limit tracks per genre (0 = all).")
     ap.add_argument("--overwrite", action="store_true", help="Overwrite existing genre json.")
     ap.add_argument("--dry-run", action="store_true", help="Do not write files, only print summary.")
+    ap.add_argument("--index-dir", default=None, help="Also upsert each reference into the track index (tekkin_analyzer_v3.track_index).")
     args = ap.parse_args()
 
     repo = Path(args.repo).resolve()
@@ -859,6 +860,15 @@ def main() -> int:
     if not args.dry_run:
         out_root.mkdir(parents=True, exist_ok=True)
 
+    track_index = None
+    embedding_from_v3 = None
+    if args.index_dir and not args.dry_run:
+        if str(repo) not in sys.path:
+            sys.path.insert(0, str(repo))
+        from tekkin_analyzer_v3.track_index import TrackIndex, embedding_from_v3
+
+        track_index = TrackIndex(str((repo / args.index_dir).resolve()))
+
     built_genres_meta: List[Dict[str, Any]] = []
     built_at = utc_now_iso()
 
@@ -897,6 +907,10 @@ def main() -> int:
                 )
                 extract_metrics_v3(res, agg)
                 agg.ok_files.append(rel)
+                if track_index is not None and embedding_from_v3 is not None:
+                    emb = embedding_from_v3(res)
+                    if emb is not None:
+                        track_index.upsert(f"ref:{g}:{rel}", emb, {"source": "reference", "profile_key": g, "file": rel})
                 print(f"  [OK] {i}/{len(files)} {rel}")
             except Exception as e:
                 agg.failed_files.append({"file": rel, "error": str(e)})
@@ -919,6 +933,10 @@ def main() -> int:
             }
         )
 
+    if track_index is not None:
+        track_index.save()
+        print(f"[WRITE] track index {args.index_dir} ({len(track_index)} tracks)")
+
     index = {
         "analyzer_version": "v3",
         "built_at": built_at,
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Generatore deterministico di audio sintetico per benchmark e confronti.
+
+Ogni caso è (kind, minuti, sr): stessi parametri -> stessi campioni, bit per
+bit, su qualunque macchina (RNG seedato per caso, niente dipendenze dal tempo).
+
+Tipi:
+- sweep:   sweep sinusoidale logaritmico 20 Hz - 20 kHz ogni 30 s, campo mono
+- pink:    rumore rosa, canali decorrelati (campo largo)
+- kickhat: kick in 4/4 + hi-hat in levare + basso a BPM noto, campo stretto
+- wide:    kickhat + pad con canali in opposizione di fase parziale (side forte)
+- clipped: kickhat spinto di +12 dB e clippato a 0 dBFS
+
+Uso:
+    python -m scripts.synth_audio kickhat 1 --out /tmp/kickhat_1m.wav
+"""
+from __future__ import annotations
+
+import argparse
+import zlib
+from typing import Dict, Tuple
+
+import numpy as np
+
+KINDS = ("sweep", "pink", "kickhat", "wide", "clipped")
+DEFAULT_SR = 44100
+# BPM noti per i tipi ritmici (verità per i confronti di tempo)
+KIND_BPM: Dict[str, float] = {"kickhat": 124.0, "wide": 128.0, "clipped": 126.0}
+
+# rumore rosa: filtro 3 poli / 3 zeri (approssimazione -3 dB/ottava, errore < 0.05 dB)
+_PINK_B = np.array([0.049922035, -0.095993537, 0.050612699, -0.004408786])
+_PINK_A = np.array([1.0, -2.494956002, 2.017265875, -0.522189400])
+
+
+def _rng(kind: str, salt: str = "") -> np.random.Generator:
+    return np.random.default_rng(zlib.crc32(f"{kind}:{salt}".encode("utf-8")))
+
+
+def _pink(n: int, rng: np.random.Generator) -> np.ndarray:
+    from scipy.signal import lfilter
+
+    white = rng.standard_normal(n)
+    pink = lfilter(_PINK_B, _PINK_A, white)
+    return pink / (np.max(np.abs(pink)) + 1e-12)
+
+
+def _sweep_period(sr: int, seconds: float = 30.0) -> np.ndarray:
+    t = np.arange(int(sr * seconds)) / sr
+    f0, f1 = 20.0, min(20000.0, 0.45 * sr)
+    k = np.log(f1 / f0)
+    phase = 2 * np.pi * f0 * seconds / k * (np.exp(t / seconds * k) - 1.0)
+    return 0.5 * np.sin(phase)
+
+
+def _bar(sr: int, bpm: float, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Una battuta (4 beat): kick, hat, basso."""
+    beat_len = int(round(sr * 60.0 / bpm))
+    n = beat_len * 4
+    t = np.arange(beat_len) / sr
+
+    # kick: pitch 145 -> 45 Hz (fase = integrale della frequenza), decadimento esponenziale
+    kick_one = np.sin(2 * np.pi * (45.0 * t + 100.0 / 35.0 * (1 - np.exp(-t * 35.0)))) * np.exp(-t * 9.0)
+    hat_len = int(0.04 * sr)
+    hat_one = rng.standard_normal(hat_len) * np.exp(-np.arange(hat_len) / sr * 120.0)
+    hat_one = np.diff(hat_one, prepend=0.0)  # passa-alto grezzo
+
+    kick = np.zeros(n)
+    hat = np.zeros(n)
+    for b in range(4):
+        s = b * beat_len
+        kick[s : s + beat_len] += kick_one
+        h = s + beat_len // 2
+        hat[h : h + hat_len] += hat_one[: max(0, min(hat_len, n - h))]
+
+    tb = np.arange(n) / sr
+    notes = np.repeat([55.0, 55.0, 65.4, 49.0], beat_len)[:n]
+    bass = 0.25 * np.sin(2 * np.pi * np.cumsum(notes) / sr) * (0.6 + 0.4 * np.cos(2 * np.pi * tb * bpm / 60.0))
+    return kick, hat, bass
+
+
+def _tile(x: np.ndarray, n: int) -> np.ndarray:
+    reps = int(np.ceil(n / max(1, x.shape[0])))
+    return np.tile(x, (reps,) + (1,) * (x.ndim - 1))[:n]
+
+
+def generate(kind: str, minutes: float, sr: int = DEFAULT_SR) -> np.ndarray:
+    """Audio stereo float32 (n, 2) deterministico."""
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    n = int(round(minutes * 60.0 * sr))
+    rng = _rng(kind, f"{minutes}:{sr}")
+
+    if kind == "sweep":
+        mono = _tile(_sweep_period(sr), n)
+        out = np.stack([mono, mono], axis=1)
+    elif kind == "pink":
+        left = _pink(n, rng)
+        right = _pink(n, rng)
+        out = 0.35 * np.stack([left, right], axis=1)
+    else:
+        bpm = KIND_BPM[kind]
+        kick, hat, bass = _bar(sr, bpm, rng)
+        bar = 0.6 * kick + 0.12 * hat + bass
+        mono = _tile(bar, n)
+        # un po' di rumore non periodico, per non avere segnale perfettamente ciclico
+        noise = 0.01 * rng.standard_normal(n)
+        out = np.stack([mono + noise, mono + np.roll(noise, 7)], axis=1)
+        if kind == "wide":
+            t = np.arange(n) / sr
+            pad = 0.12 * (np.sin(2 * np.pi * 220.0 * t) + np.sin(2 * np.pi * 329.6 * t + 0.5))
+            side = 0.15 * _pink(n, rng)
+            out[:, 0] += pad + side
+            out[:, 1] += 0.3 * pad - side
+        elif kind == "clipped":
+            out = np.clip(out * 10 ** (12.0 / 20.0), -1.0, 1.0)
+
+    peak = float(np.max(np.abs(out))) if out.size else 0.0
+    if kind != "clipped" and peak > 0.98:
+        out *= 0.98 / peak
+    return np.ascontiguousarray(out, dtype=np.float32)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Audio sintetico deterministico")
+    ap.add_argument("kind", choices=KINDS)
+    ap.add_argument("minutes", type=float)
+    ap.add_argument("--sr", type=int, default=DEFAULT_SR)
+    ap.add_argument("--out", required=True, help="file WAV di output")
+    args = ap.parse_args()
+
+    import soundfile as sf
+
+    audio = generate(args.kind, args.minutes, args.sr)
+    sf.write(args.out, audio, args.sr, subtype="FLOAT")
+    print(f"{args.out}: {audio.shape[0] / args.sr:.1f} s, {args.kind}, bpm={KIND_BPM.get(args.kind)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Report accuratezza/velocità degli engine di tempo (fast vs accurate).
+
+Confronta i BPM stimati con quelli salvati in reference_db.json per le tracce
+il cui audio è presente (audio_path da reference_manifest.json), oppure con
+tracce sintetiche a BPM noto (--synthetic N) quando l'audio non c'è.
+
+Uso (dalla root del repo):
+    python -m scripts.tempo_accuracy_report
+    python -m scripts.tempo_accuracy_report --synthetic 20 --json /tmp/tempo.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tekkin_analyzer_v3.utils.tempo import DEFAULT_BPM_RANGE, ENGINES, AudioPyramid, estimate_tempo
+
+# rapporti considerati errori di ottava/metrici (stima / riferimento)
+OCTAVE_RATIOS = (0.5, 2.0, 2.0 / 3.0, 1.5, 1.0 / 3.0, 3.0)
+OCTAVE_TOL = 0.02
+
+
+def load_reference_tracks(db_path: str, manifest_path: str, audio_root: str) -> List[Dict[str, Any]]:
+    """Tracce con BPM salvato e file audio esistente."""
+    with open(db_path, "r", encoding="utf-8") as f:
+        db = json.load(f)
+    paths: Dict[str, str] = {}
+    if manifest_path and os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        for t in manifest.get("tracks", []):
+            if t.get("id") and t.get("audio_path"):
+                paths[str(t["id"])] = os.path.join(audio_root, t["audio_path"])
+
+    out: List[Dict[str, Any]] = []
+    for genre, g in (db.get("genres") or {}).items():
+        for t in g.get("tracks", []):
+            bpm = t.get("bpm") or (t.get("features") or {}).get("bpm")
+            path = paths.get(str(t.get("id")))
+            if not bpm or not path:
+                continue
+            out.append({"id": t.get("id"), "genre": genre, "bpm": float(bpm), "path": path})
+    return out
+
+
+def load_mono(path: str) -> Tuple[np.ndarray, int]:
+    import soundfile as sf
+
+    data, sr = sf.read(path, dtype="float32", always_2d=True)
+    return np.ascontiguousarray(data.mean(axis=1), dtype=np.float32), int(sr)
+
+
+def synthetic_track(bpm: float, sr: int, seconds: float, rng: np.random.Generator) -> np.ndarray:
+    """Kick in 4/4 + hat in levare + basso sull'offbeat + rumore."""
+    t = np.arange(int(sr * seconds)) / sr
+    beat = (t * bpm / 60.0) % 1.0
+    x = 0.6 * np.sin(2 * np.pi * (50 + 100 * np.exp(-beat * 30)) * beat) * np.exp(-beat * 8)
+    if rng.random() < 0.5:
+        hat = (t * bpm / 30.0 + 0.5) % 1.0
+        x += 0.15 * rng.standard_normal(t.size) * np.exp(-hat * 60)
+    off = (beat + 0.5) % 1.0
+    x += 0.2 * np.sin(2 * np.pi * 55 * t) * np.exp(-off * 6)
+    x += 0.02 * rng.standard_normal(t.size)
+    return x.astype(np.float32)
+
+
+def octave_error(est: float, ref: float) -> bool:
+    ratio = est / ref
+    return any(abs(ratio / r - 1.0) <= OCTAVE_TOL for r in OCTAVE_RATIOS)
+
+
+def summarize(rows: Sequence[Dict[str, Any]], engine: str) -> Dict[str, Any]:
+    errs = [abs(r[engine]["bpm"] - r["bpm"]) for r in rows if r[engine]["bpm"] is not None]
+    octave = sum(1 for r in rows if r[engine]["bpm"] and abs(r[engine]["bpm"] - r["bpm"]) > 1.0 and octave_error(r[engine]["bpm"], r["bpm"]))
+    n = len(rows)
+    e = np.asarray(errs, dtype=np.float64)
+    return {
+        "tracks": n,
+        "estimated": int(e.size),
+        "abs_err_mean": float(e.mean()) if e.size else None,
+        "abs_err_median": float(np.median(e)) if e.size else None,
+        "within_0_5": float(np.mean(e <= 0.5)) if e.size else None,
+        "within_1_0": float(np.mean(e <= 1.0)) if e.size else None,
+        "octave_errors": int(octave),
+        "seconds_total": float(sum(r[engine]["took_ms"] for r in rows) / 1000.0),
+    }
+
+
+def _fmt(v: Optional[float], pct: bool = False) -> str:
+    if v is None:
+        return "-"
+    return f"{v * 100:.1f}%" if pct else f"{v:.2f}"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Accuratezza vs velocità degli engine di tempo")
+    ap.add_argument("--db", default="reference_db.json")
+    ap.add_argument("--manifest", default="reference_manifest.json")
+    ap.add_argument("--audio-root", default=".")
+    ap.add_argument("--engines", default=",".join(ENGINES), help="lista separata da virgole")
+    ap.add_argument("--bpm-range", default=None, help="min,max per l'engine fast (default env/90,180)")
+    ap.add_argument("--synthetic", type=int, default=0, help="N tracce sintetiche a BPM noto")
+    ap.add_argument("--seconds", type=float, default=60.0, help="durata tracce sintetiche")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", default=None, help="salva righe e riepilogo in JSON")
+    args = ap.parse_args()
+
+    engines = [e.strip() for e in args.engines.split(",") if e.strip() in ENGINES]
+    bpm_range = DEFAULT_BPM_RANGE
+    if args.bpm_range:
+        lo, hi = (float(v) for v in args.bpm_range.split(",", 1))
+        bpm_range = (lo, hi)
+
+    items: List[Dict[str, Any]] = []
+    if args.synthetic > 0:
+        rng = np.random.default_rng(args.seed)
+        lo, hi = bpm_range
+        for i in range(args.synthetic):
+            bpm = round(float(rng.uniform(max(lo, 95.0), min(hi, 175.0))), 1)
+            items.append({"id": f"synth_{i:03d}", "genre": "synthetic", "bpm": bpm, "rng": rng})
+    else:
+        items = [t for t in load_reference_tracks(args.db, args.manifest, args.audio_root) if os.path.exists(t["path"])]
+        if not items:
+            print("Nessuna traccia di riferimento con audio e BPM disponibile (prova --synthetic N).")
+            return
+
+    rows: List[Dict[str, Any]] = []
+    for item in items:
+        if "rng" in item:
+            sr = 44100
+            mono = synthetic_track(item["bpm"], sr, args.seconds, item.pop("rng"))
+        else:
+            mono, sr = load_mono(item["path"])
+        pyramid = AudioPyramid(mono, sr)
+        row = dict(item)
+        for engine in engines:
+            r = estimate_tempo(mono, sr, engine=engine, bpm_range=bpm_range, pyramid=pyramid)
+            row[engine] = {"bpm": r["bpm"], "confidence_unit": r["confidence_unit"], "took_ms": r["took_ms"]}
+        rows.append(row)
+        line = "  ".join(f"{e}={_fmt(row[e]['bpm'])} ({row[e]['took_ms']} ms)" for e in engines)
+        print(f"{row['id']:<14} ref={row['bpm']:.2f}  {line}")
+
+    print("")
+    print(f"{'engine':<10} {'n':>4} {'err med':>8} {'err mean':>9} {'<=0.5':>7} {'<=1.0':>7} {'ottave':>7} {'tempo s':>8}")
+    summary = {e: summarize(rows, e) for e in engines}
+    for e, s in summary.items():
+        print(
+            f"{e:<10} {s['tracks']:>4} {_fmt(s['abs_err_median']):>8} {_fmt(s['abs_err_mean']):>9} "
+            f"{_fmt(s['within_0_5'], True):>7} {_fmt(s['within_1_0'], True):>7} {s['octave_errors']:>7} {s['seconds_total']:>8.2f}"
+        )
+    if "fast" in summary and "accurate" in summary and summary["fast"]["seconds_total"] > 0:
+        print(f"speed-up fast/accurate: x{summary['accurate']['seconds_total'] / summary['fast']['seconds_total']:.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"bpm_range": list(bpm_range), "summary": summary, "rows": rows}, f, indent=2)
+        print(f"JSON: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Aggrega le trace JSONL (tekkin_analyzer_v3/utils/tracing.py) in percentili di
+latenza per stage.
+
+Raccolta: avvia l'API con TEKKIN_TRACE_EXPORTER=jsonl (file in
+TEKKIN_TRACE_FILE), lancia il load test, poi:
+    python -m scripts.trace_stats /tmp/tekkin_traces.jsonl
+    python -m scripts.trace_stats /tmp/tekkin_traces.jsonl --since 2026-01-01T10:00 --json
+
+Le righe sono raggruppate per nome di span (analyze, download, decode,
+block.loudness, ...); la colonna "share" è la quota del tempo totale delle
+trace radice.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+def read_spans(paths: Iterable[str], since: Optional[float] = None) -> List[Dict[str, Any]]:
+    spans: List[Dict[str, Any]] = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    sp = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if since is not None and float(sp.get("start_unix") or 0.0) < since:
+                    continue
+                if sp.get("duration_ms") is None:
+                    continue
+                spans.append(sp)
+    return spans
+
+
+def aggregate(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    by_name: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    roots = [sp for sp in spans if sp.get("parent_id") is None]
+    root_total = float(sum(sp["duration_ms"] for sp in roots)) or 1.0
+
+    for sp in spans:
+        name = str(sp.get("name"))
+        by_name.setdefault(name, []).append(float(sp["duration_ms"]))
+        if sp.get("status") == "error":
+            errors[name] = errors.get(name, 0) + 1
+
+    stages: Dict[str, Any] = {}
+    for name, values in by_name.items():
+        arr = np.asarray(values, dtype=np.float64)
+        stages[name] = {
+            "count": int(arr.size),
+            "errors": errors.get(name, 0),
+            "p50_ms": float(np.percentile(arr, 50)),
+            "p90_ms": float(np.percentile(arr, 90)),
+            "p99_ms": float(np.percentile(arr, 99)),
+            "max_ms": float(arr.max()),
+            "mean_ms": float(arr.mean()),
+            "share": float(arr.sum() / root_total),
+        }
+
+    status: Dict[str, int] = {}
+    for sp in roots:
+        code = str((sp.get("attrs") or {}).get("status_code", "?"))
+        status[code] = status.get(code, 0) + 1
+
+    return {"traces": len(roots), "spans": len(spans), "status_codes": status, "stages": stages}
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"trace: {report['traces']}  span: {report['spans']}  status: {report['status_codes']}")
+    print("")
+    print(f"{'stage':<28} {'n':>6} {'err':>5} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'share':>7}")
+    rows = sorted(report["stages"].items(), key=lambda kv: -kv[1]["p50_ms"] * kv[1]["count"])
+    for name, st in rows:
+        print(
+            f"{name:<28} {st['count']:>6} {st['errors']:>5} "
+            f"{st['p50_ms']:>9.1f} {st['p90_ms']:>9.1f} {st['p99_ms']:>9.1f} {st['max_ms']:>9.1f} "
+            f"{st['share'] * 100:>6.1f}%"
+        )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Percentili di latenza per stage dalle trace JSONL")
+    ap.add_argument("paths", nargs="+", help="file JSONL delle trace")
+    ap.add_argument("--since", default=None, help="solo span dopo questo istante (ISO 8601)")
+    ap.add_argument("--json", action="store_true", help="stampa il report in JSON")
+    args = ap.parse_args()
+
+    since = datetime.fromisoformat(args.since).timestamp() if args.since else None
+    spans = read_spans(args.paths, since=since)
+    if not spans:
+        print("nessuno span trovato", file=sys.stderr)
+        sys.exit(1)
+
+    report = aggregate(spans)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
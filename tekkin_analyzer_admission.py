@@ -0,0 +1,413 @@
+# tekkin_analyzer_admission.py
+"""
+Admission control per /analyze.
+
+Ogni analisi tiene in memoria la traccia decodificata, più spettrogrammi e
+dict di output: misurato sui blocchi V3 il picco è ~6x il PCM float32 stereo
+decodificato (60 s -> +140 MB, 240 s -> +485 MB), più la copia letta
+dall'API. Senza limiti un burst di richieste manda il container fuori memoria.
+
+Il controller ammette un'analisi quando:
+- i job in corso sono meno di TEKKIN_MAX_CONCURRENT (default: CPU / worker)
+- la memoria stimata dei job in corso + la nuova sta nel budget
+  TEKKIN_MEMORY_BUDGET_MB (default: 70% del limite cgroup / worker, altrimenti 2048)
+Un job da solo viene sempre ammesso (una traccia enorme non resta bloccata).
+
+Le richieste che non entrano aspettano in coda fino a TEKKIN_QUEUE_TIMEOUT_SEC;
+con la coda piena (TEKKIN_MAX_QUEUE) o a timeout scaduto -> AdmissionRejected,
+che l'API traduce in 429 + Retry-After, profondità coda e attesa stimata.
+
+Scheduling (due lane):
+- "interactive": upload dal sito, passa sempre davanti
+- "bulk": rebuild reference, backfill, ri-analisi; al massimo
+  TEKKIN_BULK_MAX_CONCURRENT slot (default: tutti meno uno), coda e timeout propri
+Se nessuno slot resta riservato agli interactive (TEKKIN_MAX_CONCURRENT=1, caso
+comune con CPU / worker, o bulk con tutti gli slot) un upload entra anche con i
+bulk in corso, oltre il limite di slot ma non oltre il budget di memoria: un mix
+da 90 minuti in bulk non lo fa andare in 429 per mancanza di slot
+(TEKKIN_INTERACTIVE_OVERFLOW=0 disattiva).
+Dentro ogni lane vince il job più corto (costo stimato dal probe: durata, codec,
+sample rate). Un job che aspetta da più di TEKKIN_STARVATION_SEC, e comunque da
+più di metà del timeout della sua lane, passa davanti a tutti (il più vecchio
+per primo), così né i bulk né le tracce lunghe restano fermi per sempre e
+l'aging scatta prima del 429 anche con il timeout breve degli interactive.
+"""
+from __future__ import annotations
+
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+# stima memoria job: base + fattore * PCM float32 decodificato
+JOB_BASE_MB = 64.0
+DEFAULT_FALLBACK_SECONDS = 600.0  # file non sondabile e dimensione ignota: 10 minuti stereo 44.1k
+# file non sondabile (es. MP3/M4A senza supporto in libsndfile): durata da
+# dimensione / bitrate tipico di un master compresso
+FALLBACK_KBPS = 192.0
+EWMA_ALPHA = 0.2
+
+LANES = ("interactive", "bulk")
+DEFAULT_LANE = "interactive"
+
+# secondi di analisi per secondo di audio (V3 + legacy, WAV 44.1k, 1 CPU);
+# ricalibrato a runtime con la media mobile dei job completati
+DEFAULT_SEC_PER_AUDIO_SEC = 0.06
+# decodifica: i formati compressi costano più del PCM
+CODEC_COST = {"WAV": 1.0, "AIFF": 1.0, "FLAC": 1.1, "OGG": 1.25, "MP3": 1.3}
+WAIT_WINDOW = 200
+# aging: un job diventa "affamato" al più tardi a questa frazione del timeout della lane
+STARVATION_TIMEOUT_FRACTION = 0.5
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _workers() -> int:
+    try:
+        return max(1, int(os.environ.get("TEKKIN_WORKERS", "") or 1))
+    except ValueError:
+        return 1
+
+
+def _cgroup_memory_mb() -> Optional[float]:
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path, "r") as f:
+                raw = f.read().strip()
+        except OSError:
+            continue
+        if raw and raw != "max":
+            value = int(raw)
+            # "nessun limite" su cgroup v1 è un valore enorme
+            if 0 < value < (1 << 60):
+                return value / (1024.0 * 1024.0)
+    return None
+
+
+def default_memory_budget_mb() -> float:
+    limit = _cgroup_memory_mb()
+    if limit is None:
+        return 2048.0
+    return max(256.0, 0.7 * limit / _workers())
+
+
+def estimate_job_mb(duration_sec: float, sr: int, channels: int, factor: Optional[float] = None) -> float:
+    """Memoria di picco stimata per un'analisi (MB)."""
+    factor = _env_float("TEKKIN_JOB_MEM_FACTOR", 8.0) if factor is None else factor
+    pcm_mb = max(0.0, duration_sec) * max(1, sr) * max(1, min(channels, 2)) * 4 / (1024.0 * 1024.0)
+    return JOB_BASE_MB + factor * pcm_mb
+
+
+def estimate_job_sec(probe: Dict[str, Any], sec_per_audio_sec: Optional[float] = None) -> float:
+    """Tempo di analisi stimato (s) dal probe: durata x codec x sample rate."""
+    rate = _env_float("TEKKIN_SEC_PER_AUDIO_SEC", DEFAULT_SEC_PER_AUDIO_SEC) if sec_per_audio_sec is None else sec_per_audio_sec
+    codec = CODEC_COST.get(str(probe.get("format") or "").upper(), 1.3)
+    # la parte di decodifica/resample scala con sr, le feature lavorano a sr fisso
+    sr_factor = 0.5 + 0.5 * max(1, int(probe.get("sr") or 44100)) / 44100.0
+    return max(0.5, float(probe.get("duration_sec") or 0.0) * rate * codec * sr_factor)
+
+
+def normalize_lane(lane: Optional[str]) -> str:
+    lane = (lane or "").strip().lower()
+    if lane not in LANES:
+        raise ValueError(f"priority must be one of {', '.join(LANES)}")
+    return lane
+
+
+def probe_audio(path: str) -> Dict[str, Any]:
+    """
+    Durata / sr / canali dall'header (senza decodificare). Se l'header non è
+    leggibile: durata stimata da dimensione del file e FALLBACK_KBPS, codec
+    dall'estensione; DEFAULT_FALLBACK_SECONDS solo senza dimensione.
+    """
+    try:
+        import soundfile as sf
+
+        info = sf.info(path)
+        if info.samplerate > 0 and info.frames > 0:
+            return {
+                "duration_sec": float(info.frames) / float(info.samplerate),
+                "sr": int(info.samplerate),
+                "channels": int(info.channels),
+                "format": str(info.format),
+                "probed": True,
+            }
+    except Exception:
+        pass
+    ext = os.path.splitext(path)[1].lstrip(".").upper() or None
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = 0
+    duration = size * 8.0 / (FALLBACK_KBPS * 1000.0) if size > 0 else DEFAULT_FALLBACK_SECONDS
+    return {"duration_sec": duration, "sr": 44100, "channels": 2, "format": ext, "probed": False}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after_sec: int, stats: Dict[str, Any]):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_sec = retry_after_sec
+        self.stats = stats
+
+
+@dataclass
+class Ticket:
+    cost_mb: float
+    admitted_at: float
+    waited_sec: float
+    lane: str = DEFAULT_LANE
+    cost_sec: float = 0.0
+
+
+@dataclass
+class _Waiter:
+    seq: int
+    lane: str
+    cost_mb: float
+    cost_sec: float
+    enqueued_at: float
+
+
+@dataclass
+class _LaneStats:
+    running: int = 0
+    admitted: int = 0
+    rejected: int = 0
+    waits: Deque[float] = field(default_factory=lambda: deque(maxlen=WAIT_WINDOW))
+
+    def snapshot(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+        n = len(waits)
+        return {
+            "running": self.running,
+            "admitted_total": self.admitted,
+            "rejected_total": self.rejected,
+            "wait_p50_sec": round(waits[n // 2], 2) if n else None,
+            "wait_p95_sec": round(waits[min(n - 1, int(0.95 * n))], 2) if n else None,
+            "wait_max_sec": round(waits[-1], 2) if n else None,
+        }
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        memory_budget_mb: Optional[float] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout_sec: Optional[float] = None,
+        bulk_max_concurrent: Optional[int] = None,
+        bulk_max_queue: Optional[int] = None,
+        bulk_queue_timeout_sec: Optional[float] = None,
+        starvation_sec: Optional[float] = None,
+    ):
+        cpu = os.cpu_count() or 1
+        self.max_concurrent = int(max_concurrent or _env_float("TEKKIN_MAX_CONCURRENT", max(1, cpu // _workers())))
+        self.memory_budget_mb = float(memory_budget_mb or _env_float("TEKKIN_MEMORY_BUDGET_MB", default_memory_budget_mb()))
+        max_queue = int(max_queue if max_queue is not None else _env_float("TEKKIN_MAX_QUEUE", 2 * self.max_concurrent))
+        queue_timeout_sec = float(
+            queue_timeout_sec if queue_timeout_sec is not None else _env_float("TEKKIN_QUEUE_TIMEOUT_SEC", 30.0)
+        )
+        # bulk: uno slot resta libero per gli upload interattivi (se ce n'è più di uno)
+        bulk_cap = int(
+            bulk_max_concurrent
+            or _env_float("TEKKIN_BULK_MAX_CONCURRENT", max(1, self.max_concurrent - 1))
+        )
+        # nessuno slot riservato agli interactive: ne ottengono uno oltre il limite
+        self.interactive_overflow = bulk_cap >= self.max_concurrent and _env_float("TEKKIN_INTERACTIVE_OVERFLOW", 1) > 0
+        self.lane_limits: Dict[str, Dict[str, float]] = {
+            "interactive": {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": max_queue,
+                "queue_timeout_sec": queue_timeout_sec,
+            },
+            "bulk": {
+                "max_concurrent": min(self.max_concurrent, bulk_cap),
+                "max_queue": int(
+                    bulk_max_queue if bulk_max_queue is not None else _env_float("TEKKIN_BULK_MAX_QUEUE", 50)
+                ),
+                "queue_timeout_sec": float(
+                    bulk_queue_timeout_sec
+                    if bulk_queue_timeout_sec is not None
+                    else _env_float("TEKKIN_BULK_QUEUE_TIMEOUT_SEC", 900.0)
+                ),
+            },
+        }
+        self.max_queue = max_queue
+        self.queue_timeout_sec = queue_timeout_sec
+        self.starvation_sec = float(
+            starvation_sec if starvation_sec is not None else _env_float("TEKKIN_STARVATION_SEC", 120.0)
+        )
+        # soglia di aging per lane: sempre prima del timeout della lane
+        for limits in self.lane_limits.values():
+            limits["starvation_sec"] = min(
+                self.starvation_sec, STARVATION_TIMEOUT_FRACTION * limits["queue_timeout_sec"]
+            )
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._running: Dict[int, Ticket] = {}
+        self._used_mb = 0.0
+        self._waiting: List[_Waiter] = []
+        self._lanes: Dict[str, _LaneStats] = {lane: _LaneStats() for lane in LANES}
+        # rapporto tempo reale / tempo stimato (1.0 = stima giusta)
+        self._calibration = 1.0
+        # durata media di un job (s), solo informativa
+        self._avg_job_sec: Optional[float] = None
+
+    # -- stato ---------------------------------------------------------------
+    def _lane_waiting(self, lane: str) -> int:
+        return sum(1 for w in self._waiting if w.lane == lane)
+
+    def _estimated_wait_sec(self, lane: str = DEFAULT_LANE, cost_sec: float = 0.0) -> float:
+        """Attesa stimata per un nuovo job nella lane: lavoro davanti / slot."""
+        if not self._waiting and len(self._running) < self.lane_limits[lane]["max_concurrent"]:
+            return 0.0
+        now = time.time()
+        running_left = sum(
+            max(0.0, t.cost_sec * self._calibration - (now - t.admitted_at)) for t in self._running.values()
+        )
+        # davanti: tutti gli interactive; per un bulk anche i bulk più corti
+        ahead = sum(
+            w.cost_sec * self._calibration
+            for w in self._waiting
+            if w.lane == "interactive" or (lane == "bulk" and w.cost_sec <= cost_sec)
+        )
+        slots = self.lane_limits[lane]["max_concurrent"]
+        return (running_left + ahead) / max(1, slots)
+
+    def _stats_locked(self) -> Dict[str, Any]:
+        lanes = {}
+        for lane in LANES:
+            snap = self._lanes[lane].snapshot()
+            snap["queue_depth"] = self._lane_waiting(lane)
+            snap["estimated_wait_sec"] = round(self._estimated_wait_sec(lane), 1)
+            snap.update({k: v for k, v in self.lane_limits[lane].items()})
+            lanes[lane] = snap
+        return {
+            "running": len(self._running),
+            "queue_depth": len(self._waiting),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "memory_used_mb": round(self._used_mb, 1),
+            "memory_budget_mb": round(self.memory_budget_mb, 1),
+            "avg_job_sec": None if self._avg_job_sec is None else round(self._avg_job_sec, 2),
+            "cost_calibration": round(self._calibration, 3),
+            "starvation_sec": self.starvation_sec,
+            "interactive_overflow": self.interactive_overflow,
+            "estimated_wait_sec": round(self._estimated_wait_sec(), 1),
+            "admitted_total": sum(s.admitted for s in self._lanes.values()),
+            "rejected_total": sum(s.rejected for s in self._lanes.values()),
+            "lanes": lanes,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return self._stats_locked()
+
+    # -- scheduling ----------------------------------------------------------
+    def _lane_has_slot(self, lane: str) -> bool:
+        return self._lanes[lane].running < self.lane_limits[lane]["max_concurrent"]
+
+    def _fits(self, cost_mb: float, lane: str = DEFAULT_LANE) -> bool:
+        if not self._running:
+            return True
+        if lane == "interactive" and self.interactive_overflow and self._lanes["interactive"].running == 0:
+            # solo bulk in corso: l'upload salta il limite di slot, non il budget di memoria
+            return self._used_mb + cost_mb <= self.memory_budget_mb
+        return (
+            len(self._running) < self.max_concurrent
+            and self._lane_has_slot(lane)
+            and self._used_mb + cost_mb <= self.memory_budget_mb
+        )
+
+    def _next_locked(self) -> Optional[_Waiter]:
+        """Prossimo job da ammettere: affamati (più vecchio), poi interactive SJF, poi bulk SJF."""
+        candidates = [w for w in self._waiting if self._lane_has_slot(w.lane) or not self._running]
+        if not candidates:
+            return None
+        now = time.time()
+        starving = [
+            w for w in candidates if now - w.enqueued_at >= self.lane_limits[w.lane]["starvation_sec"]
+        ]
+        if starving:
+            return min(starving, key=lambda w: (w.enqueued_at, w.seq))
+        for lane in LANES:
+            in_lane = [w for w in candidates if w.lane == lane]
+            if in_lane:
+                return min(in_lane, key=lambda w: (w.cost_sec, w.seq))
+        return None
+
+    def _reject_locked(self, reason: str, lane: str, cost_sec: float = 0.0) -> AdmissionRejected:
+        self._lanes[lane].rejected += 1
+        stats = self._stats_locked()
+        wait = self._estimated_wait_sec(lane, cost_sec)
+        stats["lane"] = lane
+        stats["lane_queue_depth"] = self._lane_waiting(lane)
+        stats["estimated_wait_sec"] = round(wait, 1)
+        retry = max(1, int(math.ceil(wait or 1.0)))
+        return AdmissionRejected(reason, retry, stats)
+
+    # -- API -----------------------------------------------------------------
+    def check_capacity(self, lane: str = DEFAULT_LANE) -> None:
+        """Rifiuto rapido (prima del download) se la coda della lane è già piena."""
+        with self._cond:
+            if self._lane_waiting(lane) >= self.lane_limits[lane]["max_queue"] and not self._fits(0.0, lane):
+                raise self._reject_locked("queue full", lane)
+
+    def acquire(self, cost_mb: float, lane: str = DEFAULT_LANE, cost_sec: float = 0.0) -> Ticket:
+        t0 = time.time()
+        limits = self.lane_limits[lane]
+        deadline = t0 + limits["queue_timeout_sec"]
+        with self._cond:
+            # senza coda si entra subito; altrimenti decide lo scheduler
+            if self._waiting or not self._fits(cost_mb, lane):
+                if self._lane_waiting(lane) >= limits["max_queue"]:
+                    raise self._reject_locked("queue full", lane, cost_sec)
+                me = _Waiter(next(self._seq), lane, cost_mb, cost_sec, t0)
+                self._waiting.append(me)
+                try:
+                    while not (self._next_locked() is me and self._fits(cost_mb, lane)):
+                        left = deadline - time.time()
+                        if left <= 0:
+                            raise self._reject_locked("queue timeout", lane, cost_sec)
+                        # risveglio periodico: l'aging cambia l'ordine anche senza release
+                        self._cond.wait(min(left, 1.0))
+                finally:
+                    self._waiting.remove(me)
+                    # il prossimo in coda potrebbe essere ora la testa
+                    self._cond.notify_all()
+            now = time.time()
+            ticket = Ticket(cost_mb=cost_mb, admitted_at=now, waited_sec=now - t0, lane=lane, cost_sec=cost_sec)
+            self._running[id(ticket)] = ticket
+            self._used_mb += cost_mb
+            stats = self._lanes[lane]
+            stats.running += 1
+            stats.admitted += 1
+            stats.waits.append(ticket.waited_sec)
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        took = time.time() - ticket.admitted_at
+        with self._cond:
+            if self._running.pop(id(ticket), None) is None:
+                return
+            self._used_mb = max(0.0, self._used_mb - ticket.cost_mb)
+            self._lanes[ticket.lane].running = max(0, self._lanes[ticket.lane].running - 1)
+            if self._avg_job_sec is None:
+                self._avg_job_sec = took
+            else:
+                self._avg_job_sec = (1 - EWMA_ALPHA) * self._avg_job_sec + EWMA_ALPHA * took
+            if ticket.cost_sec > 0:
+                ratio = min(10.0, max(0.1, took / ticket.cost_sec))
+                self._calibration = (1 - EWMA_ALPHA) * self._calibration + EWMA_ALPHA * ratio
+            self._cond.notify_all()
@@ -1,21 +1,50 @@
 # tekkin_analyzer_api.py
 from __future__ import annotations
 
+import time
+
+_IMPORT_T0 = time.perf_counter()
+
 import hashlib
 import json
 import logging
 import os
 import tempfile
+import threading
+from contextlib import asynccontextmanager
 from typing import Any, Optional
 
+import anyio
 import httpx
 import numpy as np
 import soundfile as sf
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel, Field
 
+# tempi di import per gruppo (loggati all'avvio insieme al warm-up)
+_IMPORT_MS: dict[str, int] = {"deps": int((time.perf_counter() - _IMPORT_T0) * 1000)}
+_t = time.perf_counter()
 from tekkin_analyzer_core import analyze_track, compute_levels, _waveform_peaks, _waveform_bands, _to_mono
+_IMPORT_MS["core_essentia"] = int((time.perf_counter() - _t) * 1000)
+_t = time.perf_counter()
 from tekkin_analyzer_v3.analyze_v3 import analyze_v3_blocks
+from tekkin_analyzer_v3.utils.resources import StageTimer, detailed_accounting
+from tekkin_analyzer_v3.utils.tracing import span, start_trace
+from tekkin_analyzer_v3.track_index import TrackIndex, embedding_from_v3
+from tekkin_analyzer_warmup import format_breakdown, run_warmup
+from tekkin_analyzer_v3.utils.es_pool import checkout as es_checkout
+from tekkin_analyzer_profiling import RequestProfiler, profile_path, requested_mode
+from tekkin_analyzer_admission import (
+    AdmissionController,
+    AdmissionRejected,
+    estimate_job_mb,
+    estimate_job_sec,
+    normalize_lane,
+    probe_audio,
+)
+_IMPORT_MS["v3"] = int((time.perf_counter() - _t) * 1000)
 
 
 logging.getLogger("numba").setLevel(logging.WARNING)
@@ -25,7 +54,93 @@ ANALYZER_SECRET = os.environ.get("TEKKIN_ANALYZER_SECRET")
 if not ANALYZER_SECRET:
     raise RuntimeError("TEKKIN_ANALYZER_SECRET non impostata nell'ambiente")
 
-app = FastAPI(title="Tekkin Analyzer (minimal)")
+# Warm-up all'avvio: "blocking" (default, il server accetta richieste solo a
+# warm-up finito), "background" (/healthz subito, /readyz 503 finché non è
+# finito), "off".
+WARMUP_MODE = os.environ.get("TEKKIN_WARMUP", "blocking").strip().lower()
+# budget di avvio (import + warm-up) oltre cui si logga un warning; 0 = nessuno
+STARTUP_BUDGET_MS = int(os.environ.get("TEKKIN_STARTUP_BUDGET_MS", "0") or 0)
+
+_startup: dict[str, Any] = {"state": "starting", "import_ms": _IMPORT_MS, "warmup": None}
+
+# limiti di concorrenza/memoria per /analyze (TEKKIN_MAX_CONCURRENT, TEKKIN_MEMORY_BUDGET_MB, ...)
+_admission = AdmissionController()
+_ready = threading.Event()
+
+
+def _warm_up() -> None:
+    try:
+        _startup["state"] = "warming"
+        _startup["warmup"] = run_warmup()
+    except Exception as exc:
+        # il servizio resta utilizzabile: il warm-up è solo un'ottimizzazione
+        logging.exception("[startup] warm-up failed")
+        _startup["warmup"] = {"errors": [f"{type(exc).__name__}: {exc}"]}
+    finally:
+        _finish_startup()
+
+
+def _finish_startup() -> None:
+    warmup = _startup.get("warmup") or {}
+    total_ms = sum(_IMPORT_MS.values()) + int(warmup.get("took_ms_total") or 0)
+    _startup["startup_ms"] = total_ms
+    _startup["state"] = "ready"
+    _ready.set()
+    logging.warning("[startup] ready in %dms (%s) | %s", total_ms, WARMUP_MODE, format_breakdown(_IMPORT_MS, warmup))
+    for err in warmup.get("errors") or []:
+        logging.warning("[startup] warm-up error: %s", err)
+    if STARTUP_BUDGET_MS and total_ms > STARTUP_BUDGET_MS:
+        logging.warning("[startup] over budget: %dms > %dms", total_ms, STARTUP_BUDGET_MS)
+
+
+def prewarm() -> None:
+    """
+    Warm-up nel processo corrente prima del fork (tekkin_analyzer_server.py):
+    i worker ereditano moduli, modelli e stato già pronti e saltano il proprio.
+    """
+    if _ready.is_set():
+        return
+    if WARMUP_MODE == "off":
+        _finish_startup()
+    else:
+        _warm_up()
+
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    if _ready.is_set():
+        # warm-up già fatto dal master prefork
+        pass
+    elif WARMUP_MODE == "off":
+        _finish_startup()
+    elif WARMUP_MODE == "background":
+        threading.Thread(target=_warm_up, name="tekkin-warmup", daemon=True).start()
+    else:
+        # nel threadpool di anyio: lo stesso che serve gli endpoint sync
+        await anyio.to_thread.run_sync(_warm_up)
+    yield
+
+
+app = FastAPI(title="Tekkin Analyzer (minimal)", lifespan=_lifespan)
+
+# Indice nearest-neighbour sulle analisi V3 (opzionale): attivo se TEKKIN_TRACK_INDEX_DIR e' impostata.
+TRACK_INDEX_DIR = os.environ.get("TEKKIN_TRACK_INDEX_DIR")
+# Con il launcher prefork ogni worker ha il suo TrackIndex sulla stessa cartella:
+# flock + rilettura del log in track_index.py tengono allineati i processi.
+# background=True: retrain e compattazione girano fuori dalla richiesta.
+_track_index: Optional[TrackIndex] = None
+_track_index_lock = threading.Lock()
+
+
+def _get_track_index() -> Optional[TrackIndex]:
+    global _track_index
+    if not TRACK_INDEX_DIR:
+        return None
+    if _track_index is None:
+        with _track_index_lock:
+            if _track_index is None:
+                _track_index = TrackIndex(TRACK_INDEX_DIR, background=True)
+    return _track_index
 
 
 class AnalyzeRequest(BaseModel):
@@ -44,6 +159,18 @@ class AnalyzeRequest(BaseModel):
 
     analyzer_version: Optional[str] = None
 
+    # "interactive" (upload dal sito) | "bulk" (rebuild, backfill, ri-analisi)
+    priority: str = "interactive"
+
+
+class SimilarRequest(BaseModel):
+    version_id: Optional[str] = None
+    embedding: Optional[list[Optional[float]]] = None
+    k: int = Field(10, ge=1, le=200)
+    mode: str = Field("approx")
+    nprobe: Optional[int] = Field(None, ge=1)
+    source: Optional[str] = None
+
 
 class AnalyzeResponse(BaseModel):
     version_id: str
@@ -141,6 +268,7 @@ def _upload_json_to_supabase_storage(
     bucket: str,
     object_path: str,
     payload: dict[str, Any],
+    stages: Optional[StageTimer] = None,
 ) -> tuple[Optional[str], Optional[int]]:
     base_url = os.environ.get("SUPABASE_URL")
     service_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
@@ -151,7 +279,9 @@ def _upload_json_to_supabase_storage(
         return None, None
 
     url = f"{base_url.rstrip('/')}/storage/v1/object/{bucket}/{object_path.lstrip('/')}"
-    data = json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=_json_default).encode("utf-8")
+    stages = stages or StageTimer()
+    with stages.stage("serialization"):
+        data = json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=_json_default).encode("utf-8")
     headers = {
         "authorization": f"Bearer {service_key}",
         "apikey": service_key,
@@ -160,7 +290,9 @@ def _upload_json_to_supabase_storage(
     }
 
     try:
-        r = httpx.post(url, content=data, headers=headers, timeout=30.0)
+        with stages.stage("upload", bucket=bucket, bytes=len(data)) as sp:
+            r = httpx.post(url, content=data, headers=headers, timeout=30.0)
+            sp.set(status_code=r.status_code)
         r.raise_for_status()
         return object_path, len(data)
     except Exception as exc:
@@ -168,19 +300,201 @@ def _upload_json_to_supabase_storage(
         return None, None
 
 
+def _too_busy(exc: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail={
+            "error": "analyzer busy",
+            "reason": exc.reason,
+            "lane": exc.stats.get("lane"),
+            "queue_depth": exc.stats.get("queue_depth"),
+            "lane_queue_depth": exc.stats.get("lane_queue_depth"),
+            "running": exc.stats.get("running"),
+            "estimated_wait_sec": exc.stats.get("estimated_wait_sec"),
+        },
+        headers={"Retry-After": str(exc.retry_after_sec)},
+    )
+
+
+@app.get("/healthz")
+def healthz():
+    # liveness: il processo risponde (anche durante il warm-up)
+    return {"status": "ok", "state": _startup["state"]}
+
+
+@app.get("/readyz")
+def readyz():
+    # readiness: warm-up concluso, il servizio può ricevere analisi
+    body = {
+        "ready": _ready.is_set(),
+        "state": _startup["state"],
+        "startup_ms": _startup.get("startup_ms"),
+        "import_ms": _IMPORT_MS,
+        "warmup": _startup.get("warmup"),
+        "admission": _admission.stats(),
+    }
+    return JSONResponse(body, status_code=200 if _ready.is_set() else 503)
+
+
+@app.get("/profiles/{profile_id}/{kind}")
+def get_profile(profile_id: str, kind: str, request: Request):
+    # profili salvati da /analyze con profiling attivo (kind: pstats | collapsed | summary)
+    secret = request.headers.get("x-analyzer-secret")
+    if not secret or secret != ANALYZER_SECRET:
+        raise HTTPException(status_code=401, detail="invalid analyzer secret")
+    path = profile_path(profile_id, kind)
+    if path is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return FileResponse(path, filename=os.path.basename(path))
+
+
+@app.get("/workers")
+def workers(request: Request):
+    # metriche per worker del launcher prefork (tekkin_analyzer_server.py)
+    secret = request.headers.get("x-analyzer-secret")
+    if not secret or secret != ANALYZER_SECRET:
+        raise HTTPException(status_code=401, detail="invalid analyzer secret")
+    stats_dir = os.environ.get("TEKKIN_WORKER_STATS_DIR")
+    if not stats_dir or not os.path.isdir(stats_dir):
+        return {"prefork": False, "pid": os.getpid(), "workers": []}
+
+    master: dict[str, Any] = {}
+    items: list[dict[str, Any]] = []
+    for name in sorted(os.listdir(stats_dir)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(stats_dir, name), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            continue
+        if name == "master.json":
+            master = data
+        else:
+            items.append(data)
+    return {"prefork": True, "pid": os.getpid(), "master": master, "workers": items}
+
+
+@app.post("/similar")
+def similar(req: SimilarRequest, request: Request):
+    secret = request.headers.get("x-analyzer-secret")
+    if not secret or secret != ANALYZER_SECRET:
+        raise HTTPException(status_code=401, detail="invalid analyzer secret")
+
+    try:
+        track_index = _get_track_index()
+    except Exception as exc:
+        raise HTTPException(status_code=503, detail=f"track index unavailable: {exc}")
+    if track_index is None:
+        raise HTTPException(status_code=503, detail="track index disabled (TEKKIN_TRACK_INDEX_DIR)")
+    if req.mode not in ("approx", "exact"):
+        raise HTTPException(status_code=400, detail="mode must be approx or exact")
+    if not req.version_id and not req.embedding:
+        raise HTTPException(status_code=400, detail="version_id or embedding required")
+
+    try:
+        results = track_index.search(
+            track_id=req.version_id if not req.embedding else None,
+            embedding=[np.nan if v is None else v for v in req.embedding] if req.embedding else None,
+            k=req.k,
+            mode=req.mode,
+            nprobe=req.nprobe,
+            source=req.source,
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="version_id not indexed")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except RuntimeError as exc:
+        raise HTTPException(status_code=503, detail=f"track index unavailable: {exc}")
+
+    return {"results": results, "index": track_index.stats()}
+
+
 @app.post("/analyze")
 def analyze(req: AnalyzeRequest, request: Request):
+    # span radice della richiesta; la serializzazione della risposta è uno span a parte
+    with start_trace(
+        "analyze",
+        version_id=req.version_id,
+        project_id=req.project_id,
+        profile_key=req.profile_key,
+        analyzer_version=req.analyzer_version,
+        priority=req.priority,
+    ) as root:
+        try:
+            # algoritmi Essentia presi dal pool del processo e riconsegnati a fine richiesta
+            with es_checkout():
+                payload = _analyze_request(req, request)
+        except HTTPException as exc:
+            root.set(status_code=exc.status_code)
+            if exc.status_code >= 400:
+                root.error(str(exc.detail))
+            raise
+        with span("response.serialize") as sp:
+            response = JSONResponse(jsonable_encoder(payload))
+            sp.set(bytes=len(response.body))
+        root.set(status_code=200)
+        return response
+
+
+def _analyze_request(req: AnalyzeRequest, request: Request):
     secret = request.headers.get("x-analyzer-secret")
     if not secret or secret != ANALYZER_SECRET:
         raise HTTPException(status_code=401, detail="invalid analyzer secret")
 
-    tmp_path = _download_to_tmp(req.audio_url)
     try:
-        sha = _sha256_file(tmp_path)
+        lane = normalize_lane(req.priority)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    # coda già piena: rifiuta prima di scaricare
+    try:
+        _admission.check_capacity(lane)
+    except AdmissionRejected as exc:
+        raise _too_busy(exc)
+
+    stages = StageTimer()
+    with stages.stage("download") as sp:
+        tmp_path = _download_to_tmp(req.audio_url)
+        sp.set(bytes=os.path.getsize(tmp_path), suffix=os.path.splitext(tmp_path)[1])
+    ticket = None
+    profiler = None
+    try:
+        with stages.stage("hash", algorithm="sha256"):
+            sha = _sha256_file(tmp_path)
         if req.audio_sha256 and req.audio_sha256.lower() != sha.lower():
             raise HTTPException(status_code=400, detail="audio_sha256 mismatch")
 
-        stereo, sr = _read_audio(tmp_path)
+        # memoria e tempo stimati dall'header, prima di decodificare
+        with span("probe") as sp:
+            probe = probe_audio(tmp_path)
+            sp.set(**probe)
+        try:
+            with span("admission", lane=lane) as sp:
+                ticket = _admission.acquire(
+                    estimate_job_mb(probe["duration_sec"], probe["sr"], probe["channels"]),
+                    lane=lane,
+                    cost_sec=estimate_job_sec(probe),
+                )
+                sp.set(waited_sec=round(ticket.waited_sec, 3), cost_mb=round(ticket.cost_mb, 1), cost_sec=round(ticket.cost_sec, 2))
+        except AdmissionRejected as exc:
+            raise _too_busy(exc)
+        logging.warning(
+            "[API] admitted lane=%s waited=%.1fs est=%.1fs duration=%.0fs format=%s",
+            lane, ticket.waited_sec, ticket.cost_sec, probe["duration_sec"], probe["format"],
+        )
+
+        # attesa in coda esclusa dai tempi di fase
+        stages.add("queue", ticket.waited_sec * 1000.0)
+
+        profile_mode = requested_mode(request.headers)
+        if profile_mode:
+            profiler = RequestProfiler(profile_mode, label=f"{req.project_id}/{req.version_id}").start()
+
+        with stages.stage("decode", decoder="soundfile", codec=probe["format"]) as sp:
+            stereo, sr = _read_audio(tmp_path)
+            sp.set(sr=sr, channels=int(stereo.shape[0]), duration_sec=round(stereo.shape[1] / float(sr), 3) if sr else None)
 
         logging.warning("[API] analyzer_version raw=%r", req.analyzer_version)
 
@@ -193,10 +507,13 @@ def analyze(req: AnalyzeRequest, request: Request):
         if analyzer_version in ("v3", "3"):
             logging.warning("[API] ENTER V3 BRANCH")
             try:
-                v3res = analyze_v3_blocks(
-                    audio_path=tmp_path,
-                    profile_key=req.profile_key,
-                )
+                with detailed_accounting(profiler is not None):
+                    v3res = analyze_v3_blocks(
+                        audio_path=tmp_path,
+                        profile_key=req.profile_key,
+                        stages=stages,
+                        audio_sha256=sha,
+                    )
             except Exception as exc:
                 logging.exception("Analyzer V3 crash")
                 raise HTTPException(status_code=500, detail=f"{type(exc).__name__}: {exc}")
@@ -242,57 +559,59 @@ def analyze(req: AnalyzeRequest, request: Request):
             extra_b = (blocks.get("extra") or {}).get("data")
             extra_b = extra_b if isinstance(extra_b, dict) else {}
 
-            arrays_blob = {
-                "loudness_stats": {
-                    "momentary_lufs": loud.get("momentary_lufs"),
-                    "short_term_lufs": loud.get("short_term_lufs"),
-                    "momentary_lufs_raw": loud.get("momentary_lufs_raw"),
-                    "short_term_lufs_raw": loud.get("short_term_lufs_raw"),
-                    "integrated_lufs": loud.get("integrated_lufs"),
-                    "lra": loud.get("lra"),
-                    "sample_peak_db": loud.get("sample_peak_db"),
-                    "true_peak_db": loud.get("true_peak_db"),
-                    "true_peak_method": loud.get("true_peak_method"),
-                },
-
-                "spectrum_db": timbre.get("spectrum_db"),
-                "sound_field": stereo_b.get("sound_field"),
-                "sound_field_xy": stereo_b.get("sound_field_xy"),
-                "sound_field_polar": stereo_b.get("sound_field_polar"),
-                "transients": transients_obj,
-
-                # ---- ADD: tonal balance ----
-                "band_energy_norm": timbre.get("bands_norm"),
-
-                # ---- ADD: spectral scalari ----
-                "spectral": (blocks.get("spectral") or {}).get("data") if isinstance((blocks.get("spectral") or {}).get("data"), dict) else None,
-
-                # ---- ADD: loudness percentili + sections ----
-                "momentary_percentiles": loud.get("momentary_percentiles"),
-                "short_term_percentiles": loud.get("short_term_percentiles"),
-                "sections": loud.get("sections"),
-
-                # ---- ADD: stereo advanced ----
-                "stereo_width": stereo_b.get("stereo_width"),
-                "width_by_band": stereo_b.get("width_by_band"),
-                "stereo_summary": stereo_b.get("stereo_summary") or stereo_b.get("summary"),
-                "correlation": stereo_b.get("correlation"),
-
-                # ---- ADD: rhythm arrays + descriptors ----
-                "beat_times": rhythm_b.get("beat_times") if isinstance(rhythm_b.get("beat_times"), list) else None,
-                "rhythm_descriptors": rhythm_b.get("descriptors") if isinstance(rhythm_b.get("descriptors"), dict) else None,
-                "relative_key": rhythm_b.get("relative_key"),
-                "danceability": rhythm_b.get("danceability"),
-
-                # ---- ADD: extra ----
-                "mfcc_mean": extra_b.get("mfcc_mean") if isinstance(extra_b.get("mfcc_mean"), list) else None,
-                "hfc": extra_b.get("hfc"),
-                "spectral_peaks_count": extra_b.get("spectral_peaks_count"),
-                "spectral_peaks_energy": extra_b.get("spectral_peaks_energy"),
-
-                # ---- ADD: levels ----
-                "levels": compute_levels(stereo),
-            }
+            with span("arrays_blob") as sp:
+                arrays_blob = {
+                    "loudness_stats": {
+                        "momentary_lufs": loud.get("momentary_lufs"),
+                        "short_term_lufs": loud.get("short_term_lufs"),
+                        "momentary_lufs_raw": loud.get("momentary_lufs_raw"),
+                        "short_term_lufs_raw": loud.get("short_term_lufs_raw"),
+                        "integrated_lufs": loud.get("integrated_lufs"),
+                        "lra": loud.get("lra"),
+                        "sample_peak_db": loud.get("sample_peak_db"),
+                        "true_peak_db": loud.get("true_peak_db"),
+                        "true_peak_method": loud.get("true_peak_method"),
+                    },
+
+                    "spectrum_db": timbre.get("spectrum_db"),
+                    "sound_field": stereo_b.get("sound_field"),
+                    "sound_field_xy": stereo_b.get("sound_field_xy"),
+                    "sound_field_polar": stereo_b.get("sound_field_polar"),
+                    "transients": transients_obj,
+
+                    # ---- ADD: tonal balance ----
+                    "band_energy_norm": timbre.get("bands_norm"),
+
+                    # ---- ADD: spectral scalari ----
+                    "spectral": (blocks.get("spectral") or {}).get("data") if isinstance((blocks.get("spectral") or {}).get("data"), dict) else None,
+
+                    # ---- ADD: loudness percentili + sections ----
+                    "momentary_percentiles": loud.get("momentary_percentiles"),
+                    "short_term_percentiles": loud.get("short_term_percentiles"),
+                    "sections": loud.get("sections"),
+
+                    # ---- ADD: stereo advanced ----
+                    "stereo_width": stereo_b.get("stereo_width"),
+                    "width_by_band": stereo_b.get("width_by_band"),
+                    "stereo_summary": stereo_b.get("stereo_summary") or stereo_b.get("summary"),
+                    "correlation": stereo_b.get("correlation"),
+
+                    # ---- ADD: rhythm arrays + descriptors ----
+                    "beat_times": rhythm_b.get("beat_times") if isinstance(rhythm_b.get("beat_times"), list) else None,
+                    "rhythm_descriptors": rhythm_b.get("descriptors") if isinstance(rhythm_b.get("descriptors"), dict) else None,
+                    "relative_key": rhythm_b.get("relative_key"),
+                    "danceability": rhythm_b.get("danceability"),
+
+                    # ---- ADD: extra ----
+                    "mfcc_mean": extra_b.get("mfcc_mean") if isinstance(extra_b.get("mfcc_mean"), list) else None,
+                    "hfc": extra_b.get("hfc"),
+                    "spectral_peaks_count": extra_b.get("spectral_peaks_count"),
+                    "spectral_peaks_energy": extra_b.get("spectral_peaks_energy"),
+
+                    # ---- ADD: levels ----
+                    "levels": compute_levels(stereo),
+                }
+                sp.set(keys=len(arrays_blob))
 
             warnings = []
             for name, blk in (blocks or {}).items():
@@ -300,12 +619,28 @@ def analyze(req: AnalyzeRequest, request: Request):
                     err = (blk or {}).get("error") or "block_failed"
                     warnings.append(f"{name}:{err}")
 
+            # l'indice è accessorio: qualsiasi errore (anche al load) resta un warning
+            emb = embedding_from_v3(v3res) if TRACK_INDEX_DIR else None
+            if emb is not None:
+                try:
+                    track_index = _get_track_index()
+                    if track_index is not None:
+                        track_index.upsert(
+                            req.version_id,
+                            emb,
+                            {"source": "track", "project_id": req.project_id, "profile_key": req.profile_key},
+                        )
+                except Exception as exc:
+                    logging.getLogger("tekkin-analyzer-min").warning("[track-index] upsert failed: %s", exc)
+                    warnings.append("track_index_upsert_failed")
+
             if req.upload_arrays_blob:
                 obj_path = f"{req.storage_base_path}/{req.project_id}/{req.version_id}/arrays.json"
                 arrays_blob_path, arrays_blob_size = _upload_json_to_supabase_storage(
                     bucket=req.storage_bucket,
                     object_path=obj_path,
                     payload=arrays_blob,
+                    stages=stages,
                 )
                 if not arrays_blob_path:
                     warnings.append("arrays_blob_upload_failed")
@@ -314,11 +649,19 @@ def analyze(req: AnalyzeRequest, request: Request):
             mono = _to_mono(stereo)
             duration_seconds = float(len(mono) / float(sr)) if mono.size else 0.0
 
-            waveform_peaks = _waveform_peaks(mono, sr, points=1200)
-            waveform_bands = _waveform_bands(stereo, sr, points=900)
+            with stages.stage("waveform"):
+                waveform_peaks = _waveform_peaks(mono, sr, points=1200)
+                waveform_bands = _waveform_bands(stereo, sr, points=900)
+
+            meta = dict(v3res.get("meta") or {})
+            meta["timings_ms"] = stages.as_dict()
+            if profiler is not None:
+                meta["profile"] = profiler.links()
+            logging.warning("[API] timings_ms %s", meta["timings_ms"])
 
             return {
                 **v3res,
+                "meta": meta,
                 "version_id": req.version_id,
                 "project_id": req.project_id,
                 "mode": req.mode,
@@ -337,14 +680,15 @@ def analyze(req: AnalyzeRequest, request: Request):
         # ----------------------------
         logging.warning("[API] ENTER LEGACY BRANCH")
         try:
-            result = analyze_track(
-                project_id=req.project_id,
-                version_id=req.version_id,
-                mode=req.mode,
-                profile_key=req.profile_key,
-                audio_stereo=stereo,
-                sr=sr,
-            )
+            with stages.stage("blocks"):
+                result = analyze_track(
+                    project_id=req.project_id,
+                    version_id=req.version_id,
+                    mode=req.mode,
+                    profile_key=req.profile_key,
+                    audio_stereo=stereo,
+                    sr=sr,
+                )
         except Exception as exc:
             logging.exception("Analyzer crash")
             raise HTTPException(status_code=500, detail=f"{type(exc).__name__}: {exc}")
@@ -369,12 +713,17 @@ def analyze(req: AnalyzeRequest, request: Request):
                     bucket=req.storage_bucket,
                     object_path=obj_path,
                     payload=arrays_blob,
+                    stages=stages,
                 )
                 if not arrays_blob_path:
                     warnings.append("arrays_blob_upload_failed")
             else:
                 warnings.append("arrays_blob_missing")
 
+        log.info("timings_ms %s", stages.as_dict())
+        if profiler is not None:
+            log.info("profile %s", profiler.links()["urls"])
+
         return AnalyzeResponse(
             version_id=req.version_id,
             project_id=req.project_id,
@@ -400,6 +749,10 @@ def analyze(req: AnalyzeRequest, request: Request):
             arrays_blob_size_bytes=arrays_blob_size,
         )
     finally:
+        if profiler is not None:
+            profiler.stop_and_save()
+        if ticket is not None:
+            _admission.release(ticket)
         try:
             os.remove(tmp_path)
         except Exception:
@@ -8,6 +8,9 @@ import json
 import math
 import numpy as np
 
+from tekkin_analyzer_v3.utils.es_pool import algorithm
+from tekkin_analyzer_v3.utils.tempo import estimate_tempo
+
 try:
     import essentia.standard as es
 except Exception as exc:
@@ -19,16 +22,13 @@ else:
 
 REFERENCE_MODELS_DIR = Path(__file__).resolve().parent / "reference_models"
 
+# modelli letti una volta per processo (i file cambiano solo con un deploy);
+# i dict restituiti sono condivisi e vanno trattati in sola lettura.
+# I profili mancanti non vengono memorizzati (profile_key arriva dalla richiesta).
+_REFERENCE_MODEL_CACHE: dict[str, dict[str, Any]] = {}
 
-def _load_reference_model(profile_key: str) -> Optional[dict[str, Any]]:
-    if not profile_key:
-        return None
-    key = str(profile_key).strip()
-    if not key:
-        return None
 
-    filename = key if key.endswith(".json") else f"{key}.json"
-    model_path = REFERENCE_MODELS_DIR / filename
+def _read_reference_model(model_path: Path) -> Optional[dict[str, Any]]:
     if not model_path.exists():
         return None
 
@@ -40,6 +40,35 @@ def _load_reference_model(profile_key: str) -> Optional[dict[str, Any]]:
         return None
 
 
+def _load_reference_model(profile_key: str) -> Optional[dict[str, Any]]:
+    if not profile_key:
+        return None
+    key = str(profile_key).strip()
+    if not key:
+        return None
+
+    filename = key if key.endswith(".json") else f"{key}.json"
+    model = _REFERENCE_MODEL_CACHE.get(filename)
+    if model is None:
+        model = _read_reference_model(REFERENCE_MODELS_DIR / filename)
+        if model is not None:
+            _REFERENCE_MODEL_CACHE[filename] = model
+    return model
+
+
+def preload_reference_models() -> list[str]:
+    """Carica in cache tutti i modelli in REFERENCE_MODELS_DIR. Ritorna i profile_key validi."""
+    loaded: list[str] = []
+    if not REFERENCE_MODELS_DIR.is_dir():
+        return loaded
+    for model_path in sorted(REFERENCE_MODELS_DIR.glob("*.json")):
+        model = _read_reference_model(model_path)
+        if model is not None:
+            _REFERENCE_MODEL_CACHE[model_path.name] = model
+            loaded.append(model_path.stem)
+    return loaded
+
+
 def _require_essentia() -> None:
     if es is None:
         raise RuntimeError(f"Essentia non disponibile: {_ESSENTIA_IMPORT_ERROR}")
@@ -151,12 +180,12 @@ def compute_transients(mono: np.ndarray, sr: int) -> dict[str, float]:
     frame_size = 1024
     hop = 512
 
-    w = es.Windowing(type="hann")
-    fft = es.FFT()
-    c2p = es.CartesianToPolar()
+    w = algorithm("Windowing", type="hann")
+    fft = algorithm("FFT")
+    c2p = algorithm("CartesianToPolar")
 
-    od = es.OnsetDetection(method="complex")  # richiede mag + phase
-    onsets_alg = es.Onsets(sampleRate=sr, hopSize=hop)
+    od = algorithm("OnsetDetection", method="complex")  # richiede mag + phase
+    onsets_alg = algorithm("Onsets", sampleRate=sr, hopSize=hop)
 
     odf = []
     for frame in es.FrameGenerator(x, frameSize=frame_size, hopSize=hop, startFromZero=True):
@@ -322,7 +351,7 @@ def _loudness_stats(stereo: np.ndarray, sr: int) -> dict[str, Any]:
     mono = np.ascontiguousarray(_to_mono(stereo), dtype=np.float32)
     stereo_n2 = _as_stereo_n2(stereo)
 
-    loud = es.LoudnessEBUR128(sampleRate=sr)
+    loud = algorithm("LoudnessEBUR128", sampleRate=sr)
     warnings: list[str] = []
 
     def _call_loud(x: np.ndarray):
@@ -401,7 +430,7 @@ def _safe_key_extract(mono: np.ndarray) -> dict[str, Any]:
     _require_essentia()
     out: dict[str, Any] = {"key": None, "scale": None, "strength": None, "warnings": []}
     try:
-        key_ex = es.KeyExtractor()
+        key_ex = algorithm("KeyExtractor")
         k, s, st = key_ex(mono)
         out["key"], out["scale"], out["strength"] = k, s, float(st)
         return out
@@ -519,9 +548,9 @@ def _waveform_bands(stereo: np.ndarray, sr: int, points: int = 900) -> dict[str,
 
     duration = float(len(mono) / float(sr))
 
-    sub_f = es.LowPass(cutoffFrequency=150.0, sampleRate=sr)
-    mid_bp = es.BandPass(bandwidth=1800.0, cutoffFrequency=900.0, sampleRate=sr)
-    high_f = es.HighPass(cutoffFrequency=4000.0, sampleRate=sr)
+    sub_f = algorithm("LowPass", cutoffFrequency=150.0, sampleRate=sr)
+    mid_bp = algorithm("BandPass", bandwidth=1800.0, cutoffFrequency=900.0, sampleRate=sr)
+    high_f = algorithm("HighPass", cutoffFrequency=4000.0, sampleRate=sr)
 
     sub = np.asarray(sub_f(mono), dtype=np.float32)
     mid = np.asarray(mid_bp(mono), dtype=np.float32)
@@ -562,18 +591,12 @@ def analyze_track(
     # Levels (L/R)
     levels = compute_levels(stereo)
 
-    # BPM
-    rhythm = es.RhythmExtractor2013(method="multifeature")
-    rhythm_out = rhythm(mono)
-
-    if isinstance(rhythm_out, (list, tuple)):
-        bpm = _safe_float(rhythm_out[0])
-        beats = rhythm_out[1] if len(rhythm_out) > 1 else []
-        beat_conf = _safe_float(rhythm_out[2]) if len(rhythm_out) > 2 else None
-    else:
-        bpm = None
-        beats = []
-        beat_conf = None
+    # BPM (engine da TEKKIN_TEMPO_ENGINE: accurate | fast)
+    tempo = estimate_tempo(mono, sr)
+    bpm = _safe_float(tempo["bpm"])
+    beats = tempo["beats"]
+    beat_conf = _safe_float(tempo["confidence"])
+    beat_conf_unit = _safe_float(tempo["confidence_unit"])
 
     # Key
     key_r = _safe_key_extract(mono)
@@ -584,11 +607,11 @@ def analyze_track(
     key_str = f"{key} {scale}".strip() if key or scale else None
 
     # Spectral summary
-    spec_alg = es.Spectrum()
-    w = es.Windowing(type="hann")
-    centroid = es.Centroid(range=sr / 2.0)
-    rolloff = es.RollOff(cutoff=0.85)
-    zcr_alg = es.ZeroCrossingRate()
+    spec_alg = algorithm("Spectrum")
+    w = algorithm("Windowing", type="hann")
+    centroid = algorithm("Centroid", range=sr / 2.0)
+    rolloff = algorithm("RollOff", cutoff=0.85)
+    zcr_alg = algorithm("ZeroCrossingRate")
 
     frame_size = 2048
     hop = 1024
@@ -704,7 +727,7 @@ def analyze_track(
         "spectral": spectral,
         "zero_crossing_rate": _safe_float(spectral.get("zero_crossing_rate")),
         "stereo_width": stereo_width,
-        "confidence": {"bpm": beat_conf, "key": key_strength},
+        "confidence": {"bpm": beat_conf, "bpm_unit": beat_conf_unit, "key": key_strength},
         "warnings": warnings,
         "essentia_features": {
             "rhythm": {"bpm": bpm, "confidence": beat_conf},
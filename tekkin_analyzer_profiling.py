@@ -0,0 +1,215 @@
+# tekkin_analyzer_profiling.py
+"""
+Profiling opt-in di una singola richiesta /analyze.
+
+Attivazione:
+- header `x-analyzer-profile: <token>` con token == TEKKIN_PROFILE_TOKEN
+  (senza TEKKIN_PROFILE_TOKEN l'header è ignorato: solo chi ha il token profila)
+- TEKKIN_PROFILE=1: profila ogni richiesta (da usare solo su un worker di debug)
+
+Modalità (TEKKIN_PROFILE_MODE o header `x-analyzer-profile-mode`):
+- deterministic (default): cProfile sul thread della richiesta -> .pstats,
+  più il campionamento degli stack -> .collapsed
+- sampling: solo campionamento (overhead trascurabile), niente .pstats
+
+Il campionatore legge lo stack del thread della richiesta ogni
+TEKKIN_PROFILE_INTERVAL_MS (default 5) ms: le chiamate Essentia compaiono come
+foglia sulla riga Python che le invoca, quindi nel flamegraph si vede subito
+quanto tempo va in C++ e quanto nei loop Python. Formato collapsed
+("a;b;c N"), pronto per flamegraph.pl / speedscope.
+
+I profili finiscono in TEKKIN_PROFILE_DIR (default /tmp/tekkin_profiles);
+oltre TEKKIN_PROFILE_KEEP profili (default 50) i più vecchi vengono cancellati.
+"""
+from __future__ import annotations
+
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+PROFILE_DIR = os.environ.get("TEKKIN_PROFILE_DIR", "/tmp/tekkin_profiles")
+PROFILE_KEEP = int(os.environ.get("TEKKIN_PROFILE_KEEP", "50") or 50)
+PROFILE_ALWAYS = os.environ.get("TEKKIN_PROFILE", "0").strip().lower() in ("1", "true", "yes")
+PROFILE_TOKEN = os.environ.get("TEKKIN_PROFILE_TOKEN", "").strip()
+PROFILE_MODE = os.environ.get("TEKKIN_PROFILE_MODE", "deterministic").strip().lower() or "deterministic"
+PROFILE_INTERVAL_SEC = float(os.environ.get("TEKKIN_PROFILE_INTERVAL_MS", "5") or 5) / 1000.0
+
+MODES = ("deterministic", "sampling")
+# estensioni dei file di un profilo (id.<ext>)
+PROFILE_FILES = {"pstats": ".pstats", "collapsed": ".collapsed", "summary": ".json"}
+
+
+def requested_mode(headers: Any) -> Optional[str]:
+    """Modalità di profiling per la richiesta, None se non va profilata."""
+    wanted = PROFILE_ALWAYS
+    token = (headers.get("x-analyzer-profile") or "").strip()
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        wanted = True
+    if not wanted:
+        return None
+    mode = (headers.get("x-analyzer-profile-mode") or PROFILE_MODE).strip().lower()
+    return mode if mode in MODES else "deterministic"
+
+
+def profile_path(profile_id: str, kind: str) -> Optional[str]:
+    """Path di un file di profilo; None se id/kind non validi o file assente."""
+    ext = PROFILE_FILES.get(kind)
+    if ext is None or not profile_id or any(c not in "0123456789abcdef-_" for c in profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + ext)
+    return path if os.path.isfile(path) else None
+
+
+class _StackSampler:
+    """Campiona lo stack di un thread e conta gli stack collassati."""
+
+    def __init__(self, thread_id: int, interval_sec: float):
+        self.thread_id = thread_id
+        self.interval_sec = interval_sec
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self) -> None:
+        own = os.path.dirname(os.path.abspath(__file__))
+        while not self._stop.wait(self.interval_sec):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                filename = code.co_filename
+                if filename.startswith(own):
+                    filename = os.path.relpath(filename, own)
+                else:
+                    filename = os.path.basename(filename)
+                stack.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.counts.most_common())
+
+
+class RequestProfiler:
+    """
+    Profila il thread corrente tra start() e stop_and_save().
+    links() è disponibile subito (serve per meta prima che il profilo sia scritto).
+    """
+
+    def __init__(self, mode: str = "deterministic", label: str = ""):
+        self.mode = mode if mode in MODES else "deterministic"
+        self.label = label
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[_StackSampler] = None
+        self._t0 = 0.0
+        self.saved = False
+
+    def links(self) -> Dict[str, Any]:
+        kinds = ["collapsed", "summary"] + (["pstats"] if self.mode == "deterministic" else [])
+        return {
+            "id": self.profile_id,
+            "mode": self.mode,
+            "files": {k: os.path.join(PROFILE_DIR, self.profile_id + PROFILE_FILES[k]) for k in kinds},
+            "urls": {k: f"/profiles/{self.profile_id}/{k}" for k in kinds},
+        }
+
+    def start(self) -> "RequestProfiler":
+        self._t0 = time.perf_counter()
+        self._sampler = _StackSampler(threading.get_ident(), PROFILE_INTERVAL_SEC)
+        self._sampler.start()
+        if self.mode == "deterministic":
+            try:
+                self._cprofile = cProfile.Profile()
+                self._cprofile.enable()
+            except ValueError:
+                # python >= 3.12: un solo profiler deterministico per processo
+                self._cprofile = None
+                self.mode = "sampling"
+        return self
+
+    def stop_and_save(self) -> Optional[Dict[str, Any]]:
+        """Ferma il profiler e scrive i file; non solleva mai (il profiling non rompe l'analisi)."""
+        if self._sampler is None:
+            return None
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._sampler.stop()
+        took_ms = int((time.perf_counter() - self._t0) * 1000)
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            links = self.links()
+            summary: Dict[str, Any] = {
+                "id": self.profile_id,
+                "label": self.label,
+                "mode": self.mode,
+                "took_ms": took_ms,
+                "samples": self._sampler.samples,
+                "interval_ms": PROFILE_INTERVAL_SEC * 1000.0,
+            }
+            with open(links["files"]["collapsed"], "w", encoding="utf-8") as f:
+                f.write(self._sampler.collapsed())
+            if self._cprofile is not None:
+                self._cprofile.dump_stats(links["files"]["pstats"])
+                buf = io.StringIO()
+                pstats.Stats(self._cprofile, stream=buf).sort_stats("cumulative").print_stats(30)
+                summary["top_cumulative"] = buf.getvalue().splitlines()
+            with open(links["files"]["summary"], "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2, ensure_ascii=False)
+            self.saved = True
+            _apply_retention()
+            return summary
+        except Exception as exc:
+            logging.getLogger("tekkin-analyzer-min").warning("[profile] save failed: %s", exc)
+            return None
+
+
+def _apply_retention(keep: Optional[int] = None) -> int:
+    """Cancella i profili più vecchi oltre `keep`. Ritorna quanti profili ha rimosso."""
+    keep = PROFILE_KEEP if keep is None else keep
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except OSError:
+        return 0
+    by_id: Dict[str, List[str]] = {}
+    for name in names:
+        for ext in PROFILE_FILES.values():
+            if name.endswith(ext):
+                by_id.setdefault(name[: -len(ext)], []).append(os.path.join(PROFILE_DIR, name))
+                break
+    if len(by_id) <= keep:
+        return 0
+
+    def _mtime(pid: str) -> float:
+        return max(os.path.getmtime(p) for p in by_id[pid])
+
+    removed = 0
+    for pid in sorted(by_id, key=_mtime)[: len(by_id) - keep]:
+        for path in by_id[pid]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        removed += 1
+    return removed
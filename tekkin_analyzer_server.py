@@ -0,0 +1,350 @@
+# tekkin_analyzer_server.py
+"""
+Launcher prefork per il servizio analyzer.
+
+Il master importa tekkin_analyzer_api (Essentia, NumPy, modelli), esegue il
+warm-up e solo dopo fa fork di N worker uvicorn sullo stesso socket: moduli,
+librerie native e reference model restano pagine condivise copy-on-write.
+
+Ogni worker viene riciclato (drain graceful: smette di accettare, finisce le
+richieste in corso, esce) dopo TEKKIN_WORKER_MAX_JOBS analisi o quando l'RSS
+supera TEKKIN_WORKER_MAX_RSS_MB; il master lo rimpiazza. Un worker che muore
+(anche per un crash nel codice nativo) viene rimpiazzato senza fermare gli altri.
+
+Metriche per worker: file JSON in TEKKIN_WORKER_STATS_DIR, esposti da
+GET /workers.
+
+Uso:
+    python tekkin_analyzer_server.py --workers 4 --port 8000
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+import uvicorn
+
+# path che contano come "job" per il riciclo
+JOB_PATHS = ("/analyze",)
+# exit code di un worker riciclato (distinto da crash / segnali)
+RECYCLE_EXIT_CODE = 0
+# un worker che muore prima di questo tempo rallenta il respawn (crash loop)
+MIN_WORKER_LIFETIME_SEC = 5.0
+RESPAWN_BACKOFF_SEC = 1.0
+
+_log = logging.getLogger("tekkin-analyzer-server")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+def rss_mb() -> float:
+    """RSS corrente del processo in MB (/proc su Linux, altrimenti picco da getrusage)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except Exception:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux: KB, macOS: byte
+        return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def _write_json_atomic(path: str, payload: Dict[str, Any]) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+# -----------------------------------------------------------------------------
+# Worker
+# -----------------------------------------------------------------------------
+class WorkerState:
+    def __init__(self, slot: int, generation: int, stats_dir: str, max_jobs: int, max_rss_mb: int):
+        self.slot = slot
+        self.generation = generation
+        self.stats_path = os.path.join(stats_dir, f"worker-{slot}.json")
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.started_at = time.time()
+        self.jobs = 0
+        self.in_flight = 0
+        self.last_job_at: Optional[float] = None
+        self.last_job_ms: Optional[int] = None
+        self.recycle_reason: Optional[str] = None
+        self.rss_mb = rss_mb()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "slot": self.slot,
+            "pid": os.getpid(),
+            "generation": self.generation,
+            "started_at": self.started_at,
+            "uptime_sec": round(time.time() - self.started_at, 1),
+            "jobs": self.jobs,
+            "in_flight": self.in_flight,
+            "rss_mb": round(self.rss_mb, 1),
+            "max_jobs": self.max_jobs,
+            "max_rss_mb": self.max_rss_mb,
+            "last_job_at": self.last_job_at,
+            "last_job_ms": self.last_job_ms,
+            "state": "draining" if self.recycle_reason else "serving",
+            "recycle_reason": self.recycle_reason,
+        }
+
+    def publish(self) -> None:
+        try:
+            _write_json_atomic(self.stats_path, self.snapshot())
+        except Exception as exc:
+            _log.warning("[worker %d] stats write failed: %s", self.slot, exc)
+
+    def check_recycle(self) -> Optional[str]:
+        if self.recycle_reason:
+            return self.recycle_reason
+        if self.max_jobs > 0 and self.jobs >= self.max_jobs:
+            self.recycle_reason = f"jobs {self.jobs} >= {self.max_jobs}"
+        elif self.max_rss_mb > 0 and self.rss_mb >= self.max_rss_mb:
+            self.recycle_reason = f"rss {self.rss_mb:.0f}MB >= {self.max_rss_mb}MB"
+        return self.recycle_reason
+
+
+class RecyclingApp:
+    """Wrapper ASGI: conta i job, aggiorna RSS/metriche e chiede il drain al server."""
+
+    def __init__(self, app, state: WorkerState):
+        self.app = app
+        self.state = state
+        self.server: Optional[uvicorn.Server] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") != "http" or scope.get("path") not in JOB_PATHS:
+            return await self.app(scope, receive, send)
+
+        st = self.state
+        status: Dict[str, int] = {}
+
+        async def _send(message):
+            if message.get("type") == "http.response.start":
+                status["code"] = int(message.get("status", 0))
+            await send(message)
+
+        st.in_flight += 1
+        t0 = time.time()
+        try:
+            return await self.app(scope, receive, _send)
+        finally:
+            st.in_flight -= 1
+            # le richieste respinte (4xx: secret, validazione, 429) non hanno
+            # caricato audio e non contano come job
+            if not 400 <= status.get("code", 500) < 500:
+                st.jobs += 1
+            st.last_job_at = time.time()
+            st.last_job_ms = int((st.last_job_at - t0) * 1000)
+            st.rss_mb = rss_mb()
+            reason = st.check_recycle()
+            st.publish()
+            if reason and self.server is not None and not self.server.should_exit:
+                _log.warning("[worker %d pid=%d] recycling: %s", st.slot, os.getpid(), reason)
+                # uvicorn smette di accettare e attende le richieste in corso
+                self.server.should_exit = True
+
+
+def _worker_main(sock: socket.socket, slot: int, generation: int, args: argparse.Namespace) -> int:
+    import tekkin_analyzer_api as api
+
+    state = WorkerState(slot, generation, args.stats_dir, args.max_jobs, args.max_rss_mb)
+    wrapped = RecyclingApp(api.app, state)
+    config = uvicorn.Config(
+        wrapped,
+        lifespan="on",
+        log_level=args.log_level,
+        timeout_graceful_shutdown=args.drain_timeout,
+    )
+    server = uvicorn.Server(config)
+    wrapped.server = server
+    state.publish()
+    server.run(sockets=[sock])
+    state.publish()
+    return RECYCLE_EXIT_CODE
+
+
+# -----------------------------------------------------------------------------
+# Master
+# -----------------------------------------------------------------------------
+class Master:
+    def __init__(self, sock: socket.socket, args: argparse.Namespace):
+        self.sock = sock
+        self.args = args
+        self.workers: Dict[int, Dict[str, Any]] = {}  # pid -> {slot, generation, started}
+        self.generations: Dict[int, int] = {}
+        self.restarts: Dict[int, Dict[str, int]] = {}
+        self.stopping = False
+
+    def spawn(self, slot: int) -> None:
+        generation = self.generations.get(slot, 0) + 1
+        self.generations[slot] = generation
+        pid = os.fork()
+        if pid == 0:
+            # figlio: i segnali li gestisce uvicorn
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 1
+            try:
+                code = _worker_main(self.sock, slot, generation, self.args)
+            except BaseException:
+                logging.exception("[worker %d] crashed", slot)
+            finally:
+                os._exit(code)
+        self.workers[pid] = {"slot": slot, "generation": generation, "started": time.time()}
+        self.publish()
+
+    def publish(self) -> None:
+        try:
+            _write_json_atomic(
+                os.path.join(self.args.stats_dir, "master.json"),
+                {
+                    "pid": os.getpid(),
+                    "workers": self.args.workers,
+                    "alive": sorted(w["slot"] for w in self.workers.values()),
+                    "restarts": {str(k): v for k, v in self.restarts.items()},
+                    "max_jobs": self.args.max_jobs,
+                    "max_rss_mb": self.args.max_rss_mb,
+                },
+            )
+        except Exception as exc:
+            _log.warning("[master] stats write failed: %s", exc)
+
+    def _on_exit(self, pid: int, status: int) -> None:
+        info = self.workers.pop(pid, None)
+        if info is None:
+            return
+        slot = info["slot"]
+        if os.WIFSIGNALED(status):
+            sig = os.WTERMSIG(status)
+            kind = f"signal {sig}"
+            # uvicorn, dopo lo shutdown graceful, rilancia SIGTERM/SIGINT ricevuto
+            reason = "stop" if sig in (signal.SIGTERM, signal.SIGINT) else "crash"
+        else:
+            code = os.WEXITSTATUS(status)
+            kind = f"exit {code}"
+            reason = "recycle" if code == RECYCLE_EXIT_CODE else "crash"
+        counters = self.restarts.setdefault(slot, {"recycle": 0, "crash": 0, "stop": 0})
+        counters[reason] += 1
+        lived = time.time() - info["started"]
+        _log.warning("[master] worker %d pid=%d ended (%s, %s) after %.0fs", slot, pid, reason, kind, lived)
+        if self.stopping:
+            self.publish()
+            return
+        if reason == "crash" and lived < MIN_WORKER_LIFETIME_SEC:
+            time.sleep(RESPAWN_BACKOFF_SEC)
+        self.spawn(slot)
+
+    def _stop(self, signum, _frame) -> None:
+        if self.stopping:
+            return
+        self.stopping = True
+        _log.warning("[master] signal %d: draining %d workers", signum, len(self.workers))
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for slot in range(self.args.workers):
+            self.spawn(slot)
+
+        deadline: Optional[float] = None
+        while self.workers:
+            if self.stopping and deadline is None:
+                deadline = time.time() + self.args.drain_timeout + 5
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG if self.stopping else 0)
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            if pid == 0:
+                if deadline is not None and time.time() > deadline:
+                    for left in list(self.workers):
+                        _log.warning("[master] worker pid=%d did not drain, killing", left)
+                        try:
+                            os.kill(left, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    deadline = time.time() + 5
+                time.sleep(0.2)
+                continue
+            self._on_exit(pid, status)
+        return 0
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Tekkin Analyzer prefork server")
+    ap.add_argument("--host", default=os.environ.get("TEKKIN_HOST", "0.0.0.0"))
+    ap.add_argument("--port", type=int, default=_env_int("PORT", 8000))
+    ap.add_argument("--workers", type=int, default=_env_int("TEKKIN_WORKERS", 2))
+    ap.add_argument("--max-jobs", type=int, default=_env_int("TEKKIN_WORKER_MAX_JOBS", 200), help="0 = nessun limite")
+    ap.add_argument("--max-rss-mb", type=int, default=_env_int("TEKKIN_WORKER_MAX_RSS_MB", 0), help="0 = nessun limite")
+    ap.add_argument("--drain-timeout", type=int, default=_env_int("TEKKIN_WORKER_DRAIN_SEC", 300), help="secondi per finire le richieste in corso")
+    ap.add_argument("--backlog", type=int, default=2048)
+    ap.add_argument("--log-level", default=os.environ.get("TEKKIN_LOG_LEVEL", "info"))
+    args = ap.parse_args()
+    args.workers = max(1, args.workers)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    args.stats_dir = os.environ.get("TEKKIN_WORKER_STATS_DIR") or tempfile.mkdtemp(prefix="tekkin-workers-")
+    os.makedirs(args.stats_dir, exist_ok=True)
+    os.environ["TEKKIN_WORKER_STATS_DIR"] = args.stats_dir
+    # l'admission control (tekkin_analyzer_admission) divide CPU e memoria per worker
+    os.environ["TEKKIN_WORKERS"] = str(args.workers)
+
+    sock = _bind(args.host, args.port, args.backlog)
+
+    # import + warm-up nel master: i worker ereditano tutto già pronto
+    import tekkin_analyzer_api as api
+
+    api.prewarm()
+    gc.collect()
+    # oggetti del master fuori dal GC: il ciclo del collector nei figli non
+    # tocca (e quindi non copia) le loro pagine
+    gc.freeze()
+
+    _log.warning(
+        "[master] pid=%d listening on %s:%d, workers=%d max_jobs=%d max_rss_mb=%d stats=%s",
+        os.getpid(), args.host, args.port, args.workers, args.max_jobs, args.max_rss_mb, args.stats_dir,
+    )
+    return Master(sock, args).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
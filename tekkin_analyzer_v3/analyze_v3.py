@@ -10,6 +10,7 @@ if REPO_ROOT not in sys.path:
 
 import argparse
 import json
+import logging
 import time
 from dataclasses import dataclass
 from typing import Any, Dict, Optional
@@ -17,16 +18,42 @@ from typing import Any, Dict, Optional
 import numpy as np
 
 from tekkin_analyzer_v3.utils.audio_loader import load_audio_ffmpeg
+from tekkin_analyzer_v3.utils.pcm_cache import cached_pcm, sha256_file
+from tekkin_analyzer_v3.utils.tempo import analysis_pyramid
+from tekkin_analyzer_v3.utils.resources import MEM_MODE, StageTimer, deep_nbytes, json_nbytes, json_sizes_enabled, measure
+from tekkin_analyzer_v3.utils.tracing import span
 from tekkin_analyzer_v3.blocks.loudness import analyze_loudness
 from tekkin_analyzer_v3.blocks.timbre_spectrum import analyze_timbre_spectrum
 from tekkin_analyzer_v3.blocks.stereo import analyze_stereo
 from tekkin_analyzer_v3.blocks.transients import analyze_transients
 from tekkin_analyzer_v3.blocks.rhythm import analyze_rhythm
 from tekkin_analyzer_v3.blocks.extra import analyze_extra
+from tekkin_analyzer_v3.block_store import block_params, default_store, source_fingerprint
 
 
 BAND_KEYS = ["sub", "low", "lowmid", "mid", "presence", "high", "air"]
 
+# blocchi V3 nell'ordine di esecuzione (usati anche dal warm-up del servizio)
+V3_BLOCKS = (
+    ("loudness", analyze_loudness),
+    ("timbre_spectrum", analyze_timbre_spectrum),
+    ("stereo", analyze_stereo),
+    ("transients", analyze_transients),
+    ("rhythm", analyze_rhythm),
+    ("extra", analyze_extra),
+)
+
+# versione di ogni blocco per block_store: BLOCK_VERSION dichiarata nel modulo +
+# impronta dei sorgenti del blocco e delle dipendenze tekkin_analyzer_v3 che usa
+# (utils/tempo.py, utils/chroma.py, es_pool, ...) + versione di Essentia.
+# Un cambio di codice ricalcola da solo i blocchi toccati; BLOCK_VERSION va
+# incrementata a mano solo se l'output cambia senza toccare i sorgenti
+# (modelli, tabelle o librerie esterne diverse da Essentia).
+BLOCK_VERSIONS: Dict[str, str] = {
+    name: f"{sys.modules[fn.__module__].BLOCK_VERSION}+{source_fingerprint(sys.modules[fn.__module__])}"
+    for name, fn in V3_BLOCKS
+}
+
 
 @dataclass(frozen=True)
 class AnalyzerV3Config:
@@ -39,58 +66,176 @@ def _safe_block(name: str, fn, audio: np.ndarray, sr: int) -> Dict[str, Any]:
     """
     Esegue un blocco e non rompe mai l'analisi completa.
     In caso di errore, torna { ok:false, error:"...", data:null }.
+    Oltre a took_ms riporta cpu_ms, peak_mem_mb, output_bytes e output_json_bytes
+    (solo con trace/profiling attivi, vedi utils/resources.py).
     """
     t0 = time.time()
-    try:
-        data = fn(audio=audio, sr=sr)
-        return {
-            "ok": True,
-            "took_ms": int((time.time() - t0) * 1000),
-            "data": data,
-        }
-    except Exception as e:
-        return {
-            "ok": False,
-            "took_ms": int((time.time() - t0) * 1000),
-            "error": f"{type(e).__name__}: {e}",
-            "data": None,
-        }
+    with span(f"block.{name}") as sp:
+        with measure() as res:
+            try:
+                data = fn(audio=audio, sr=sr)
+                out: Dict[str, Any] = {"ok": True, "data": data}
+            except Exception as e:
+                data = None
+                out = {"ok": False, "error": f"{type(e).__name__}: {e}", "data": None}
+        out["took_ms"] = int((time.time() - t0) * 1000)
+        out["version"] = BLOCK_VERSIONS.get(name)
+        out["cpu_ms"] = res["cpu_ms"]
+        out["peak_mem_mb"] = res["peak_mem_mb"]
+        out["output_bytes"] = deep_nbytes(data) if data is not None else 0
+        out["output_json_bytes"] = None
+        if json_sizes_enabled():
+            try:
+                out["output_json_bytes"] = json_nbytes(data) if data is not None else 0
+            except Exception:
+                pass
+        sp.set(**{k: out[k] for k in ("ok", "took_ms", "cpu_ms", "peak_mem_mb", "output_bytes", "output_json_bytes")})
+        if not out["ok"]:
+            sp.error(out["error"])
+    return out
+
+
+def _reused_block(envelope: Dict[str, Any]) -> Dict[str, Any]:
+    """Envelope dallo store: costo zero in questa analisi, quello originale in stored_took_ms."""
+    out = dict(envelope)
+    out["reused"] = True
+    out["stored_took_ms"] = int(envelope.get("took_ms") or 0)
+    out["took_ms"] = 0
+    out["cpu_ms"] = 0.0
+    out["peak_mem_mb"] = 0.0
+    return out
+
+
+def _decode(audio_path: str, cfg: AnalyzerV3Config, sha: Optional[str], timer: StageTimer) -> np.ndarray:
+    """PCM stereo (n, 2) float32 a cfg.sr, via cache PCM."""
+    with timer.stage("decode", decoder="ffmpeg") as sp:
+        audio, cache_hit = cached_pcm(
+            audio_path,
+            cfg.sr,
+            lambda: load_audio_ffmpeg(
+                path=audio_path,
+                sr=cfg.sr,
+                max_seconds=cfg.max_seconds,
+                ffmpeg_bin=cfg.ffmpeg_bin,
+            )[0],
+            sha256=sha,
+            max_seconds=cfg.max_seconds,
+        )
+        sp.set(sr=cfg.sr, samples=int(audio.shape[0]), duration_sec=float(audio.shape[0] / cfg.sr) if cfg.sr > 0 else None, pcm_cache="hit" if cache_hit else "miss")
+
+    # audio shape: (n, 2) float32, stereo
+    # Se per qualsiasi motivo arriva mono, lo portiamo a 2 canali.
+    if audio.ndim == 1:
+        audio = np.stack([audio, audio], axis=-1)
+    if audio.ndim == 2 and audio.shape[1] == 1:
+        audio = np.concatenate([audio, audio], axis=1)
+    return audio
+
+
+def _resources_summary(blocks: Dict[str, Any]) -> Dict[str, Any]:
+    """Totali per richiesta sui blocchi V3 (esclusi gli alias compat)."""
+    env = [blocks[name] for name, _ in V3_BLOCKS if name in blocks]
+    peaks = [b.get("peak_mem_mb") for b in env if b.get("peak_mem_mb") is not None]
+    json_sizes = [b.get("output_json_bytes") for b in env if b.get("output_json_bytes") is not None]
+    return {
+        "cpu_ms_blocks": sum(int(b.get("cpu_ms") or 0) for b in env),
+        "peak_mem_mb_max": max(peaks) if peaks else None,
+        "mem_method": MEM_MODE,
+        "output_bytes": sum(int(b.get("output_bytes") or 0) for b in env),
+        "output_json_bytes": sum(int(v) for v in json_sizes) if json_sizes else None,
+    }
 
 
 def analyze_v3(
     audio_path: str,
     profile_key: Optional[str] = None,
     config: Optional[AnalyzerV3Config] = None,
+    stages: Optional[StageTimer] = None,
+    audio_sha256: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Analisi V3: orchestratore unico.
     Output stabile a blocchi:
       loudness, timbre_spectrum, stereo, transients, rhythm, extra
+    stages: StageTimer della richiesta (l'API lo passa per aggiungere download,
+    hash, upload); meta.timings_ms contiene i tempi per fase.
+    Il PCM decodificato passa dalla cache su disco (utils/pcm_cache.py);
+    i blocchi già calcolati alla versione corrente si riusano da block_store
+    (meta.incremental); audio_sha256 evita di ricalcolare l'hash se il
+    chiamante lo ha già.
     """
     cfg = config or AnalyzerV3Config()
+    timer = stages or StageTimer()
 
     t0 = time.time()
-    audio, sr = load_audio_ffmpeg(
-        path=audio_path,
-        sr=cfg.sr,
-        max_seconds=cfg.max_seconds,
-        ffmpeg_bin=cfg.ffmpeg_bin,
-    )
-
-    # audio shape: (n, 2) float32, stereo
-    # Se per qualsiasi motivo arriva mono, lo portiamo a 2 canali.
-    if audio.ndim == 1:
-        audio = np.stack([audio, audio], axis=-1)
-    if audio.ndim == 2 and audio.shape[1] == 1:
-        audio = np.concatenate([audio, audio], axis=1)
+    sr = cfg.sr
+    store = default_store()
+    params = block_params(cfg.sr, cfg.max_seconds)
+    sha = audio_sha256
+    if store is not None and not sha:
+        with timer.stage("hash", algorithm="sha256"):
+            sha = sha256_file(audio_path)
+
+    reused: Dict[str, Dict[str, Any]] = {}
+    audio_meta: Optional[Dict[str, Any]] = None
+    if store is not None and sha:
+        with span("block_store.lookup") as sp:
+            for name, _ in V3_BLOCKS:
+                env = store.get(sha, name, BLOCK_VERSIONS[name], params)
+                if env is not None:
+                    reused[name] = env
+            # tutti i blocchi validi: niente decode, sr/campioni dallo store
+            if len(reused) == len(V3_BLOCKS):
+                audio_meta = store.audio_meta(sha, params)
+            sp.set(reused=sorted(reused), decode_skipped=audio_meta is not None)
+
+    audio: Optional[np.ndarray] = None
+    if audio_meta is None:
+        # il timer dell'API ha già un "decode" (soundfile): conta solo questo
+        decode_before = timer.ms.get("decode", 0)
+        audio = _decode(audio_path, cfg, sha, timer)
+        audio_meta = {
+            "sr": sr,
+            "channels": int(audio.shape[1]),
+            "samples": int(audio.shape[0]),
+            "decode_ms": int(timer.ms.get("decode", 0) - decode_before),
+        }
+        if store is not None and sha:
+            store.note_source(sha, audio_path, params, audio_meta)
 
     blocks: Dict[str, Any] = {}
-    blocks["loudness"] = _safe_block("loudness", analyze_loudness, audio, sr)
-    blocks["timbre_spectrum"] = _safe_block("timbre_spectrum", analyze_timbre_spectrum, audio, sr)
-    blocks["stereo"] = _safe_block("stereo", analyze_stereo, audio, sr)
-    blocks["transients"] = _safe_block("transients", analyze_transients, audio, sr)
-    blocks["rhythm"] = _safe_block("rhythm", analyze_rhythm, audio, sr)
-    blocks["extra"] = _safe_block("extra", analyze_extra, audio, sr)
+    t_blocks = time.perf_counter()
+    # una AudioPyramid per analisi, condivisa dai blocchi (utils/tempo.py)
+    with span("blocks", count=len(V3_BLOCKS), reused=len(reused)) as sp, analysis_pyramid(sr):
+        for name, fn in V3_BLOCKS:
+            if name in reused:
+                blocks[name] = _reused_block(reused[name])
+            else:
+                blocks[name] = _safe_block(name, fn, audio, sr)
+        sp.set(failed=[name for name, _ in V3_BLOCKS if not blocks[name]["ok"]])
+    # il tempo fuori dai blocchi è la misura stessa (output_bytes, JSON, span)
+    blocks_ms = sum(int(blocks[name]["took_ms"]) for name, _ in V3_BLOCKS)
+    timer.add("blocks", blocks_ms)
+    timer.add("accounting", max(0.0, (time.perf_counter() - t_blocks) * 1000.0 - blocks_ms))
+
+    computed = [name for name, _ in V3_BLOCKS if name not in reused]
+    if store is not None and sha and computed:
+        with timer.stage("block_store", blocks=len(computed)):
+            for name in computed:
+                try:
+                    store.put(sha, name, BLOCK_VERSIONS[name], params, blocks[name])
+                except (OSError, TypeError, ValueError) as e:
+                    logging.getLogger("tekkin-analyzer-min").warning("[block-store] %s non salvato: %s", name, e)
+    decode_skipped = audio is None
+    incremental = {
+        "store": store is not None,
+        "reused": [name for name, _ in V3_BLOCKS if name in reused],
+        "computed": computed,
+        "decode_skipped": decode_skipped,
+        # stima: costo originale dei blocchi riusati (+ il decode evitato)
+        "saved_ms": sum(int(env.get("took_ms") or 0) for env in reused.values())
+        + (int(audio_meta.get("decode_ms") or 0) if decode_skipped else 0),
+    }
 
     # --- COMPAT ALIAS PER UI V2 ---
     ts = blocks.get("timbre_spectrum", {})
@@ -126,10 +271,13 @@ def analyze_v3(
         "profile_key": profile_key,
         "meta": {
             "sr": sr,
-            "channels": int(audio.shape[1]) if audio.ndim == 2 else 2,
-            "samples": int(audio.shape[0]) if audio.ndim >= 1 else 0,
-            "duration_sec": float(audio.shape[0] / sr) if sr > 0 else None,
+            "channels": int(audio_meta["channels"]),
+            "samples": int(audio_meta["samples"]),
+            "duration_sec": float(audio_meta["samples"] / sr) if sr > 0 else None,
             "took_ms_total": int((time.time() - t0) * 1000),
+            "timings_ms": timer.ms,
+            "resources": _resources_summary(blocks),
+            "incremental": incremental,
         },
         "blocks": blocks,
     }
@@ -322,12 +470,18 @@ def print_summary(res: dict):
     print("================================")
 
 
-def analyze_v3_blocks(*, audio_path: str, profile_key: str):
+def analyze_v3_blocks(
+    *,
+    audio_path: str,
+    profile_key: str,
+    stages: Optional[StageTimer] = None,
+    audio_sha256: Optional[str] = None,
+):
     """
     Wrapper stabile per l'API FastAPI.
     Ritorna lo stesso dict di analyze_v3().
     """
-    return analyze_v3(audio_path=audio_path, profile_key=profile_key)
+    return analyze_v3(audio_path=audio_path, profile_key=profile_key, stages=stages, audio_sha256=audio_sha256)
 
 
 def main():
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+Store persistente degli output per blocco V3, chiave (sha256 audio, blocco,
+versione del blocco, parametri di decode).
+
+Ogni blocco dichiara BLOCK_VERSION nel suo modulo (analyze_v3.BLOCK_VERSIONS):
+quando cambia una versione, la ri-analisi della stessa traccia ricalcola solo
+quel blocco e riusa gli altri dallo store; se tutti i blocchi sono validi non
+serve nemmeno il decode. Si salvano solo i blocchi ok, quindi un re-run dopo
+un blocco fallito ricalcola solo quello.
+
+Layout (TEKKIN_BLOCK_STORE_DIR, default /tmp/tekkin_block_store):
+  <sha[:2]>/<sha>/<blocco>@<versione>@<params>.json   envelope del blocco
+  <sha[:2]>/<sha>/source.json                         ultimo path audio, sr/campioni per params
+
+TEKKIN_BLOCK_STORE=0 disattiva (benchmark e confronti golden lo spengono).
+TEKKIN_BLOCK_STORE_MB budget in MB (default 1024; 0 = disattivato): oltre
+budget si eliminano le entry usate meno di recente (mtime, aggiornato a ogni
+hit), come utils/pcm_cache.py. ~280 KB per minuto di traccia.
+
+Versioni: la chiave usa analyze_v3.BLOCK_VERSIONS = BLOCK_VERSION del modulo +
+impronta dei sorgenti (source_fingerprint) del blocco e dei moduli
+tekkin_analyzer_v3 che usa (utils/tempo.py, utils/chroma.py, es_pool, ...) +
+versione di Essentia. Una modifica a una dipendenza condivisa invalida quindi
+i blocchi che la usano anche senza toccare BLOCK_VERSION; BLOCK_VERSION resta
+per i cambi di output che non passano dai sorgenti (modelli, dati esterni).
+
+CLI:
+  python -m tekkin_analyzer_v3.block_store backfill --manifest versions.jsonl --out-dir out/
+  python -m tekkin_analyzer_v3.block_store backfill --audio ~/tracks --dry-run
+  python -m tekkin_analyzer_v3.block_store stats
+  python -m tekkin_analyzer_v3.block_store prune        # elimina versioni non più correnti
+  python -m tekkin_analyzer_v3.block_store evict --mb 512
+Il manifest ha una riga JSON per versione: {version_id, audio_path | audio_url,
+sha256?, profile_key?}. Senza --manifest né --audio il backfill percorre tutte
+le tracce già nello store il cui audio è ancora su disco.
+"""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+REPO_ROOT = str(Path(__file__).resolve().parent.parent)
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import types
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+SOURCE_JSON = "source.json"
+_UNSAFE = re.compile(r"[^A-Za-z0-9._+-]")
+DEFAULT_BUDGET_MB = 1024.0
+# eviction dopo aver scritto ~1/20 del budget (non a ogni put: percorre tutto lo store)
+EVICT_EVERY_SHARE = 0.05
+PACKAGE = "tekkin_analyzer_v3"
+
+
+def _json_default(o: Any):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, (np.floating, np.integer)):
+        return o.item()
+    if isinstance(o, np.bool_):
+        return bool(o)
+    return str(o)
+
+
+def _safe(s: str) -> str:
+    return _UNSAFE.sub("_", s)
+
+
+def source_fingerprint(module: types.ModuleType) -> str:
+    """
+    Hash (8 hex) dei sorgenti di `module` e dei moduli tekkin_analyzer_v3 che
+    usa, seguiti transitivamente dai nomi importati, + versione di Essentia.
+    """
+    seen: Dict[str, types.ModuleType] = {}
+    stack = [module]
+    while stack:
+        mod = stack.pop()
+        if mod.__name__ in seen:
+            continue
+        seen[mod.__name__] = mod
+        for value in vars(mod).values():
+            dep = value if isinstance(value, types.ModuleType) else sys.modules.get(getattr(value, "__module__", None) or "")
+            if dep is not None and dep.__name__.split(".")[0] == PACKAGE and dep.__name__ not in seen:
+                stack.append(dep)
+    h = hashlib.sha256()
+    for name in sorted(seen):
+        try:
+            src = inspect.getsource(seen[name])
+        except (OSError, TypeError):
+            src = ""
+        h.update(name.encode("utf-8") + b"\0" + src.encode("utf-8") + b"\0")
+    try:
+        import essentia
+
+        h.update(str(getattr(essentia, "__version__", "")).encode("utf-8"))
+    except Exception:
+        pass
+    return h.hexdigest()[:8]
+
+
+def block_params(sr: int, max_seconds: Optional[float] = None) -> str:
+    """Parametri di decode che cambiano l'input dei blocchi."""
+    p = f"sr{int(sr)}"
+    if max_seconds is not None and max_seconds > 0:
+        p += f"_t{float(max_seconds):g}"
+    return p
+
+
+def _write_json_atomic(path: str, payload: Dict[str, Any]) -> None:
+    d = os.path.dirname(path)
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=d)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class BlockStore:
+    def __init__(self, root: str, budget_bytes: Optional[int] = None):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        # byte scritti dall'ultima eviction (None = mai fatta in questo processo)
+        self._written: Optional[int] = None
+
+    def _dir(self, sha256: str) -> str:
+        sha = sha256.lower()
+        return os.path.join(self.root, sha[:2], sha)
+
+    def _path(self, sha256: str, block: str, version: str, params: str) -> str:
+        return os.path.join(self._dir(sha256), f"{_safe(block)}@{_safe(version)}@{_safe(params)}.json")
+
+    def get(self, sha256: str, block: str, version: str, params: str) -> Optional[Dict[str, Any]]:
+        path = self._path(sha256, block, version, params)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        env = entry.get("envelope")
+        if not (isinstance(env, dict) and env.get("ok")):
+            return None
+        try:
+            os.utime(path)  # LRU
+        except OSError:
+            pass
+        return env
+
+    def put(self, sha256: str, block: str, version: str, params: str, envelope: Dict[str, Any]) -> None:
+        if not envelope.get("ok"):
+            return
+        path = self._path(sha256, block, version, params)
+        _write_json_atomic(path, {
+            "sha256": sha256.lower(),
+            "block": block,
+            "version": version,
+            "params": params,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "envelope": envelope,
+        })
+        if self.budget_bytes:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            with self._lock:
+                due = self._written is None or self._written + size >= self.budget_bytes * EVICT_EVERY_SHARE
+                self._written = 0 if due else self._written + size
+            if due:
+                self.evict()
+
+    def evict(self, budget: Optional[int] = None) -> Tuple[int, int]:
+        """Elimina le entry meno recenti finché lo store sta nel budget: (entry, byte liberati)."""
+        budget = self.budget_bytes if budget is None else budget
+        if not budget:
+            return 0, 0
+        with self._lock:
+            items = []
+            total = 0
+            for sha in self.shas():
+                d = self._dir(sha)
+                for _, _, _, path in self.entries(sha):
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    items.append((st.st_mtime, st.st_size, path, sha))
+                    total += st.st_size
+                try:
+                    total += os.path.getsize(os.path.join(d, SOURCE_JSON))
+                except OSError:
+                    pass
+            n, freed = 0, 0
+            emptied = set()
+            for _, size, path, sha in sorted(items):
+                if total <= budget:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                freed += size
+                n += 1
+                emptied.add(sha)
+            # tracce rimaste senza blocchi: via anche source.json e cartella
+            for sha in emptied:
+                if not self.entries(sha):
+                    d = self._dir(sha)
+                    try:
+                        os.remove(os.path.join(d, SOURCE_JSON))
+                        os.rmdir(d)
+                        os.rmdir(os.path.dirname(d))  # solo se vuota
+                    except OSError:
+                        pass
+            return n, freed
+
+    def source(self, sha256: str) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self._dir(sha256), SOURCE_JSON), "r", encoding="utf-8") as f:
+                src = json.load(f)
+            return src if isinstance(src, dict) else {}
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def audio_meta(self, sha256: str, params: str) -> Optional[Dict[str, Any]]:
+        meta = (self.source(sha256).get("audio") or {}).get(params)
+        return meta if isinstance(meta, dict) and meta.get("samples") else None
+
+    def note_source(self, sha256: str, audio_path: str, params: str, audio_meta: Dict[str, Any]) -> None:
+        # ultimo writer vince: con più worker sullo stesso audio il contenuto è equivalente
+        src = self.source(sha256)
+        src["sha256"] = sha256.lower()
+        path = os.path.abspath(audio_path)
+        prev = src.get("audio_path")
+        # il file temporaneo dell'API non sostituisce un path ancora valido (serve al backfill)
+        if not (prev and os.path.isfile(prev) and path.startswith(tempfile.gettempdir() + os.sep)):
+            src["audio_path"] = path
+        src.setdefault("audio", {})[params] = audio_meta
+        src["updated_at"] = datetime.now(timezone.utc).isoformat()
+        _write_json_atomic(os.path.join(self._dir(sha256), SOURCE_JSON), src)
+
+    def shas(self) -> Iterator[str]:
+        try:
+            prefixes = sorted(os.listdir(self.root))
+        except OSError:
+            return
+        for prefix in prefixes:
+            pdir = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(pdir):
+                continue
+            for sha in sorted(os.listdir(pdir)):
+                if os.path.isdir(os.path.join(pdir, sha)):
+                    yield sha
+
+    def entries(self, sha256: str) -> List[Tuple[str, str, str, str]]:
+        """(blocco, versione, params, path) delle entry di una traccia."""
+        out = []
+        d = self._dir(sha256)
+        try:
+            names = os.listdir(d)
+        except OSError:
+            return out
+        for name in names:
+            if not name.endswith(".json") or name == SOURCE_JSON or name.startswith(".tmp_"):
+                continue
+            parts = name[: -len(".json")].split("@")
+            if len(parts) == 3:
+                out.append((parts[0], parts[1], parts[2], os.path.join(d, name)))
+        return out
+
+
+def budget_bytes() -> int:
+    try:
+        mb = float(os.environ.get("TEKKIN_BLOCK_STORE_MB", str(DEFAULT_BUDGET_MB)) or 0)
+    except ValueError:
+        mb = 0.0
+    return int(max(0.0, mb) * 1024 * 1024)
+
+
+def store_enabled() -> bool:
+    if os.environ.get("TEKKIN_BLOCK_STORE", "1").strip().lower() in ("0", "false", "no", "off"):
+        return False
+    return budget_bytes() > 0
+
+
+_default_store: Optional[BlockStore] = None
+_default_store_lock = threading.Lock()
+
+
+def default_store() -> Optional[BlockStore]:
+    """Store del processo (stesso oggetto tra le richieste: il contatore di eviction è condiviso)."""
+    global _default_store
+    if not store_enabled():
+        return None
+    root = os.environ.get("TEKKIN_BLOCK_STORE_DIR") or os.path.join(tempfile.gettempdir(), "tekkin_block_store")
+    budget = budget_bytes()
+    with _default_store_lock:
+        if _default_store is None or _default_store.root != root or _default_store.budget_bytes != budget:
+            _default_store = BlockStore(root, budget)
+        return _default_store
+
+
+# ---------------------------------------------------------------------------
+# backfill
+# ---------------------------------------------------------------------------
+
+AUDIO_EXTS = (".wav", ".aiff", ".aif", ".flac", ".mp3", ".m4a", ".ogg")
+
+
+def _tracks_from_args(args: argparse.Namespace, store: BlockStore) -> List[Dict[str, Any]]:
+    tracks: List[Dict[str, Any]] = []
+    if args.manifest:
+        with open(args.manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    tracks.append(json.loads(line))
+    for p in args.audio or []:
+        p = os.path.expanduser(p)
+        files = []
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                files.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(AUDIO_EXTS))
+        elif os.path.isfile(p):
+            files.append(p)
+        tracks.extend({"version_id": Path(fp).stem, "audio_path": fp} for fp in files)
+    if not args.manifest and not args.audio:
+        for sha in store.shas():
+            src = store.source(sha)
+            tracks.append({"version_id": sha[:12], "sha256": sha, "audio_path": src.get("audio_path")})
+    return tracks
+
+
+def _download(url: str) -> str:
+    import httpx
+
+    suffix = os.path.splitext(url.split("?", 1)[0])[1] or ".bin"
+    fd, path = tempfile.mkstemp(prefix="tekkin_backfill_", suffix=suffix)
+    with os.fdopen(fd, "wb") as f, httpx.stream("GET", url, timeout=120.0, follow_redirects=True) as r:
+        r.raise_for_status()
+        for chunk in r.iter_bytes():
+            f.write(chunk)
+    return path
+
+
+def backfill(args: argparse.Namespace) -> int:
+    from tekkin_analyzer_v3.analyze_v3 import BLOCK_VERSIONS, V3_BLOCKS, AnalyzerV3Config, analyze_v3
+    from tekkin_analyzer_v3.utils.pcm_cache import sha256_file
+
+    store = default_store()
+    if store is None:
+        print("[ERR] TEKKIN_BLOCK_STORE disattivato", file=sys.stderr)
+        return 2
+    cfg = AnalyzerV3Config(sr=args.sr, max_seconds=args.max_seconds)
+    params = block_params(cfg.sr, cfg.max_seconds)
+    names = [name for name, _ in V3_BLOCKS]
+
+    tracks = _tracks_from_args(args, store)
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    per_block = {name: {"reused": 0, "computed": 0, "failed": 0} for name in names}
+    totals = {"tracks": len(tracks), "analyzed": 0, "up_to_date": 0, "skipped": 0, "decode_skipped": 0}
+    saved_ms = 0
+    spent_ms = 0
+    t_start = time.perf_counter()
+
+    for i, tr in enumerate(tracks, 1):
+        vid = str(tr.get("version_id") or f"track-{i}")
+        tmp_path = None
+        try:
+            audio_path = tr.get("audio_path")
+            sha = tr.get("sha256")
+            if not (audio_path and os.path.isfile(audio_path)):
+                audio_path = None
+                if tr.get("audio_url") and not args.dry_run:
+                    tmp_path = audio_path = _download(str(tr["audio_url"]))
+            if sha is None and audio_path:
+                sha = sha256_file(audio_path)
+
+            stale = [n for n in names if sha is None or store.get(sha, n, BLOCK_VERSIONS[n], params) is None]
+            if not stale:
+                totals["up_to_date"] += 1
+                for n in names:
+                    per_block[n]["reused"] += 1
+                print(f"[{i}/{len(tracks)}] {vid}: aggiornato")
+                # con --out-dir si riscrive comunque l'output (tutto dallo store, niente decode)
+                if not args.out_dir or args.dry_run:
+                    continue
+            elif args.dry_run:
+                for n in names:
+                    per_block[n]["computed" if n in stale else "reused"] += 1
+                print(f"[{i}/{len(tracks)}] {vid}: da ricalcolare {', '.join(stale)}")
+                continue
+            if audio_path is None and stale:
+                totals["skipped"] += 1
+                print(f"[{i}/{len(tracks)}] {vid}: audio non disponibile, salto")
+                continue
+
+            t0 = time.perf_counter()
+            res = analyze_v3(audio_path or "", profile_key=tr.get("profile_key") or args.profile_key, config=cfg, audio_sha256=sha)
+            took = int((time.perf_counter() - t0) * 1000)
+            inc = (res.get("meta") or {}).get("incremental") or {}
+            if stale:
+                totals["analyzed"] += 1
+                spent_ms += took
+                saved_ms += int(inc.get("saved_ms") or 0)
+                totals["decode_skipped"] += 1 if inc.get("decode_skipped") else 0
+                for n in inc.get("reused") or []:
+                    per_block[n]["reused"] += 1
+                for n in inc.get("computed") or []:
+                    ok = bool((res["blocks"].get(n) or {}).get("ok"))
+                    per_block[n]["computed" if ok else "failed"] += 1
+                print(f"[{i}/{len(tracks)}] {vid}: ricalcolati {', '.join(inc.get('computed') or []) or '-'} in {took} ms, risparmiati ~{inc.get('saved_ms', 0)} ms")
+            if args.out_dir:
+                with open(os.path.join(args.out_dir, f"{_safe(vid)}.json"), "w", encoding="utf-8") as f:
+                    json.dump(res, f, ensure_ascii=False, default=_json_default)
+        except Exception as e:
+            totals["skipped"] += 1
+            print(f"[{i}/{len(tracks)}] {vid}: errore {type(e).__name__}: {e}")
+        finally:
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    elapsed_ms = int((time.perf_counter() - t_start) * 1000)
+    full_ms = spent_ms + saved_ms
+    report = {
+        "params": params,
+        "versions": BLOCK_VERSIONS,
+        "totals": totals,
+        "blocks": per_block,
+        "spent_ms": spent_ms,
+        "saved_ms_estimate": saved_ms,
+        "saved_share": round(saved_ms / full_ms, 4) if full_ms > 0 else None,
+        "elapsed_ms": elapsed_ms,
+        "dry_run": bool(args.dry_run),
+    }
+    print("")
+    print(f"tracce {totals['tracks']}: analizzate {totals['analyzed']}, già aggiornate {totals['up_to_date']}, saltate {totals['skipped']}, decode evitati {totals['decode_skipped']}")
+    print(f"{'blocco':<16} {'versione':<30} {'riusati':>8} {'ricalc.':>8} {'falliti':>8}")
+    for n in names:
+        st = per_block[n]
+        print(f"{n:<16} {BLOCK_VERSIONS[n]:<30} {st['reused']:>8} {st['computed']:>8} {st['failed']:>8}")
+    if not args.dry_run:
+        share = f"{report['saved_share'] * 100:.0f}%" if report["saved_share"] is not None else "-"
+        print(f"tempo speso {spent_ms / 1000:.1f}s, risparmiato ~{saved_ms / 1000:.1f}s rispetto al ricalcolo completo ({share})")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+def stats(store: BlockStore, current: Dict[str, str]) -> Dict[str, Any]:
+    by_key: Dict[str, Dict[str, int]] = {}
+    tracks = 0
+    for sha in store.shas():
+        tracks += 1
+        for block, version, params, path in store.entries(sha):
+            key = f"{block}@{version}"
+            st = by_key.setdefault(key, {"entries": 0, "bytes": 0, "current": int(current.get(block) == version)})
+            st["entries"] += 1
+            try:
+                st["bytes"] += os.path.getsize(path)
+            except OSError:
+                pass
+    total = sum(st["bytes"] for st in by_key.values())
+    return {"root": store.root, "tracks": tracks, "bytes": total, "budget_bytes": store.budget_bytes, "blocks": by_key}
+
+
+def prune(store: BlockStore, current: Dict[str, str], dry_run: bool) -> Tuple[int, int]:
+    n, freed = 0, 0
+    for sha in store.shas():
+        for block, version, _, path in store.entries(sha):
+            if current.get(block) == version:
+                continue
+            try:
+                size = os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+                n += 1
+                freed += size
+            except OSError:
+                pass
+    return n, freed
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Store per blocco V3 (ricalcolo incrementale)")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    p_b = sub.add_parser("backfill", help="Ri-analizza le versioni ricalcolando solo i blocchi cambiati")
+    p_b.add_argument("--manifest", default=None, help="JSONL {version_id, audio_path|audio_url, sha256?, profile_key?}")
+    p_b.add_argument("--audio", nargs="*", help="file o cartelle audio (version_id = nome file)")
+    p_b.add_argument("--profile-key", default=None)
+    p_b.add_argument("--sr", type=int, default=44100)
+    p_b.add_argument("--max-seconds", type=float, default=None)
+    p_b.add_argument("--out-dir", default=None, help="salva l'output completo per versione")
+    p_b.add_argument("--dry-run", action="store_true", help="mostra solo cosa andrebbe ricalcolato")
+    p_b.add_argument("--report", default=None, help="report JSON")
+
+    sub.add_parser("stats", help="Entry e byte per blocco@versione")
+
+    p_p = sub.add_parser("prune", help="Elimina le entry di versioni non correnti")
+    p_p.add_argument("--dry-run", action="store_true")
+
+    p_e = sub.add_parser("evict", help="Applica il budget (TEKKIN_BLOCK_STORE_MB o --mb) eliminando le entry meno recenti")
+    p_e.add_argument("--mb", type=float, default=None)
+
+    args = p.parse_args()
+
+    if args.cmd == "backfill":
+        return backfill(args)
+
+    from tekkin_analyzer_v3.analyze_v3 import BLOCK_VERSIONS
+
+    store = default_store()
+    if store is None:
+        print("[ERR] TEKKIN_BLOCK_STORE disattivato", file=sys.stderr)
+        return 2
+    current = {name: _safe(v) for name, v in BLOCK_VERSIONS.items()}
+    if args.cmd == "stats":
+        print(json.dumps(stats(store, current), indent=2))
+    elif args.cmd == "evict":
+        budget = int(args.mb * 1024 * 1024) if args.mb is not None else None
+        n, freed = store.evict(budget)
+        print(f"eliminate: {n} entry, {freed / 1e6:.1f} MB")
+    else:
+        n, freed = prune(store, current, args.dry_run)
+        print(f"{'da eliminare' if args.dry_run else 'eliminate'}: {n} entry, {freed / 1e6:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,6 +3,10 @@ from __future__ import annotations
 from typing import Any, Dict, List, Optional
 import numpy as np
 
+from tekkin_analyzer_v3.utils.es_pool import algorithm
+
+BLOCK_VERSION = "1"
+
 
 def _to_mono(audio: np.ndarray) -> np.ndarray:
     if audio.ndim == 2 and audio.shape[1] >= 2:
@@ -25,20 +29,20 @@ def analyze_extra(audio: np.ndarray, sr: int) -> Dict[str, Any]:
     frame_size = 2048
     hop_size = 1024
 
-    w = es.Windowing(type="hann")
-    spec = es.Spectrum(size=frame_size)
+    w = algorithm("Windowing", type="hann")
+    spec = algorithm("Spectrum", size=frame_size)
 
     # MFCC: prendiamo mean e std su tutto il brano (13 coeff)
-    mfcc_alg = es.MFCC(numberCoefficients=13)
+    mfcc_alg = algorithm("MFCC", numberCoefficients=13)
 
     # HFC e SpectralPeaks: possono non esserci su tutte le build, ma nel tuo container dovrebbero
     try:
-        hfc_alg = es.HFC()
+        hfc_alg = algorithm("HFC")
     except Exception:
         hfc_alg = None
 
     try:
-        peaks_alg = es.SpectralPeaks(sampleRate=sr, maxPeaks=10)
+        peaks_alg = algorithm("SpectralPeaks", sampleRate=sr, maxPeaks=10)
     except Exception:
         peaks_alg = None
 
@@ -4,6 +4,10 @@ from typing import Any, Dict, List, Optional, Tuple
 import math
 import numpy as np
 
+from tekkin_analyzer_v3.utils.es_pool import algorithm
+
+BLOCK_VERSION = "1"
+
 
 def _lin_to_dbfs(x: float) -> Optional[float]:
     if x <= 0:
@@ -164,7 +168,7 @@ def analyze_loudness(audio: np.ndarray, sr: int) -> Dict[str, Any]:
 
     import essentia.standard as es
 
-    loud = es.LoudnessEBUR128(sampleRate=sr)
+    loud = algorithm("LoudnessEBUR128", sampleRate=sr)
     y = loud(stereo)
 
     # questa build ritorna 4 elementi: 2 ndarray + 2 float
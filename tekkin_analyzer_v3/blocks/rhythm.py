@@ -3,6 +3,15 @@ from __future__ import annotations
 from typing import Any, Dict, List
 import numpy as np
 
+from tekkin_analyzer_v3.utils.chroma import analyze_chroma
+from tekkin_analyzer_v3.utils.es_pool import algorithm
+from tekkin_analyzer_v3.utils.tempo import DEFAULT_BPM_RANGE, DEFAULT_ENGINE, estimate_tempo, shared_pyramid
+
+# engine e range del tempo (env) cambiano bpm e beat: fanno parte della versione
+BLOCK_VERSION = f"2+{DEFAULT_ENGINE}-{DEFAULT_BPM_RANGE[0]:g}-{DEFAULT_BPM_RANGE[1]:g}"
+
+KEY_PROFILES = ("temperley", "bgate", "edma")
+
 
 def _to_mono(audio: np.ndarray) -> np.ndarray:
     if audio.ndim == 2 and audio.shape[1] >= 2:
@@ -34,7 +43,8 @@ def analyze_rhythm(audio: np.ndarray, sr: int) -> Dict[str, Any]:
 
     out: Dict[str, Any] = {
         "bpm": None,
-        "bpm_confidence": None,  # raw, non 0-1
+        "bpm_confidence": None,  # nativa dell'engine (accurate: raw 0..5.32, fast: 0-1)
+        "bpm_confidence_unit": None,  # 0-1 con qualsiasi engine
         "beat_times": None,
         "beat_times_raw": None,
         "stability": None,
@@ -43,26 +53,30 @@ def analyze_rhythm(audio: np.ndarray, sr: int) -> Dict[str, Any]:
         "descriptors": None,
     }
 
-    # Rhythm extractor (ret variabile tra build)
-    rex = es.RhythmExtractor2013(method="multifeature")
-    ret = rex(mono)
+    # piramide dell'analisi (analyze_v3 apre lo scope): il livello pieno è il mono
+    pyramid = shared_pyramid(mono, sr)
+    mono = pyramid.full
 
-    bpm = ret[0] if len(ret) > 0 else None
-    ticks = ret[1] if len(ret) > 1 else []
-    confidence = ret[2] if len(ret) > 2 else None
+    # Tempo: engine "accurate" (RhythmExtractor2013 multifeature, default) o
+    # "fast" (onset + autocorrelazione sul livello a 11 kHz), vedi utils/tempo.py
+    tempo = estimate_tempo(mono, sr, pyramid=pyramid)
 
-    out["bpm"] = None if bpm is None else float(bpm)
-    out["bpm_confidence"] = None if confidence is None else float(confidence)
+    out["bpm"] = tempo["bpm"]
+    out["bpm_confidence"] = tempo["confidence"]
+    out["bpm_confidence_unit"] = tempo["confidence_unit"]
+    ticks = tempo["beats"]
 
     ticks = np.asarray(ticks, dtype=np.float64).reshape(-1)
     ticks_list = [float(t) for t in ticks]
     out["beat_times_raw"] = ticks_list
     out["beat_times"] = _downsample_list(ticks_list, max_points=256, round_ndigits=3)
 
-    # Stabilità (ibi std)
+    # Stabilità (ibi std): l'engine fast produce una griglia a tempo costante,
+    # quindi la stabilità ha senso solo con i beat tracciati da accurate
     if ticks.size >= 3:
         ibi = np.diff(ticks)
-        out["stability"] = float(np.std(ibi))
+        if tempo["engine"] == "accurate":
+            out["stability"] = float(np.std(ibi))
         out["descriptors"] = {
             "ibi_mean": float(np.mean(ibi)),
             "ibi_std": float(np.std(ibi)),
@@ -70,10 +84,12 @@ def analyze_rhythm(audio: np.ndarray, sr: int) -> Dict[str, Any]:
         }
     elif ticks.size > 0:
         out["descriptors"] = {"beats_count": int(ticks.size)}
+    out["descriptors"] = out.get("descriptors") or {}
+    out["descriptors"]["tempo_engine"] = tempo["engine"]
 
     # Danceability: Essentia ritorna (value, curve) oppure value
     try:
-        d_alg = es.Danceability()
+        d_alg = algorithm("Danceability")
         val = d_alg(mono)
         if isinstance(val, (tuple, list)) and len(val) > 0:
             out["danceability"] = float(val[0])
@@ -82,27 +98,24 @@ def analyze_rhythm(audio: np.ndarray, sr: int) -> Dict[str, Any]:
     except Exception:
         out["danceability"] = None
 
-    # KEY (formato Tekkin "Ab minor")
+    # KEY (formato Tekkin "Ab minor"): un solo HPCP, profilo temperley
+    # come prima scelta, default (bgate) ed edma dallo stesso cromagramma
     try:
-        # tentativo 1: profile temperley (senza parametri non supportati)
-        try:
-            kex = es.KeyExtractor(profileType="temperley")
-            key, scale, strength = kex(mono)
-            if key is not None and scale is not None:
-                out["key"] = f"{str(key)} {str(scale)}"
-            out["descriptors"] = out.get("descriptors") or {}
-            out["descriptors"]["key_strength"] = float(strength) if strength is not None else None
-            out["descriptors"]["key_profile"] = "temperley"
-        except Exception as e1:
-            # fallback 2: default constructor (massima compatibilità)
-            kex2 = es.KeyExtractor()
-            key2, scale2, strength2 = kex2(mono)
-            if key2 is not None and scale2 is not None:
-                out["key"] = f"{str(key2)} {str(scale2)}"
-            out["descriptors"] = out.get("descriptors") or {}
-            out["descriptors"]["key_strength"] = float(strength2) if strength2 is not None else None
-            out["descriptors"]["key_profile"] = "default"
-            out["descriptors"]["key_fallback_from"] = f"{type(e1).__name__}"
+        chroma = analyze_chroma(mono, sr, profiles=KEY_PROFILES)
+        profile = next((p for p in KEY_PROFILES if chroma.key(p) is not None), None)
+        if profile is None:
+            raise RuntimeError("nessun profilo di tonalità disponibile")
+        key, scale, strength = chroma.key(profile)
+        if key and scale:
+            out["key"] = f"{key} {scale}"
+        out["descriptors"] = out.get("descriptors") or {}
+        out["descriptors"]["key_strength"] = float(strength) if strength is not None else None
+        out["descriptors"]["key_profile"] = "default" if profile == "bgate" else profile
+        if profile != KEY_PROFILES[0]:
+            out["descriptors"]["key_fallback_from"] = "temperley"
+        out["descriptors"]["key_alternatives"] = {
+            p: f"{k} {sc}" for p, (k, sc, _st) in chroma.keys.items() if p != profile
+        }
     except Exception as e:
         out["descriptors"] = out.get("descriptors") or {}
         out["descriptors"]["key_error"] = f"{type(e).__name__}: {e}"
@@ -4,6 +4,10 @@ from typing import Any, Dict, List, Tuple
 import math
 import numpy as np
 
+from tekkin_analyzer_v3.utils.es_pool import algorithm
+
+
+BLOCK_VERSION = "1"
 
 BAND_KEYS = ["sub", "low", "lowmid", "mid", "presence", "high", "air"]
 BAND_EDGES_HZ = [20.0, 60.0, 200.0, 500.0, 2000.0, 5000.0, 10000.0, 20000.0]
@@ -100,8 +104,8 @@ def analyze_stereo(audio: np.ndarray, sr: int) -> Dict[str, Any]:
     except Exception as e:
         raise RuntimeError("Essentia non disponibile nell'ambiente Python corrente.") from e
 
-    window = es.Windowing(type="hann")
-    spectrum = es.Spectrum(size=frame_size)
+    window = algorithm("Windowing", type="hann")
+    spectrum = algorithm("Spectrum", size=frame_size)
     hz_bins = np.linspace(0.0, sr / 2.0, num=(frame_size // 2) + 1)
 
     # Arrays raw
@@ -3,6 +3,10 @@ from __future__ import annotations
 from typing import Any, Dict, List, Tuple
 import numpy as np
 
+from tekkin_analyzer_v3.utils.es_pool import algorithm
+
+
+BLOCK_VERSION = "1"
 
 BAND_KEYS = ["sub", "low", "lowmid", "mid", "presence", "high", "air"]
 BAND_EDGES_HZ = [20.0, 60.0, 200.0, 500.0, 2000.0, 5000.0, 10000.0, 20000.0]
@@ -93,8 +97,8 @@ def analyze_timbre_spectrum(audio: np.ndarray, sr: int) -> Dict[str, Any]:
     frame_size = 4096
     hop_size = 2048
 
-    window = es.Windowing(type="hann")
-    spectrum = es.Spectrum(size=frame_size)
+    window = algorithm("Windowing", type="hann")
+    spectrum = algorithm("Spectrum", size=frame_size)
 
     hz_bins = np.linspace(0.0, sr / 2.0, num=(frame_size // 2) + 1).astype(np.float64)
 
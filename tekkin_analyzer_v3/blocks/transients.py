@@ -4,6 +4,8 @@ from typing import Any, Dict, List, Optional
 import math
 import numpy as np
 
+BLOCK_VERSION = "1"
+
 
 def _to_mono(audio: np.ndarray) -> np.ndarray:
     if audio.ndim == 2 and audio.shape[1] >= 2:
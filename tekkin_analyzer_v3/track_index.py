@@ -0,0 +1,961 @@
+#!/usr/bin/env python3
+"""
+Indice nearest-neighbour persistente sulle tracce analizzate con V3.
+
+Embedding compatto per traccia (EMBEDDING_KEYS):
+  - extra.mfcc.mean / extra.mfcc.std (13 + 13)
+  - timbre_spectrum.bands_norm (7)
+  - timbre_spectrum.spectral scalari (5, Hz in log1p)
+
+Ricerca coseno su feature standardizzate (mean/scale congelati al train),
+con pesi per gruppo cosi' i 26 coefficienti MFCC non schiacciano bande e spettro.
+
+Modalita':
+  - "exact": brute force su tutta la matrice (riferimento per la recall)
+  - "approx": IVF (k-means sferico, nlist ~ sqrt(n)), visita solo nprobe liste
+
+Persistenza in una cartella:
+  snapshot.npz  (matrice raw, stats, centroidi + ids/meta in "info": un solo
+                 file, sostituito con un rename atomico)
+  log.jsonl     (upsert/delete incrementali, riapplicati al load)
+  .lock         (flock: più processi sulla stessa cartella)
+Le cartelle nel vecchio formato (snapshot.npz + snapshot.json) si leggono
+ancora e passano al nuovo formato alla prima compattazione.
+
+Più processi (worker prefork di tekkin_analyzer_server.py) possono aprire la
+stessa cartella: le scritture prendono il lock esclusivo e prima di scrivere
+riallineano lo stato (snapshot nuovo o righe di log aggiunte da altri), la
+compattazione riscrive quindi anche le righe degli altri worker; le ricerche
+prendono il lock condiviso e leggono solo il log nuovo.
+
+Con background=True (API) retrain e compattazione non girano dentro
+l'upsert: un thread di manutenzione li esegue quando si supera la soglia,
+e il k-means gira fuori dai lock.
+
+CLI:
+  python -m tekkin_analyzer_v3.track_index add --index-dir idx res1.json res2.json
+  python -m tekkin_analyzer_v3.track_index query --index-dir idx --id <version_id> -k 10
+  python -m tekkin_analyzer_v3.track_index bench --synthetic 100000 -k 10
+"""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+REPO_ROOT = str(Path(__file__).resolve().parent.parent)
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi (un solo processo per cartella)
+    fcntl = None
+
+
+EMBEDDING_VERSION = "v1"
+
+BAND_KEYS = ["sub", "low", "lowmid", "mid", "presence", "high", "air"]
+SPECTRAL_KEYS = [
+    "spectral_centroid_hz",
+    "spectral_rolloff_hz",
+    "spectral_bandwidth_hz",
+    "spectral_flatness",
+    "zero_crossing_rate",
+]
+SPECTRAL_LOG_KEYS = {"spectral_centroid_hz", "spectral_rolloff_hz", "spectral_bandwidth_hz"}
+N_MFCC = 13
+
+EMBEDDING_KEYS: List[str] = (
+    [f"mfcc_mean_{i}" for i in range(N_MFCC)]
+    + [f"mfcc_std_{i}" for i in range(N_MFCC)]
+    + [f"band_{k}" for k in BAND_KEYS]
+    + list(SPECTRAL_KEYS)
+)
+EMBEDDING_DIM = len(EMBEDDING_KEYS)
+
+# Ogni gruppo pesa uguale nel coseno: peso per dimensione = 1/sqrt(dimensione gruppo)
+_GROUP_SIZES = [N_MFCC, N_MFCC, len(BAND_KEYS), len(SPECTRAL_KEYS)]
+GROUP_WEIGHTS = np.concatenate(
+    [np.full(n, 1.0 / math.sqrt(n), dtype=np.float32) for n in _GROUP_SIZES]
+)
+
+# Sotto questa soglia l'indice resta brute force (gia' sub-millisecondo).
+IVF_MIN_TRACKS = 2048
+DEFAULT_NPROBE = 12
+KMEANS_ITERS = 12
+KMEANS_SAMPLE_PER_LIST = 64
+
+SNAPSHOT_NPZ = "snapshot.npz"
+SNAPSHOT_JSON = "snapshot.json"  # formato precedente (npz + json separati), solo lettura
+LOG_JSONL = "log.jsonl"
+LOCK_FILE = ".lock"
+
+
+def _get_in(d: Any, path: str) -> Any:
+    cur = d
+    for part in path.split("."):
+        if not isinstance(cur, dict):
+            return None
+        cur = cur.get(part)
+    return cur
+
+
+def _float_or_nan(x: Any) -> float:
+    try:
+        if x is None or isinstance(x, bool):
+            return math.nan
+        v = float(x)
+        return v if math.isfinite(v) else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def embedding_from_blocks(
+    extra: Optional[Dict[str, Any]],
+    timbre: Optional[Dict[str, Any]],
+) -> Optional[np.ndarray]:
+    """
+    Embedding float32 (EMBEDDING_DIM,) dai dati di analyze_extra e analyze_timbre_spectrum.
+    None se mancano MFCC o bands_norm. Gli scalari spettrali mancanti restano NaN
+    (= media del catalogo dopo la standardizzazione).
+    """
+    extra = extra if isinstance(extra, dict) else {}
+    timbre = timbre if isinstance(timbre, dict) else {}
+
+    mfcc = extra.get("mfcc") if isinstance(extra.get("mfcc"), dict) else {}
+    mean = mfcc.get("mean")
+    std = mfcc.get("std")
+    if not isinstance(mean, list) or not isinstance(std, list):
+        return None
+    if len(mean) < N_MFCC or len(std) < N_MFCC:
+        return None
+
+    bands = timbre.get("bands_norm")
+    if not isinstance(bands, dict):
+        return None
+
+    spectral = timbre.get("spectral") if isinstance(timbre.get("spectral"), dict) else {}
+
+    vec = np.empty(EMBEDDING_DIM, dtype=np.float32)
+    vec[:N_MFCC] = [_float_or_nan(x) for x in mean[:N_MFCC]]
+    vec[N_MFCC : 2 * N_MFCC] = [_float_or_nan(x) for x in std[:N_MFCC]]
+    off = 2 * N_MFCC
+    vec[off : off + len(BAND_KEYS)] = [_float_or_nan(bands.get(k)) for k in BAND_KEYS]
+    off += len(BAND_KEYS)
+    for i, k in enumerate(SPECTRAL_KEYS):
+        v = _float_or_nan(spectral.get(k))
+        if k in SPECTRAL_LOG_KEYS and math.isfinite(v):
+            v = math.log1p(max(v, 0.0))
+        vec[off + i] = v
+
+    if not np.all(np.isfinite(vec[: 2 * N_MFCC + len(BAND_KEYS)])):
+        return None
+    return vec
+
+
+def embedding_from_v3(result: Dict[str, Any]) -> Optional[np.ndarray]:
+    """Embedding dall'output completo di analyze_v3 (dict con "blocks")."""
+    return embedding_from_blocks(
+        _get_in(result, "blocks.extra.data"),
+        _get_in(result, "blocks.timbre_spectrum.data"),
+    )
+
+
+def _l2_normalize_rows(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    np.maximum(norms, 1e-12, out=norms)
+    return x / norms
+
+
+def _spherical_kmeans(
+    x: np.ndarray,
+    n_clusters: int,
+    *,
+    iters: int = KMEANS_ITERS,
+    seed: int = 0,
+) -> np.ndarray:
+    """k-means sferico (x gia' L2-normalizzato). Ritorna centroidi normalizzati (k, d)."""
+    rng = np.random.default_rng(seed)
+    n = x.shape[0]
+    n_clusters = max(1, min(int(n_clusters), n))
+    centroids = x[rng.choice(n, size=n_clusters, replace=False)].copy()
+
+    for _ in range(max(1, iters)):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = counts == 0
+        if np.any(empty):
+            # liste vuote: riparti da punti casuali
+            sums[empty] = x[rng.choice(n, size=int(empty.sum()), replace=True)]
+        centroids = _l2_normalize_rows(sums)
+
+    return centroids.astype(np.float32, copy=False)
+
+
+class TrackIndex:
+    """
+    Indice coseno su embedding V3, thread-safe, con upsert incrementale.
+
+    Le statistiche di standardizzazione e i centroidi IVF vengono ricalcolati
+    (train) quando il numero di tracce raddoppia rispetto all'ultimo train:
+    costo ammortizzato O(1) per insert. Tra un train e l'altro i nuovi vettori
+    usano le statistiche congelate.
+
+    background=True sposta retrain e compattazione su un thread di
+    manutenzione: upsert scrive solo la riga di log.
+    """
+
+    def __init__(
+        self,
+        index_dir: Optional[str] = None,
+        *,
+        nprobe: int = DEFAULT_NPROBE,
+        background: bool = False,
+    ):
+        self.index_dir = Path(index_dir) if index_dir else None
+        self.nprobe = int(nprobe)
+        self.background = bool(background)
+
+        self._lock = threading.RLock()
+        self._flock_fd: Optional[int] = None
+        self._maint_thread: Optional[threading.Thread] = None
+        self._maint_again = False
+        self._reset()
+
+        if self.index_dir is not None:
+            with self._lock, self._dir_lock(exclusive=False):
+                self._load()
+
+    def _reset(self) -> None:
+        self._ids: List[str] = []
+        self._metas: List[Dict[str, Any]] = []
+        self._row_of: Dict[str, int] = {}
+        self._raw = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self._vecs = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self._n = 0
+
+        self._mean = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+        self._scale = np.ones(EMBEDDING_DIM, dtype=np.float32)
+        self._trained_n = 0
+
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self._lists: List[List[int]] = []
+
+        self._log_rows = 0
+        # posizione nel log già applicata e snapshot su cui si basa lo stato
+        self._log_pos = 0
+        self._snapshot_gen: Optional[Tuple[int, int, int]] = None
+
+    # ---------- stato ----------
+
+    def __len__(self) -> int:
+        with self._lock, self._dir_lock(exclusive=False):
+            self._sync()
+            return self._n
+
+    def __contains__(self, track_id: str) -> bool:
+        with self._lock, self._dir_lock(exclusive=False):
+            self._sync()
+            return track_id in self._row_of
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock, self._dir_lock(exclusive=False):
+            self._sync()
+            return {
+                "tracks": self._n,
+                "dim": EMBEDDING_DIM,
+                "embedding_version": EMBEDDING_VERSION,
+                "trained_n": self._trained_n,
+                "ivf_lists": 0 if self._centroids is None else int(self._centroids.shape[0]),
+                "nprobe": self.nprobe,
+                "log_rows": self._log_rows,
+                "index_dir": str(self.index_dir) if self.index_dir else None,
+            }
+
+    def get_vector(self, track_id: str) -> Optional[np.ndarray]:
+        with self._lock, self._dir_lock(exclusive=False):
+            self._sync()
+            row = self._row_of.get(track_id)
+            return None if row is None else self._raw[row].copy()
+
+    def get_meta(self, track_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock, self._dir_lock(exclusive=False):
+            self._sync()
+            row = self._row_of.get(track_id)
+            return None if row is None else dict(self._metas[row])
+
+    # ---------- trasformazioni ----------
+
+    def _transform(self, raw: np.ndarray) -> np.ndarray:
+        z = (raw - self._mean) / self._scale
+        z[~np.isfinite(z)] = 0.0
+        z *= GROUP_WEIGHTS
+        return _l2_normalize_rows(z.reshape(-1, EMBEDDING_DIM)).astype(np.float32, copy=False)
+
+    def _ensure_capacity(self, n: int) -> None:
+        cap = self._raw.shape[0]
+        if n <= cap:
+            return
+        new_cap = max(n, 2 * cap, 64)
+        raw = np.empty((new_cap, EMBEDDING_DIM), dtype=np.float32)
+        vecs = np.empty((new_cap, EMBEDDING_DIM), dtype=np.float32)
+        assign = np.zeros(new_cap, dtype=np.int32)
+        raw[: self._n] = self._raw[: self._n]
+        vecs[: self._n] = self._vecs[: self._n]
+        assign[: self._n] = self._assign[: self._n]
+        self._raw, self._vecs, self._assign = raw, vecs, assign
+
+    # ---------- train ----------
+
+    def train(self) -> None:
+        """Ricalcola standardizzazione e (se n >= IVF_MIN_TRACKS) i centroidi IVF."""
+        with self._lock:
+            raw = self._raw[: self._n].copy()
+        params = self._fit(raw)
+        with self._lock:
+            self._apply_fit(*params)
+
+    def _fit(self, raw: np.ndarray) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], int]:
+        """Statistiche e centroidi da una copia di raw: nessuno stato toccato, gira fuori dai lock."""
+        n = raw.shape[0]
+        mean, scale = self._mean, self._scale
+        if n >= 2:
+            with np.errstate(invalid="ignore"):
+                m = np.nanmean(raw, axis=0)
+                sd = np.nanstd(raw, axis=0)
+            mean = np.where(np.isfinite(m), m, 0.0).astype(np.float32)
+            scale = np.where(np.isfinite(sd) & (sd > 1e-9), sd, 1.0).astype(np.float32)
+
+        centroids = None
+        if n >= IVF_MIN_TRACKS:
+            z = (raw - mean) / scale
+            z[~np.isfinite(z)] = 0.0
+            z *= GROUP_WEIGHTS
+            vecs = _l2_normalize_rows(z).astype(np.float32, copy=False)
+            n_lists = int(round(math.sqrt(n)))
+            rng = np.random.default_rng(n)
+            n_sample = min(n, n_lists * KMEANS_SAMPLE_PER_LIST)
+            sample = vecs[rng.choice(n, size=n_sample, replace=False)]
+            centroids = _spherical_kmeans(sample, n_lists, seed=n)
+        return mean, scale, centroids, n
+
+    def _apply_fit(
+        self, mean: np.ndarray, scale: np.ndarray, centroids: Optional[np.ndarray], trained_n: int
+    ) -> None:
+        """Installa il risultato di _fit (sotto self._lock); riproietta anche le righe arrivate nel frattempo."""
+        n = self._n
+        self._mean = mean
+        self._scale = scale
+        if n:
+            self._vecs[:n] = self._transform(self._raw[:n])
+        self._trained_n = trained_n
+
+        self._centroids = centroids
+        self._lists = []
+        if centroids is not None:
+            self._assign[:n] = self._nearest_list(self._vecs[:n])
+            self._lists = [[] for _ in range(centroids.shape[0])]
+            for row, lst in enumerate(self._assign[:n].tolist()):
+                self._lists[lst].append(row)
+
+    def _nearest_list(self, vecs: np.ndarray) -> np.ndarray:
+        assert self._centroids is not None
+        out = np.empty(vecs.shape[0], dtype=np.int32)
+        step = 8192
+        for i0 in range(0, vecs.shape[0], step):
+            out[i0 : i0 + step] = np.argmax(vecs[i0 : i0 + step] @ self._centroids.T, axis=1)
+        return out
+
+    def _needs_retrain(self) -> bool:
+        return self._n >= 2 and self._n >= 2 * max(self._trained_n, 1)
+
+    def _needs_compaction(self) -> bool:
+        # compatta quando il log supera 1/4 dello snapshot (min 1000 righe)
+        return self.index_dir is not None and self._log_rows >= max(1000, self._n // 4)
+
+    def _maybe_retrain(self) -> None:
+        if not self._needs_retrain():
+            return
+        if self.background:
+            self._schedule_maintenance()
+        else:
+            self.train()
+
+    # ---------- manutenzione in background ----------
+
+    def _schedule_maintenance(self) -> None:
+        """Avvia il thread di manutenzione (sotto self._lock); se gira già, ripete un giro."""
+        if self._maint_thread is not None:
+            self._maint_again = True
+            return
+        self._maint_thread = threading.Thread(
+            target=self._maintenance_worker, name="track-index-maintenance", daemon=True
+        )
+        self._maint_thread.start()
+
+    def _maintenance_worker(self) -> None:
+        log = logging.getLogger("tekkin-track-index")
+        while True:
+            try:
+                self.maintain()
+            except Exception as exc:
+                log.warning("[track-index] manutenzione fallita: %s", exc)
+            with self._lock:
+                if not self._maint_again:
+                    self._maint_thread = None
+                    return
+                self._maint_again = False
+
+    def maintain(self) -> None:
+        """Retrain e compattazione se servono. Il k-means gira senza lock: upsert e ricerche proseguono."""
+        with self._lock, self._dir_lock(exclusive=False):
+            self._sync()
+            raw = self._raw[: self._n].copy() if self._needs_retrain() else None
+        if raw is not None:
+            params = self._fit(raw)
+            with self._lock:
+                self._apply_fit(*params)
+        with self._lock:
+            compact = self._needs_compaction()
+        if compact:
+            self.save()
+
+    def wait_maintenance(self, timeout: Optional[float] = None) -> None:
+        """Attende il thread di manutenzione in corso (test, shutdown)."""
+        t = self._maint_thread
+        if t is not None:
+            t.join(timeout)
+
+    # ---------- upsert / delete ----------
+
+    def _upsert_row(self, track_id: str, raw: np.ndarray, meta: Dict[str, Any]) -> None:
+        row = self._row_of.get(track_id)
+        vec = self._transform(raw.reshape(1, -1))[0]
+
+        if row is None:
+            row = self._n
+            self._ensure_capacity(row + 1)
+            self._ids.append(track_id)
+            self._metas.append(meta)
+            self._row_of[track_id] = row
+            self._n += 1
+        else:
+            self._metas[row] = meta
+            if self._centroids is not None:
+                self._lists[int(self._assign[row])].remove(row)
+
+        self._raw[row] = raw
+        self._vecs[row] = vec
+        if self._centroids is not None:
+            lst = int(np.argmax(self._centroids @ vec))
+            self._assign[row] = lst
+            self._lists[lst].append(row)
+
+    def _delete_row(self, track_id: str) -> bool:
+        row = self._row_of.pop(track_id, None)
+        if row is None:
+            return False
+        last = self._n - 1
+
+        if self._centroids is not None:
+            self._lists[int(self._assign[row])].remove(row)
+
+        if row != last:
+            # swap-remove: l'ultima riga prende il posto di quella cancellata
+            moved_id = self._ids[last]
+            self._ids[row] = moved_id
+            self._metas[row] = self._metas[last]
+            self._raw[row] = self._raw[last]
+            self._vecs[row] = self._vecs[last]
+            self._row_of[moved_id] = row
+            if self._centroids is not None:
+                lst = self._lists[int(self._assign[last])]
+                lst[lst.index(last)] = row
+                self._assign[row] = self._assign[last]
+
+        self._ids.pop()
+        self._metas.pop()
+        self._n -= 1
+        return True
+
+    def upsert(
+        self,
+        track_id: str,
+        embedding: Sequence[float],
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Inserisce o aggiorna una traccia. Idempotente per track_id."""
+        raw = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if raw.size != EMBEDDING_DIM:
+            raise ValueError(f"embedding dim {raw.size} != {EMBEDDING_DIM}")
+        meta = dict(meta or {})
+        with self._lock, self._dir_lock(exclusive=True):
+            self._sync()
+            self._upsert_row(str(track_id), raw, meta)
+            self._append_log({"op": "upsert", "id": str(track_id), "vec": _vec_to_json(raw), "meta": meta})
+            self._maybe_retrain()
+
+    def upsert_many(self, items: Sequence[Tuple[str, Sequence[float], Optional[Dict[str, Any]]]]) -> int:
+        """Upsert in blocco: un solo retrain/compact alla fine."""
+        entries: List[Dict[str, Any]] = []
+        with self._lock, self._dir_lock(exclusive=True):
+            self._sync()
+            for track_id, embedding, meta in items:
+                raw = np.asarray(embedding, dtype=np.float32).reshape(-1)
+                if raw.size != EMBEDDING_DIM:
+                    raise ValueError(f"embedding dim {raw.size} != {EMBEDDING_DIM}")
+                meta_d = dict(meta or {})
+                self._upsert_row(str(track_id), raw, meta_d)
+                entries.append({"op": "upsert", "id": str(track_id), "vec": _vec_to_json(raw), "meta": meta_d})
+            self._append_log_many(entries)
+            self._maybe_retrain()
+        return len(entries)
+
+    def delete(self, track_id: str) -> bool:
+        with self._lock, self._dir_lock(exclusive=True):
+            self._sync()
+            ok = self._delete_row(str(track_id))
+            if ok:
+                self._append_log({"op": "delete", "id": str(track_id)})
+            return ok
+
+    # ---------- ricerca ----------
+
+    def search(
+        self,
+        *,
+        embedding: Optional[Sequence[float]] = None,
+        track_id: Optional[str] = None,
+        k: int = 10,
+        mode: str = "approx",
+        nprobe: Optional[int] = None,
+        source: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Top-k per similarita' coseno.
+        - embedding oppure track_id (gia' indicizzato, escluso dai risultati)
+        - mode: "approx" (IVF) | "exact" (brute force)
+        - source: filtra su meta["source"] (es. "reference")
+        """
+        if mode not in ("approx", "exact"):
+            raise ValueError(f"mode non valido: {mode}")
+
+        with self._lock, self._dir_lock(exclusive=False):
+            self._sync()
+            n = self._n
+            exclude_row = -1
+            if track_id is not None:
+                row = self._row_of.get(str(track_id))
+                if row is None:
+                    raise KeyError(track_id)
+                q = self._vecs[row].copy()
+                exclude_row = row
+            elif embedding is not None:
+                raw = np.asarray(embedding, dtype=np.float32).reshape(-1)
+                if raw.size != EMBEDDING_DIM:
+                    raise ValueError(f"embedding dim {raw.size} != {EMBEDDING_DIM}")
+                q = self._transform(raw.reshape(1, -1))[0]
+            else:
+                raise ValueError("serve embedding oppure track_id")
+
+            if n == 0 or k <= 0:
+                return []
+
+            if mode == "approx" and self._centroids is not None:
+                n_probe = max(1, min(int(nprobe or self.nprobe), self._centroids.shape[0]))
+                c_scores = self._centroids @ q
+                probe = np.argpartition(-c_scores, n_probe - 1)[:n_probe]
+                parts = [self._lists[int(p)] for p in probe]
+                cand = np.fromiter(
+                    (r for lst in parts for r in lst), dtype=np.int64, count=sum(len(p) for p in parts)
+                )
+                full_scan = False
+            else:
+                cand = np.arange(n, dtype=np.int64)
+                full_scan = True
+
+            if source is not None:
+                keep = np.fromiter(
+                    (self._metas[int(r)].get("source") == source for r in cand), dtype=bool, count=cand.size
+                )
+                cand = cand[keep]
+                full_scan = False
+            if exclude_row >= 0:
+                full_scan = False
+                cand = cand[cand != exclude_row]
+            if cand.size == 0:
+                return []
+
+            # brute force senza filtri: niente fancy-indexing (evita la copia della matrice)
+            scores = self._vecs[:n] @ q if full_scan else self._vecs[cand] @ q
+            kk = min(int(k), cand.size)
+            top = np.argpartition(-scores, kk - 1)[:kk] if kk < cand.size else np.arange(cand.size)
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            return [
+                {
+                    "id": self._ids[int(cand[i])],
+                    "score": float(scores[i]),
+                    "meta": dict(self._metas[int(cand[i])]),
+                }
+                for i in top
+            ]
+
+    # ---------- persistenza ----------
+
+    def _paths(self) -> Tuple[Path, Path, Path]:
+        assert self.index_dir is not None
+        return (
+            self.index_dir / SNAPSHOT_NPZ,
+            self.index_dir / SNAPSHOT_JSON,
+            self.index_dir / LOG_JSONL,
+        )
+
+    @contextlib.contextmanager
+    def _dir_lock(self, exclusive: bool):
+        """
+        flock su <index_dir>/.lock, da prendere dentro self._lock. Rientrante
+        nello stesso processo (save() chiamato da un upsert riusa il lock).
+        """
+        if self.index_dir is None or fcntl is None or self._flock_fd is not None:
+            yield
+            return
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.index_dir / LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._flock_fd = fd
+            yield
+        finally:
+            self._flock_fd = None
+            os.close(fd)  # rilascia anche il flock
+
+    def _disk_generation(self) -> Optional[Tuple[int, int, int]]:
+        npz_path, _, _ = self._paths()
+        try:
+            st = npz_path.stat()
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _sync(self) -> None:
+        """Riallinea lo stato alle scritture di altri processi sulla stessa cartella."""
+        if self.index_dir is None:
+            return
+        _, _, log_path = self._paths()
+        try:
+            log_size = log_path.stat().st_size
+        except OSError:
+            log_size = 0
+        if self._disk_generation() != self._snapshot_gen or log_size < self._log_pos:
+            # un altro processo ha compattato: si riparte dallo snapshot nuovo
+            self._reset()
+            self._load()
+        elif log_size > self._log_pos:
+            self._replay_log(log_path)
+
+    def _replay_log(self, log_path: Path) -> None:
+        """Applica le righe del log da self._log_pos in poi (solo righe complete)."""
+        with log_path.open("rb") as f:
+            f.seek(self._log_pos)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                e = json.loads(line)
+            except json.JSONDecodeError:
+                # riga troncata da un crash durante l'append: ignora
+                continue
+            if e.get("op") == "delete":
+                self._delete_row(str(e.get("id")))
+            elif e.get("op") == "upsert":
+                raw = np.asarray(_vec_from_json(e.get("vec")), dtype=np.float32)
+                if raw.size == EMBEDDING_DIM:
+                    self._upsert_row(str(e.get("id")), raw, dict(e.get("meta") or {}))
+            self._log_rows += 1
+        self._log_pos += end
+        self._maybe_retrain()
+
+    def _append_log(self, entry: Dict[str, Any]) -> None:
+        self._append_log_many([entry])
+
+    def _append_log_many(self, entries: List[Dict[str, Any]]) -> None:
+        if self.index_dir is None or not entries:
+            return
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        _, _, log_path = self._paths()
+        with log_path.open("ab") as f:
+            for e in entries:
+                f.write((json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+            self._log_pos = f.tell()
+        self._log_rows += len(entries)
+        if self._needs_compaction():
+            if self.background:
+                self._schedule_maintenance()
+            else:
+                self.save()
+
+    def save(self) -> None:
+        """
+        Scrive lo snapshot e tronca il log, dopo aver riletto le scritture altrui.
+        Matrici e ids/meta stanno nello stesso npz, quindi un solo rename lo
+        rende visibile: un crash lascia lo snapshot vecchio o quello nuovo,
+        mai un misto. Un crash prima di troncare il log fa solo riapplicare
+        upsert/delete già inclusi (idempotenti).
+        """
+        if self.index_dir is None:
+            return
+        with self._lock, self._dir_lock(exclusive=True):
+            self._sync()
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            npz_path, json_path, log_path = self._paths()
+            n = self._n
+
+            info = json.dumps(
+                {
+                    "embedding_version": EMBEDDING_VERSION,
+                    "dim": EMBEDDING_DIM,
+                    "rows": n,
+                    "trained_n": self._trained_n,
+                    "ids": self._ids,
+                    "metas": self._metas,
+                },
+                ensure_ascii=False,
+            )
+            tmp_npz = npz_path.with_name(npz_path.name + ".tmp.npz")
+            with tmp_npz.open("wb") as f:
+                np.savez(
+                    f,
+                    raw=self._raw[:n],
+                    mean=self._mean,
+                    scale=self._scale,
+                    centroids=self._centroids if self._centroids is not None else np.empty((0, EMBEDDING_DIM), np.float32),
+                    info=np.array(info),
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            tmp_npz.replace(npz_path)
+            json_path.unlink(missing_ok=True)  # formato precedente
+            log_path.write_text("", encoding="utf-8")
+            self._log_rows = 0
+            self._log_pos = 0
+            self._snapshot_gen = self._disk_generation()
+
+    def _load(self) -> None:
+        npz_path, json_path, log_path = self._paths()
+        self._snapshot_gen = self._disk_generation()
+
+        if npz_path.exists():
+            with np.load(npz_path) as z:
+                if "info" in z.files:
+                    info = json.loads(str(z["info"]))
+                elif json_path.exists():
+                    info = json.loads(json_path.read_text(encoding="utf-8"))
+                else:
+                    raise RuntimeError(f"track index {self.index_dir}: {SNAPSHOT_JSON} mancante, ricostruire l'indice")
+                if info.get("embedding_version") != EMBEDDING_VERSION or info.get("dim") != EMBEDDING_DIM:
+                    raise RuntimeError(
+                        f"track index {self.index_dir}: embedding {info.get('embedding_version')} "
+                        f"non compatibile con {EMBEDDING_VERSION}, ricostruire l'indice"
+                    )
+                raw = np.asarray(z["raw"], dtype=np.float32)
+                mean = np.asarray(z["mean"], dtype=np.float32)
+                scale = np.asarray(z["scale"], dtype=np.float32)
+                centroids = np.asarray(z["centroids"], dtype=np.float32)
+
+            ids = [str(x) for x in info.get("ids") or []]
+            metas = list(info.get("metas") or [])
+            if len(ids) != raw.shape[0] or len(metas) != raw.shape[0]:
+                raise RuntimeError(f"track index {self.index_dir}: snapshot incoerente")
+
+            n = raw.shape[0]
+            self._mean = mean
+            self._scale = scale
+            self._ensure_capacity(n)
+            self._raw[:n] = raw
+            self._ids = ids
+            self._metas = metas
+            self._row_of = {tid: i for i, tid in enumerate(ids)}
+            self._n = n
+            self._trained_n = int(info.get("trained_n") or 0)
+            if n:
+                self._vecs[:n] = self._transform(raw)
+
+            if centroids.shape[0] > 0:
+                self._centroids = centroids
+                self._assign[:n] = self._nearest_list(self._vecs[:n]) if n else self._assign[:0]
+                self._lists = [[] for _ in range(centroids.shape[0])]
+                for row, lst in enumerate(self._assign[:n].tolist()):
+                    self._lists[lst].append(row)
+
+        if log_path.exists():
+            self._replay_log(log_path)
+
+
+def _vec_to_json(raw: np.ndarray) -> List[Optional[float]]:
+    return [float(x) if math.isfinite(float(x)) else None for x in raw.tolist()]
+
+
+def _vec_from_json(xs: Any) -> List[float]:
+    if not isinstance(xs, list):
+        return []
+    return [math.nan if x is None else float(x) for x in xs]
+
+
+def recall_at_k(
+    index: TrackIndex,
+    *,
+    n_queries: int = 200,
+    k: int = 10,
+    nprobe: Optional[int] = None,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Recall@k della modalita' approx rispetto al brute force, su tracce dell'indice
+    usate come query. Riporta anche i tempi medi per query.
+    """
+    ids = list(index._ids)
+    if not ids:
+        return {"queries": 0, "k": k, "recall": None}
+
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False)
+
+    hits = 0
+    total = 0
+    t_exact = 0.0
+    t_approx = 0.0
+    for i in picks:
+        tid = ids[int(i)]
+        t0 = time.perf_counter()
+        exact = index.search(track_id=tid, k=k, mode="exact")
+        t1 = time.perf_counter()
+        approx = index.search(track_id=tid, k=k, mode="approx", nprobe=nprobe)
+        t2 = time.perf_counter()
+        t_exact += t1 - t0
+        t_approx += t2 - t1
+
+        truth = {r["id"] for r in exact}
+        hits += len(truth.intersection(r["id"] for r in approx))
+        total += len(truth)
+
+    nq = len(picks)
+    return {
+        "queries": int(nq),
+        "k": int(k),
+        "nprobe": int(nprobe or index.nprobe),
+        "tracks": len(index),
+        "recall": float(hits / total) if total else None,
+        "exact_ms_per_query": round(1000.0 * t_exact / nq, 3),
+        "approx_ms_per_query": round(1000.0 * t_approx / nq, 3),
+    }
+
+
+def _synthetic_embeddings(n: int, seed: int = 0) -> np.ndarray:
+    """Embedding sintetici con struttura a cluster (per bench/recall senza audio)."""
+    rng = np.random.default_rng(seed)
+    n_centers = max(8, int(math.sqrt(n) // 4))
+    centers = rng.normal(0.0, 1.0, size=(n_centers, EMBEDDING_DIM)).astype(np.float32)
+    labels = rng.integers(0, n_centers, size=n)
+    return centers[labels] + rng.normal(0.0, 0.6, size=(n, EMBEDDING_DIM)).astype(np.float32)
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Tekkin track index (nearest-neighbour su embedding V3)")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    p_add = sub.add_parser("add", help="Indicizza output JSON di analyze_v3")
+    p_add.add_argument("--index-dir", required=True)
+    p_add.add_argument("--source", default="track", help="meta.source (es. reference)")
+    p_add.add_argument("--id-from", choices=["path", "stem"], default="stem")
+    p_add.add_argument("files", nargs="+")
+
+    p_q = sub.add_parser("query", help="Top-k simili a una traccia indicizzata")
+    p_q.add_argument("--index-dir", required=True)
+    p_q.add_argument("--id", required=True)
+    p_q.add_argument("-k", type=int, default=10)
+    p_q.add_argument("--mode", choices=["approx", "exact"], default="approx")
+    p_q.add_argument("--nprobe", type=int, default=None)
+    p_q.add_argument("--source", default=None)
+
+    p_b = sub.add_parser("bench", help="Recall approx vs exact e latenza per query")
+    p_b.add_argument("--index-dir", default=None)
+    p_b.add_argument("--synthetic", type=int, default=0, help="Usa N embedding sintetici in memoria")
+    p_b.add_argument("-k", type=int, default=10)
+    p_b.add_argument("--nprobe", type=int, default=None)
+    p_b.add_argument("--queries", type=int, default=200)
+
+    p_s = sub.add_parser("stats", help="Statistiche indice")
+    p_s.add_argument("--index-dir", required=True)
+
+    args = p.parse_args()
+
+    if args.cmd == "add":
+        index = TrackIndex(args.index_dir)
+        items: List[Tuple[str, Sequence[float], Optional[Dict[str, Any]]]] = []
+        for fp in args.files:
+            path = Path(fp)
+            try:
+                res = json.loads(path.read_text(encoding="utf-8"))
+            except Exception as e:
+                print(f"[SKIP] {fp}: {type(e).__name__}: {e}")
+                continue
+            emb = embedding_from_v3(res)
+            if emb is None:
+                print(f"[SKIP] {fp}: extra/timbre_spectrum mancanti")
+                continue
+            tid = str(path) if args.id_from == "path" else path.stem
+            items.append((tid, emb, {"source": args.source, "profile_key": res.get("profile_key"), "file": str(path)}))
+        index.upsert_many(items)
+        index.save()
+        print(json.dumps(index.stats(), indent=2))
+        return 0
+
+    if args.cmd == "query":
+        index = TrackIndex(args.index_dir)
+        res = index.search(track_id=args.id, k=args.k, mode=args.mode, nprobe=args.nprobe, source=args.source)
+        print(json.dumps(res, indent=2, ensure_ascii=False))
+        return 0
+
+    if args.cmd == "bench":
+        if args.synthetic > 0:
+            index = TrackIndex()
+            emb = _synthetic_embeddings(args.synthetic)
+            t0 = time.perf_counter()
+            index.upsert_many([(f"syn_{i}", emb[i], {"source": "synthetic"}) for i in range(emb.shape[0])])
+            print(f"[bench] build {args.synthetic} tracks: {time.perf_counter() - t0:.2f}s")
+        elif args.index_dir:
+            index = TrackIndex(args.index_dir)
+        else:
+            p.error("bench: serve --index-dir oppure --synthetic N")
+            return 2
+        print(json.dumps(recall_at_k(index, n_queries=args.queries, k=args.k, nprobe=args.nprobe), indent=2))
+        return 0
+
+    if args.cmd == "stats":
+        print(json.dumps(TrackIndex(args.index_dir).stats(), indent=2))
+        return 0
+
+    return 2
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
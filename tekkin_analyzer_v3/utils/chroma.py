@@ -0,0 +1,157 @@
+# tekkin_analyzer_v3/utils/chroma.py
+"""
+Stadio cromatico condiviso: HPCP calcolato una volta sola per frame, da cui si
+ricavano tonalità (più profili), strength e statistiche HPCP.
+
+La catena replica quella interna di es.KeyExtractor (Windowing hann ->
+Spectrum -> SpectralPeaks -> SpectralWhitening -> HPCP non normalizzato ->
+media -> normalizzazione al massimo -> soglia pcpThreshold -> Key senza
+polifonia/triadi): con gli stessi parametri key, scale e strength coincidono
+con KeyExtractor, ma ogni profilo in più costa solo una chiamata a es.Key
+sull'HPCP medio invece di un'altra passata completa sul segnale.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tekkin_analyzer_v3.utils.es_pool import algorithm
+
+# default di es.KeyExtractor
+FRAME_SIZE = 4096
+HOP_SIZE = 4096
+HPCP_SIZE = 12
+MIN_FREQUENCY = 25.0
+MAX_FREQUENCY = 3500.0
+MAX_PEAKS = 60
+PEAKS_THRESHOLD = 1e-4
+PCP_THRESHOLD = 0.2
+TUNING_FREQUENCY = 440.0
+
+@dataclass
+class ChromaResult:
+  hpcp: np.ndarray                      # (frames, HPCP_SIZE) float32, non normalizzato
+  sr: int
+  keys: Dict[str, Tuple[str, str, float]] = field(default_factory=dict)
+
+  def key(self, profile: str) -> Optional[Tuple[str, str, float]]:
+    return self.keys.get(profile)
+
+def _es():
+  try:
+    import essentia.standard as es
+  except Exception as e:
+    raise RuntimeError("Essentia non disponibile nell'ambiente Python corrente.") from e
+  return es
+
+def compute_hpcp_frames(
+  signal: np.ndarray,
+  sr: int,
+  frame_size: int = FRAME_SIZE,
+  hop_size: int = HOP_SIZE,
+) -> np.ndarray:
+  """HPCP per frame con la configurazione di KeyExtractor. Ritorna (frames, 12)."""
+  es = _es()
+  x = np.ascontiguousarray(signal, dtype=np.float32).reshape(-1)
+  if x.size == 0 or sr <= 0:
+    return np.zeros((0, HPCP_SIZE), dtype=np.float32)
+
+  windowing = algorithm("Windowing", type="hann")
+  spectrum = algorithm("Spectrum", size=frame_size)
+  peaks = algorithm(
+    "SpectralPeaks",
+    orderBy="magnitude",
+    magnitudeThreshold=PEAKS_THRESHOLD,
+    minFrequency=MIN_FREQUENCY,
+    maxFrequency=MAX_FREQUENCY,
+    maxPeaks=MAX_PEAKS,
+    sampleRate=float(sr),
+  )
+  whitening = algorithm("SpectralWhitening", maxFrequency=MAX_FREQUENCY, sampleRate=float(sr))
+  hpcp = algorithm(
+    "HPCP",
+    bandPreset=False,
+    harmonics=4,
+    maxFrequency=MAX_FREQUENCY,
+    minFrequency=MIN_FREQUENCY,
+    nonLinear=False,
+    normalized="none",
+    referenceFrequency=TUNING_FREQUENCY,
+    sampleRate=float(sr),
+    size=HPCP_SIZE,
+    weightType="cosine",
+    windowSize=1.0,
+    maxShifted=False,
+  )
+
+  frames: List[np.ndarray] = []
+  for frame in es.FrameGenerator(x, frameSize=frame_size, hopSize=hop_size):
+    spec = spectrum(windowing(frame))
+    freqs, mags = peaks(spec)
+    frames.append(np.asarray(hpcp(freqs, whitening(spec, freqs, mags)), dtype=np.float32))
+
+  if not frames:
+    return np.zeros((0, HPCP_SIZE), dtype=np.float32)
+  return np.vstack(frames)
+
+def average_pcp(hpcp_frames: np.ndarray, pcp_threshold: float = PCP_THRESHOLD) -> Optional[np.ndarray]:
+  """HPCP medio normalizzato al massimo, bin sotto soglia azzerati (come KeyExtractor)."""
+  if hpcp_frames.size == 0:
+    return None
+  avg = hpcp_frames.astype(np.float64).mean(axis=0)
+  peak = float(avg.max())
+  if peak <= 0.0:
+    return None
+  avg = avg / peak
+  avg[avg < pcp_threshold] = 0.0
+  return avg.astype(np.float32)
+
+def key_from_pcp(pcp: np.ndarray, profile: str = "bgate") -> Tuple[str, str, float]:
+  key_algo = algorithm(
+    "Key",
+    numHarmonics=4,
+    pcpSize=int(pcp.size),
+    profileType=profile,
+    slope=0.6,
+    usePolyphony=False,
+    useThreeChords=False,
+  )
+  key, scale, strength = key_algo(np.asarray(pcp, dtype=np.float32))[:3]
+  return str(key), str(scale), float(strength)
+
+def hpcp_stats(hpcp_frames: np.ndarray) -> Optional[Dict[str, List[float]]]:
+  """Media/std per bin sugli HPCP per frame normalizzati al massimo (unitMax)."""
+  if hpcp_frames.size == 0:
+    return None
+  peaks = hpcp_frames.max(axis=1, keepdims=True)
+  valid = peaks[:, 0] > 0
+  if not np.any(valid):
+    return None
+  norm = hpcp_frames[valid] / peaks[valid]
+  return {
+    "mean": [float(v) for v in norm.mean(axis=0)],
+    "std": [float(v) for v in norm.std(axis=0)],
+  }
+
+def analyze_chroma(
+  signal: np.ndarray,
+  sr: int,
+  profiles: Sequence[str] = ("bgate",),
+) -> ChromaResult:
+  """
+  Un solo passaggio HPCP, poi una stima di tonalità per ciascun profilo.
+  I profili che Essentia rifiuta vengono saltati (assenti da keys).
+  """
+  frames = compute_hpcp_frames(signal, sr)
+  result = ChromaResult(hpcp=frames, sr=int(sr))
+  pcp = average_pcp(frames)
+  if pcp is None:
+    return result
+  for profile in profiles:
+    try:
+      result.keys[profile] = key_from_pcp(pcp, profile)
+    except Exception:
+      continue
+  return result
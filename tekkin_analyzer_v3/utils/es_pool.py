@@ -0,0 +1,140 @@
+# tekkin_analyzer_v3/utils/es_pool.py
+"""
+Pool di algoritmi Essentia: condiviso nel processo, con checkout per thread.
+
+Ogni blocco costruiva i suoi algoritmi a ogni richiesta: per quelli leggeri
+costa frazioni di ms, ma RhythmExtractor2013 multifeature ~200 ms,
+LoudnessEBUR128 / KeyExtractor qualche ms. Qui ogni algoritmo viene configurato
+una volta per (classe, parametri) in ciascun thread (sampleRate fa parte dei
+parametri) e riusato; a ogni richiesta si chiama reset(), che azzera lo stato
+interno (filtri IIR, onset detection, ...) e rende il risultato identico a
+quello di un'istanza nuova.
+
+Un'istanza per chiave e per thread: la stessa chiave non va usata in due
+punti contemporaneamente (es. due LowPass identici intrecciati sullo stesso
+segnale). TEKKIN_ES_POOL=0 disattiva il riuso (istanza nuova a ogni chiamata).
+
+Le istanze di un thread sono sue finché dura checkout() (un'analisi); a fine
+checkout tornano nel pool del processo e il prossimo thread che chiede la
+stessa chiave le riprende invece di costruirle. Così il warm-up (in un thread
+qualsiasi, o nel master prefork) scalda anche i thread del threadpool che
+servono le richieste.
+"""
+from __future__ import annotations
+
+import contextlib
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+POOL_ENABLED = os.environ.get("TEKKIN_ES_POOL", "1").strip().lower() not in ("0", "false", "no")
+
+_local = threading.local()
+# istanze libere del processo, per chiave (riconsegnate a fine checkout)
+_idle_lock = threading.Lock()
+_idle: Dict[Tuple[str, Any], List[Any]] = {}
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {}
+
+def _es():
+  try:
+    import essentia.standard as es
+  except Exception as e:
+    raise RuntimeError("Essentia non disponibile nell'ambiente Python corrente.") from e
+  return es
+
+def _freeze(value: Any) -> Any:
+  if isinstance(value, (list, tuple)):
+    return tuple(_freeze(v) for v in value)
+  if isinstance(value, dict):
+    return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+  return value
+
+def _cache() -> Dict[Tuple[str, Any], Any]:
+  cache = getattr(_local, "algorithms", None)
+  if cache is None:
+    cache = {}
+    _local.algorithms = cache
+  return cache
+
+def _record(name: str, built: bool, ms: float) -> None:
+  with _stats_lock:
+    s = _stats.setdefault(name, {"built": 0, "reused": 0, "build_ms": 0.0, "reset_ms": 0.0})
+    if built:
+      s["built"] += 1
+      s["build_ms"] += ms
+    else:
+      s["reused"] += 1
+      s["reset_ms"] += ms
+
+def algorithm(name: str, **params: Any) -> Any:
+  """
+  Istanza configurata di es.<name>(**params), pronta all'uso (stato azzerato).
+  Gli errori di configurazione (parametro sconosciuto, ...) passano al chiamante
+  come con la costruzione diretta.
+  """
+  key = (name, _freeze(params))
+  cache = _cache()
+  algo = cache.get(key) if POOL_ENABLED else None
+  if algo is None and POOL_ENABLED:
+    with _idle_lock:
+      free = _idle.get(key)
+      algo = free.pop() if free else None
+    if algo is not None:
+      cache[key] = algo
+  t0 = time.perf_counter()
+  if algo is None:
+    algo = getattr(_es(), name)(**params)
+    if POOL_ENABLED:
+      cache[key] = algo
+    _record(name, True, (time.perf_counter() - t0) * 1000.0)
+  else:
+    algo.reset()
+    _record(name, False, (time.perf_counter() - t0) * 1000.0)
+  return algo
+
+def release_thread() -> int:
+  """Riconsegna al pool del processo le istanze del thread corrente; ritorna quante."""
+  cache = _cache()
+  n = len(cache)
+  with _idle_lock:
+    for key, algo in cache.items():
+      _idle.setdefault(key, []).append(algo)
+  cache.clear()
+  return n
+
+@contextlib.contextmanager
+def checkout() -> Iterator[None]:
+  """
+  Scope di un'analisi: le istanze usate restano del thread fino all'uscita,
+  poi tornano nel pool del processo. Annidabile (riconsegna solo il più esterno).
+  """
+  depth = getattr(_local, "depth", 0)
+  _local.depth = depth + 1
+  try:
+    yield
+  finally:
+    _local.depth = depth
+    if depth == 0:
+      release_thread()
+
+def pool_size() -> int:
+  """Algoritmi configurati nel processo (thread corrente + liberi)."""
+  with _idle_lock:
+    idle = sum(len(v) for v in _idle.values())
+  return len(_cache()) + idle
+
+def pool_stats(reset: bool = False) -> Dict[str, Dict[str, float]]:
+  """Contatori per classe su tutti i thread: built, reused, build_ms, reset_ms."""
+  with _stats_lock:
+    out = {k: dict(v) for k, v in _stats.items()}
+    if reset:
+      _stats.clear()
+  return out
+
+def clear_pool() -> None:
+  """Svuota il pool del thread corrente e quello del processo."""
+  _cache().clear()
+  with _idle_lock:
+    _idle.clear()
@@ -0,0 +1,182 @@
+# tekkin_analyzer_v3/utils/pcm_cache.py
+"""
+Cache su disco del PCM decodificato (float32 stereo, shape (n, 2)).
+
+Ri-analisi con un altro analyzer_version, re-run dopo un blocco fallito e
+rebuild dei reference decodificano lo stesso MP3 ogni volta; qui il risultato
+di ffmpeg (già ricampionato a sr) resta in un .npy riaperto con
+np.load(mmap_mode="r"): nessuna copia in RAM finché i blocchi non leggono.
+
+  audio, hit = cached_pcm(path, 44100, lambda: load_audio_ffmpeg(path, sr=44100)[0])
+
+Chiave: sha256 del file sorgente + sr (+ max_seconds se troncato), quindi lo
+stesso audio scaricato da URL diversi riusa la stessa entry. L'array
+restituito da un hit è read-only: chi lo modifica deve copiarlo.
+
+Env:
+- TEKKIN_PCM_CACHE_DIR (default /tmp/tekkin_pcm_cache), condivisa tra worker
+- TEKKIN_PCM_CACHE_MB budget in MB (default 2048; 0 = cache disattivata);
+  oltre budget si eliminano le entry usate meno di recente (mtime, aggiornato
+  a ogni hit)
+Scritture atomiche (file temporaneo + os.replace): due worker sullo stesso
+audio al massimo decodificano due volte.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+_log = logging.getLogger("tekkin-analyzer-min")
+_evict_lock = threading.Lock()
+
+def cache_dir() -> str:
+  return os.environ.get("TEKKIN_PCM_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "tekkin_pcm_cache")
+
+def budget_bytes() -> int:
+  try:
+    mb = float(os.environ.get("TEKKIN_PCM_CACHE_MB", "2048") or 0)
+  except ValueError:
+    mb = 0.0
+  return int(max(0.0, mb) * 1024 * 1024)
+
+def enabled() -> bool:
+  return budget_bytes() > 0
+
+def sha256_file(path: str) -> str:
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for b in iter(lambda: f.read(1024 * 1024), b""):
+      h.update(b)
+  return h.hexdigest()
+
+def _entry_path(sha256: str, sr: int, max_seconds: Optional[float]) -> str:
+  name = f"{sha256.lower()}_{int(sr)}"
+  if max_seconds is not None and max_seconds > 0:
+    name += f"_t{float(max_seconds):g}"
+  return os.path.join(cache_dir(), name + ".npy")
+
+def get(sha256: str, sr: int, max_seconds: Optional[float] = None) -> Optional[np.ndarray]:
+  """Array memory-mapped (read-only) o None se assente/illeggibile."""
+  if not enabled():
+    return None
+  path = _entry_path(sha256, sr, max_seconds)
+  try:
+    audio = np.load(path, mmap_mode="r", allow_pickle=False)
+  except FileNotFoundError:
+    return None
+  except Exception as e:
+    _log.warning("[pcm-cache] entry corrotta %s: %s", path, e)
+    _remove(path)
+    return None
+  if audio.dtype != np.float32 or audio.ndim != 2:
+    _remove(path)
+    return None
+  try:
+    os.utime(path)  # LRU
+  except OSError:
+    pass
+  return audio
+
+def put(sha256: str, sr: int, audio: np.ndarray, max_seconds: Optional[float] = None) -> bool:
+  """Salva (atomico) e applica il budget. False se disattivata o troppo grande."""
+  budget = budget_bytes()
+  audio = np.ascontiguousarray(audio, dtype=np.float32)
+  if budget <= 0 or audio.nbytes > budget:
+    return False
+  d = cache_dir()
+  path = _entry_path(sha256, sr, max_seconds)
+  try:
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp_", suffix=".npy", dir=d)
+    try:
+      with os.fdopen(fd, "wb") as f:
+        np.save(f, audio, allow_pickle=False)
+      os.replace(tmp, path)
+    except BaseException:
+      _remove(tmp)
+      raise
+  except OSError as e:
+    _log.warning("[pcm-cache] scrittura fallita %s: %s", path, e)
+    return False
+  evict(budget)
+  return True
+
+def evict(budget: Optional[int] = None) -> int:
+  """Elimina le entry meno recenti finché la cartella sta nel budget; ritorna i byte liberati."""
+  budget = budget_bytes() if budget is None else budget
+  d = cache_dir()
+  with _evict_lock:
+    try:
+      names = os.listdir(d)
+    except OSError:
+      return 0
+    entries = []
+    for name in names:
+      if not name.endswith(".npy") or name.startswith(".tmp_"):
+        continue
+      try:
+        st = os.stat(os.path.join(d, name))
+      except OSError:
+        continue
+      entries.append((st.st_mtime, st.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    for _, size, name in sorted(entries):
+      if total <= budget:
+        break
+      # su Linux un file già mappato resta leggibile anche dopo l'unlink
+      if _remove(os.path.join(d, name)):
+        total -= size
+        freed += size
+    return freed
+
+def stats() -> dict:
+  d = cache_dir()
+  n, total = 0, 0
+  try:
+    for name in os.listdir(d):
+      if name.endswith(".npy") and not name.startswith(".tmp_"):
+        try:
+          total += os.path.getsize(os.path.join(d, name))
+          n += 1
+        except OSError:
+          pass
+  except OSError:
+    pass
+  return {"dir": d, "entries": n, "bytes": total, "budget_bytes": budget_bytes()}
+
+def _remove(path: str) -> bool:
+  try:
+    os.remove(path)
+    return True
+  except OSError:
+    return False
+
+def cached_pcm(
+  path: str,
+  sr: int,
+  decode: Callable[[], np.ndarray],
+  *,
+  sha256: Optional[str] = None,
+  max_seconds: Optional[float] = None,
+) -> Tuple[np.ndarray, bool]:
+  """
+  PCM (n, 2) float32 di `path` a `sr`: dalla cache se c'è, altrimenti decode()
+  e salvataggio. sha256 del file se già calcolato (l'API lo ha dal download).
+  Ritorna (audio, hit).
+  """
+  if not enabled():
+    return decode(), False
+  key = sha256 or sha256_file(path)
+  audio = get(key, sr, max_seconds)
+  if audio is not None:
+    return audio, True
+  audio = decode()
+  put(key, sr, audio, max_seconds)
+  return audio, False
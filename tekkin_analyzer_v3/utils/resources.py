@@ -0,0 +1,193 @@
+# tekkin_analyzer_v3/utils/resources.py
+"""
+Misura delle risorse per blocco e per richiesta.
+
+Per ogni blocco V3:
+- cpu_ms: tempo CPU del thread che esegue il blocco (thread_time; gli eventuali
+  thread interni di BLAS/Essentia non sono contati)
+- peak_mem_mb: picco di memoria incrementale durante il blocco
+    TEKKIN_BLOCK_MEM=rss (default): RSS del processo campionato ogni ~5 ms;
+      vede anche le allocazioni C++ di Essentia, ma con più analisi in
+      parallelo nello stesso worker include quelle degli altri thread; la
+      memoria già riservata dal processo (blocchi precedenti) non conta
+    TEKKIN_BLOCK_MEM=tracemalloc: solo allocazioni Python/numpy, più lento
+    TEKKIN_BLOCK_MEM=off: non misurato
+- output_bytes: memoria occupata dall'output (numpy nbytes + oggetti Python)
+- output_json_bytes: dimensione dell'output serializzato in JSON; costa un
+  json.dumps completo del blocco, quindi si calcola solo con la trace attiva
+  per la richiesta, dentro detailed_accounting() (profiling) o con
+  TEKKIN_BLOCK_JSON_BYTES=1; altrimenti è null
+
+StageTimer accumula i tempi per fase della richiesta (download, hash, decode,
+blocks, accounting, serialization, upload); ogni fase è anche uno span
+(utils/tracing.py). "accounting" è il costo della misura stessa (tempo fuori
+dai blocchi nel ciclo dei blocchi), "serialization" il JSON da caricare.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+from tekkin_analyzer_v3.utils.tracing import current_span, span
+
+MEM_MODE = (os.environ.get("TEKKIN_BLOCK_MEM", "rss").strip().lower() or "rss")
+if MEM_MODE not in ("rss", "tracemalloc", "off"):
+  MEM_MODE = "rss"
+
+SAMPLE_INTERVAL_SEC = 0.005
+
+JSON_BYTES_ALWAYS = os.environ.get("TEKKIN_BLOCK_JSON_BYTES", "0").strip().lower() in ("1", "true", "yes", "on")
+_detailed: ContextVar[bool] = ContextVar("tekkin_detailed_accounting", default=False)
+
+@contextmanager
+def detailed_accounting(on: bool = True) -> Iterator[None]:
+  """Dentro lo scope (richieste profilate) i blocchi riportano anche output_json_bytes."""
+  token = _detailed.set(bool(on))
+  try:
+    yield
+  finally:
+    _detailed.reset(token)
+
+def json_sizes_enabled() -> bool:
+  return JSON_BYTES_ALWAYS or _detailed.get() or current_span() is not None
+
+try:
+  _PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+except (AttributeError, ValueError, OSError):
+  _PAGE_MB = 4096 / (1024.0 * 1024.0)
+
+def rss_mb() -> Optional[float]:
+  """RSS corrente del processo (MB) da /proc; None se non disponibile."""
+  try:
+    with open("/proc/self/statm", "r") as f:
+      return int(f.read().split()[1]) * _PAGE_MB
+  except (OSError, ValueError, IndexError):
+    return None
+
+class _RssSampler:
+  """Thread che campiona l'RSS fino a stop() e tiene il massimo."""
+
+  def __init__(self) -> None:
+    self.base = rss_mb()
+    self.peak = self.base
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+  def _run(self) -> None:
+    while not self._stop.wait(SAMPLE_INTERVAL_SEC):
+      self._sample()
+
+  def _sample(self) -> None:
+    cur = rss_mb()
+    if cur is not None and (self.peak is None or cur > self.peak):
+      self.peak = cur
+
+  def start(self) -> "_RssSampler":
+    if self.base is not None:
+      self._thread.start()
+    return self
+
+  def stop(self) -> Optional[float]:
+    if self.base is None:
+      return None
+    self._stop.set()
+    self._thread.join()
+    self._sample()
+    return max(0.0, self.peak - self.base)
+
+@contextmanager
+def measure(mode: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+  """
+  Misura CPU e picco di memoria del blocco di codice.
+  Il dict restituito viene riempito all'uscita: {cpu_ms, peak_mem_mb, mem_method}.
+  """
+  mode = mode or MEM_MODE
+  out: Dict[str, Any] = {"cpu_ms": None, "peak_mem_mb": None, "mem_method": mode}
+
+  sampler = None
+  started_tracing = False
+  base_traced = 0
+  if mode == "rss":
+    sampler = _RssSampler().start()
+  elif mode == "tracemalloc":
+    if not tracemalloc.is_tracing():
+      tracemalloc.start()
+      started_tracing = True
+    tracemalloc.reset_peak()
+    base_traced = tracemalloc.get_traced_memory()[0]
+
+  c0 = time.thread_time()
+  try:
+    yield out
+  finally:
+    out["cpu_ms"] = int((time.thread_time() - c0) * 1000)
+    peak = None
+    if sampler is not None:
+      peak = sampler.stop()
+    elif mode == "tracemalloc":
+      peak = max(0, tracemalloc.get_traced_memory()[1] - base_traced) / (1024.0 * 1024.0)
+      if started_tracing:
+        tracemalloc.stop()
+    out["peak_mem_mb"] = None if peak is None else round(peak, 1)
+
+def deep_nbytes(obj: Any, _seen: Optional[set] = None) -> int:
+  """Byte occupati da un output (dict/list annidati, array numpy, scalari)."""
+  seen = _seen if _seen is not None else set()
+  oid = id(obj)
+  if oid in seen:
+    return 0
+  seen.add(oid)
+  if isinstance(obj, np.ndarray):
+    return int(obj.nbytes) + sys.getsizeof(obj) - (obj.nbytes if obj.flags.owndata else 0)
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    for k, v in obj.items():
+      size += deep_nbytes(k, seen) + deep_nbytes(v, seen)
+  elif isinstance(obj, (list, tuple, set, frozenset)):
+    for v in obj:
+      size += deep_nbytes(v, seen)
+  return size
+
+def _json_default(o: Any) -> Any:
+  if isinstance(o, np.ndarray):
+    return o.tolist()
+  if isinstance(o, (np.floating, np.integer)):
+    return o.item()
+  return str(o)
+
+def json_nbytes(obj: Any) -> int:
+  """Dimensione dell'oggetto serializzato in JSON compatto (UTF-8)."""
+  return len(json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_json_default).encode("utf-8"))
+
+class StageTimer:
+  """Tempi per fase (ms), sommati se la stessa fase si ripete. stage() restituisce lo span."""
+
+  def __init__(self) -> None:
+    self.t0 = time.perf_counter()
+    self.ms: Dict[str, int] = {}
+
+  @contextmanager
+  def stage(self, name: str, **attrs: Any) -> Iterator[Any]:
+    t = time.perf_counter()
+    try:
+      with span(name, **attrs) as sp:
+        yield sp
+    finally:
+      self.add(name, (time.perf_counter() - t) * 1000.0)
+
+  def add(self, name: str, ms: float) -> None:
+    self.ms[name] = self.ms.get(name, 0) + int(round(ms))
+
+  def as_dict(self) -> Dict[str, int]:
+    out = dict(self.ms)
+    out["total"] = int((time.perf_counter() - self.t0) * 1000)
+    return out
@@ -0,0 +1,285 @@
+# tekkin_analyzer_v3/utils/tempo.py
+"""
+Stima del tempo per materiale EDM.
+
+- AudioPyramid: versioni decimate del mono (sr, sr/2, sr/4, ...). Una per
+  analisi: analyze_v3 apre analysis_pyramid() attorno ai blocchi e i
+  consumatori la prendono con shared_pyramid(mono, sr), riconosciuta
+  dall'identità dell'array (tempo sui livelli decimati, danceability e
+  tonalità sul livello pieno, stesso mono senza copie).
+- engine "accurate" (default): RhythmExtractor2013(method="multifeature") sul
+  segnale a piena banda, come prima.
+- engine "fast": onset envelope (spectral flux log) a 11.025 kHz +
+  autocorrelazione pesata a pettine (armoniche del periodo) su una griglia BPM
+  fine, vincolata al range configurato; fase dei beat per tempo costante.
+  Cambia il contratto: confidence 0-1 invece di 0..5.32, beat su griglia
+  rigida (niente stability), BPM diversi su materiale poco ritmico. Va
+  attivato solo quando i consumatori (mapVersionToAnalyzerCompareModel.ts,
+  rebuild_reference_models_v3.py) leggono confidence_unit.
+
+Engine e range si scelgono con TEKKIN_TEMPO_ENGINE (accurate|fast) e
+TEKKIN_TEMPO_BPM_RANGE ("min,max"), o per chiamata.
+"""
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import os
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+from scipy.signal import resample_poly
+
+from tekkin_analyzer_v3.utils.es_pool import algorithm
+
+ENGINES = ("fast", "accurate")
+
+def _env_engine() -> str:
+  v = os.environ.get("TEKKIN_TEMPO_ENGINE", "accurate").strip().lower()
+  return v if v in ENGINES else "accurate"
+
+def _env_bpm_range() -> Tuple[float, float]:
+  raw = os.environ.get("TEKKIN_TEMPO_BPM_RANGE", "").strip()
+  if raw:
+    try:
+      lo, hi = (float(v) for v in raw.split(",", 1))
+      if 0 < lo < hi:
+        return lo, hi
+    except ValueError:
+      pass
+  return 90.0, 180.0
+
+DEFAULT_ENGINE = _env_engine()
+DEFAULT_BPM_RANGE = _env_bpm_range()
+
+# onset envelope
+ONSET_RATE = 11025
+ONSET_N_FFT = 512
+ONSET_HOP = 64
+ONSET_LOG_GAIN = 100.0
+ONSET_CHUNK_FRAMES = 4096
+# pettine: armoniche del periodo sommate nell'autocorrelazione
+COMB_HARMONICS = 8
+BPM_GRID_STEP = 0.02
+
+class AudioPyramid:
+  """Mono float32 decimato per potenze di 2, livelli calcolati su richiesta."""
+
+  def __init__(self, mono: np.ndarray, sr: int):
+    self.sr = int(sr)
+    self._levels: Dict[int, np.ndarray] = {self.sr: np.ascontiguousarray(mono, dtype=np.float32).reshape(-1)}
+
+  @property
+  def full(self) -> np.ndarray:
+    return self._levels[self.sr]
+
+  def level(self, min_rate: int) -> Tuple[np.ndarray, int]:
+    """Livello con la frequenza più bassa >= min_rate (es. 11025 da 44100)."""
+    rate = self.sr
+    while rate % 2 == 0 and rate // 2 >= min_rate:
+      nxt = rate // 2
+      if nxt not in self._levels:
+        # FIR anti-alias di resample_poly, float32
+        self._levels[nxt] = resample_poly(self._levels[rate], 1, 2).astype(np.float32)
+      rate = nxt
+    return self._levels[rate], rate
+
+class _PyramidSlot:
+  """
+  Piramide dell'analisi corrente: creata dal primo consumatore con il suo mono.
+  Tiene un riferimento al mono sorgente, così l'identità (is) resta valida
+  per tutto lo scope.
+  """
+
+  def __init__(self, sr: int):
+    self.sr = int(sr)
+    self.source: Optional[np.ndarray] = None
+    self.pyramid: Optional[AudioPyramid] = None
+
+  def matches(self, mono: np.ndarray) -> bool:
+    return self.pyramid is not None and (mono is self.source or mono is self.pyramid.full)
+
+_current_slot: contextvars.ContextVar[Optional[_PyramidSlot]] = contextvars.ContextVar("tekkin_pyramid", default=None)
+
+@contextlib.contextmanager
+def analysis_pyramid(sr: int) -> Iterator[None]:
+  """
+  Scope di un'analisi: dentro, shared_pyramid() con lo stesso sr e lo stesso
+  array mono (identità, non solo lunghezza) ritorna sempre la stessa
+  AudioPyramid. Stesso thread (i blocchi V3 girano in sequenza); fuori dallo
+  scope, o con un altro segnale, ognuno ha la sua.
+  """
+  token = _current_slot.set(_PyramidSlot(sr))
+  try:
+    yield
+  finally:
+    _current_slot.reset(token)
+
+def shared_pyramid(mono: np.ndarray, sr: int) -> AudioPyramid:
+  """
+  Piramide dell'analisi corrente se è stata costruita da questo stesso mono
+  (o dal suo livello pieno), altrimenti nuova. Il primo consumatore dello
+  scope la crea; un segnale diverso non la sostituisce.
+  """
+  slot = _current_slot.get()
+  if slot is None or slot.sr != int(sr):
+    return AudioPyramid(mono, sr)
+  if slot.matches(mono):
+    return slot.pyramid
+  pyramid = AudioPyramid(mono, sr)
+  if slot.pyramid is None:
+    slot.source = mono
+    slot.pyramid = pyramid
+  return pyramid
+
+def onset_envelope(x: np.ndarray, rate: int, n_fft: int = ONSET_N_FFT, hop: int = ONSET_HOP) -> Tuple[np.ndarray, float]:
+  """Spectral flux (log-magnitudo, differenza positiva) -> (env, frame_rate)."""
+  x = np.ascontiguousarray(x, dtype=np.float32)
+  fps = rate / float(hop)
+  if x.size < n_fft:
+    return np.zeros(0, dtype=np.float32), fps
+  n_frames = 1 + (x.size - n_fft) // hop
+  frames = np.lib.stride_tricks.as_strided(
+    x, shape=(n_frames, n_fft), strides=(x.strides[0] * hop, x.strides[0]), writeable=False
+  )
+  win = np.hanning(n_fft).astype(np.float32)
+  flux = np.zeros(n_frames, dtype=np.float32)
+  prev: Optional[np.ndarray] = None
+  for a in range(0, n_frames, ONSET_CHUNK_FRAMES):
+    b = min(n_frames, a + ONSET_CHUNK_FRAMES)
+    mag = np.abs(np.fft.rfft(frames[a:b] * win, axis=1)).astype(np.float32)
+    logm = np.log1p(ONSET_LOG_GAIN * mag)
+    if prev is not None:
+      logm_ext = np.vstack([prev[None, :], logm])
+    else:
+      logm_ext = np.vstack([logm[:1], logm])
+    diff = np.diff(logm_ext, axis=0)
+    np.maximum(diff, 0.0, out=diff)
+    flux[a:b] = diff.sum(axis=1)
+    prev = logm[-1]
+  # toglie la media locale (~1 s): resta la parte impulsiva
+  k = max(1, int(round(fps)))
+  kernel = np.ones(k, dtype=np.float32) / k
+  local = np.convolve(flux, kernel, mode="same")
+  env = np.maximum(flux - local, 0.0)
+  return env.astype(np.float32), fps
+
+def _autocorr(env: np.ndarray, max_lag: int) -> np.ndarray:
+  n = env.size
+  size = 1
+  while size < 2 * n:
+    size *= 2
+  spec = np.fft.rfft(env.astype(np.float64) - float(env.mean()), size)
+  ac = np.fft.irfft(spec * np.conj(spec), size)[: max_lag + 1]
+  if ac[0] > 0:
+    ac = ac / ac[0]
+  # correzione per la sovrapposizione che cala con il lag
+  ac = ac * (n / np.maximum(n - np.arange(ac.size), 1))
+  return ac
+
+def _comb_scores(ac: np.ndarray, fps: float, bpms: np.ndarray, harmonics: int) -> np.ndarray:
+  lags = 60.0 * fps / bpms
+  idx = np.arange(ac.size, dtype=np.float64)
+  total = np.zeros(bpms.size, dtype=np.float64)
+  count = np.zeros(bpms.size, dtype=np.float64)
+  for h in range(1, harmonics + 1):
+    pos = lags * h
+    ok = pos < ac.size - 1
+    total[ok] += np.interp(pos[ok], idx, ac)
+    count[ok] += 1.0
+  return total / np.maximum(count, 1.0)
+
+def _beat_phase(env: np.ndarray, period: float) -> float:
+  if env.size == 0 or period <= 0:
+    return 0.0
+  n_beats = int((env.size - 1) // period)
+  if n_beats <= 0:
+    return 0.0
+  offsets = np.arange(int(np.ceil(period)))
+  grid = offsets[:, None] + period * np.arange(n_beats)[None, :]
+  grid = np.minimum(np.round(grid).astype(np.int64), env.size - 1)
+  return float(offsets[int(np.argmax(env[grid].sum(axis=1)))])
+
+def estimate_tempo_fast(
+  mono: np.ndarray,
+  sr: int,
+  bpm_range: Optional[Tuple[float, float]] = None,
+  pyramid: Optional[AudioPyramid] = None,
+) -> Dict[str, Any]:
+  """
+  BPM da onset envelope + autocorrelazione a pettine nel range dato.
+  confidence in [0, 1]: quanto il picco scelto emerge dagli altri candidati.
+  """
+  lo, hi = bpm_range or DEFAULT_BPM_RANGE
+  pyr = pyramid if pyramid is not None else shared_pyramid(mono, sr)
+  x, rate = pyr.level(ONSET_RATE)
+  env, fps = onset_envelope(x, rate)
+  out: Dict[str, Any] = {"bpm": None, "beats": [], "confidence": None, "confidence_unit": None, "engine": "fast"}
+  if env.size < int(4 * fps) or not np.any(env > 0):
+    return out
+
+  max_lag = int(np.ceil(60.0 * fps / lo * COMB_HARMONICS)) + 2
+  ac = _autocorr(env, min(max_lag, env.size - 1))
+  bpms = np.arange(lo, hi + BPM_GRID_STEP / 2, BPM_GRID_STEP)
+  scores = _comb_scores(ac, fps, bpms, COMB_HARMONICS)
+  best = int(np.argmax(scores))
+  bpm = float(bpms[best])
+  # raffinamento parabolico sul picco della griglia
+  if 0 < best < bpms.size - 1:
+    y0, y1, y2 = scores[best - 1], scores[best], scores[best + 1]
+    denom = y0 - 2 * y1 + y2
+    if denom < 0:
+      bpm += float(0.5 * (y0 - y2) / denom) * BPM_GRID_STEP
+
+  spread = float(scores.max() - np.median(scores))
+  rng_ = float(scores.max() - scores.min())
+  confidence = spread / rng_ if rng_ > 0 else 0.0
+
+  period = 60.0 * fps / bpm
+  phase = _beat_phase(env, period)
+  n_beats = int((env.size - 1 - phase) // period) + 1
+  frame_t0 = (ONSET_N_FFT / 2.0) / rate
+  beats = [float((phase + i * period) / fps + frame_t0) for i in range(max(0, n_beats))]
+
+  confidence = float(np.clip(confidence, 0.0, 1.0))
+  out.update({"bpm": round(bpm, 2), "beats": beats, "confidence": confidence, "confidence_unit": confidence})
+  return out
+
+def estimate_tempo_accurate(mono: np.ndarray, sr: int) -> Dict[str, Any]:
+  """RhythmExtractor2013 multifeature (confidence grezza 0..5.32)."""
+  ret = algorithm("RhythmExtractor2013", method="multifeature")(np.ascontiguousarray(mono, dtype=np.float32))
+  bpm = ret[0] if len(ret) > 0 else None
+  ticks = ret[1] if len(ret) > 1 else []
+  conf = ret[2] if len(ret) > 2 else None
+  return {
+    "bpm": None if bpm is None else float(bpm),
+    "beats": [float(t) for t in np.asarray(ticks, dtype=np.float64).reshape(-1)],
+    "confidence": None if conf is None else float(conf),
+    "confidence_unit": None if conf is None else float(np.clip(float(conf) / 5.0, 0.0, 1.0)),
+    "engine": "accurate",
+    "raw": ret,
+  }
+
+def estimate_tempo(
+  mono: np.ndarray,
+  sr: int,
+  engine: Optional[str] = None,
+  bpm_range: Optional[Tuple[float, float]] = None,
+  pyramid: Optional[AudioPyramid] = None,
+) -> Dict[str, Any]:
+  """
+  Entry point comune. Ritorna bpm, beats, confidence (nativa dell'engine:
+  0..5.32 per accurate, 0-1 per fast), confidence_unit (sempre 0-1),
+  engine e took_ms. Senza pyramid usa quella dell'analisi corrente.
+  """
+  eng = (engine or DEFAULT_ENGINE).lower()
+  if pyramid is None:
+    pyramid = shared_pyramid(mono, sr)
+  t0 = time.perf_counter()
+  if eng == "accurate":
+    out = estimate_tempo_accurate(mono if pyramid is None else pyramid.full, sr)
+  else:
+    out = estimate_tempo_fast(mono, sr, bpm_range=bpm_range, pyramid=pyramid)
+  out["took_ms"] = int((time.perf_counter() - t0) * 1000)
+  return out
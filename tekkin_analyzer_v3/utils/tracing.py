@@ -0,0 +1,198 @@
+# tekkin_analyzer_v3/utils/tracing.py
+"""
+Span annidati per il ciclo di vita di una richiesta di analisi.
+
+  with start_trace("analyze", version_id=...) as root:
+    with span("download") as sp:
+      ...
+      sp.set(bytes=123)
+
+span() fuori da una trace attiva non fa niente (costo ~zero), quindi blocchi e
+utils possono aprire span anche quando girano da CLI o nel warm-up.
+
+A fine trace tutti gli span vanno all'exporter, una riga JSON per span:
+  {trace_id, span_id, parent_id, name, start_unix, duration_ms, status, attrs}
+
+Exporter (TEKKIN_TRACE_EXPORTER):
+- off (default): nessun export
+- jsonl: append su TEKKIN_TRACE_FILE (default /tmp/tekkin_traces.jsonl),
+  ruotato in .1 oltre TEKKIN_TRACE_MAX_MB (default 100)
+- "modulo:factory": factory() -> oggetto con export(spans: list[dict])
+set_exporter() lo sostituisce da codice. Aggregazione: scripts/trace_stats.py.
+"""
+from __future__ import annotations
+
+import contextvars
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("tekkin_span", default=None)
+
+class Span:
+  __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "status", "start_unix", "_t0", "duration_ms")
+
+  def __init__(self, trace: "_Trace", name: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+    self.trace = trace
+    self.span_id = uuid.uuid4().hex[:16]
+    self.parent_id = parent_id
+    self.name = name
+    self.attrs = dict(attrs)
+    self.status = "ok"
+    self.start_unix = time.time()
+    self._t0 = time.perf_counter()
+    self.duration_ms: Optional[float] = None
+
+  def set(self, **attrs: Any) -> "Span":
+    self.attrs.update(attrs)
+    return self
+
+  def error(self, message: str) -> "Span":
+    self.status = "error"
+    self.attrs["error"] = message
+    return self
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {
+      "trace_id": self.trace.trace_id,
+      "span_id": self.span_id,
+      "parent_id": self.parent_id,
+      "name": self.name,
+      "start_unix": round(self.start_unix, 6),
+      "duration_ms": self.duration_ms,
+      "status": self.status,
+      "attrs": self.attrs,
+    }
+
+class _NoopSpan:
+  trace = None
+  span_id = None
+
+  def set(self, **attrs: Any) -> "_NoopSpan":
+    return self
+
+  def error(self, message: str) -> "_NoopSpan":
+    return self
+
+_NOOP = _NoopSpan()
+
+class _Trace:
+  def __init__(self) -> None:
+    self.trace_id = uuid.uuid4().hex
+    self.spans: List[Span] = []
+    self._lock = threading.Lock()
+
+  def add(self, sp: Span) -> None:
+    with self._lock:
+      self.spans.append(sp)
+
+# -- exporter ----------------------------------------------------------------
+
+class NullExporter:
+  def export(self, spans: List[Dict[str, Any]]) -> None:
+    return None
+
+class JsonlExporter:
+  """Append di una riga JSON per span; thread-safe, rotazione semplice a .1."""
+
+  def __init__(self, path: str, max_mb: float = 100.0):
+    self.path = path
+    self.max_bytes = int(max_mb * 1024 * 1024)
+    self._lock = threading.Lock()
+
+  def export(self, spans: List[Dict[str, Any]]) -> None:
+    lines = "".join(json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in spans)
+    with self._lock:
+      d = os.path.dirname(self.path)
+      if d:
+        os.makedirs(d, exist_ok=True)
+      try:
+        if self.max_bytes > 0 and os.path.getsize(self.path) > self.max_bytes:
+          os.replace(self.path, self.path + ".1")
+      except OSError:
+        pass
+      with open(self.path, "a", encoding="utf-8") as f:
+        f.write(lines)
+
+def _exporter_from_env() -> Any:
+  name = (os.environ.get("TEKKIN_TRACE_EXPORTER", "off") or "off").strip()
+  if name.lower() in ("", "off", "0", "none"):
+    return NullExporter()
+  if name.lower() == "jsonl":
+    return JsonlExporter(
+      os.environ.get("TEKKIN_TRACE_FILE", "/tmp/tekkin_traces.jsonl"),
+      max_mb=float(os.environ.get("TEKKIN_TRACE_MAX_MB", "100") or 100),
+    )
+  module, _, attr = name.partition(":")
+  try:
+    return getattr(importlib.import_module(module), attr or "exporter")()
+  except Exception as e:
+    logging.getLogger("tekkin-analyzer-min").warning("[trace] exporter %r non caricabile: %s", name, e)
+    return NullExporter()
+
+_exporter: Any = _exporter_from_env()
+
+def set_exporter(exporter: Any) -> None:
+  global _exporter
+  _exporter = exporter if exporter is not None else NullExporter()
+
+def get_exporter() -> Any:
+  return _exporter
+
+def enabled() -> bool:
+  return not isinstance(_exporter, NullExporter)
+
+# -- API ---------------------------------------------------------------------
+
+def current_span() -> Optional[Span]:
+  return _current.get()
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Any]:
+  """Span figlio dello span corrente; no-op se non c'è una trace attiva."""
+  parent = _current.get()
+  if parent is None:
+    yield _NOOP
+    return
+  sp = Span(parent.trace, name, parent.span_id, attrs)
+  token = _current.set(sp)
+  try:
+    yield sp
+  except BaseException as e:
+    sp.error(f"{type(e).__name__}: {e}")
+    raise
+  finally:
+    sp.duration_ms = round((time.perf_counter() - sp._t0) * 1000.0, 3)
+    _current.reset(token)
+    sp.trace.add(sp)
+
+@contextmanager
+def start_trace(name: str, **attrs: Any) -> Iterator[Any]:
+  """Span radice: all'uscita esporta l'intera trace. No-op con exporter off."""
+  if not enabled():
+    yield _NOOP
+    return
+  trace = _Trace()
+  root = Span(trace, name, None, attrs)
+  token = _current.set(root)
+  try:
+    yield root
+  except BaseException as e:
+    # HTTPException & co.: lo status lo mette il chiamante se lo conosce
+    if root.status == "ok":
+      root.error(f"{type(e).__name__}: {e}")
+    raise
+  finally:
+    root.duration_ms = round((time.perf_counter() - root._t0) * 1000.0, 3)
+    _current.reset(token)
+    trace.add(root)
+    try:
+      _exporter.export([s.to_dict() for s in trace.spans])
+    except Exception as e:
+      logging.getLogger("tekkin-analyzer-min").warning("[trace] export failed: %s", e)
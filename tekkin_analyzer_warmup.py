@@ -0,0 +1,103 @@
+# tekkin_analyzer_warmup.py
+"""
+Warm-up del servizio analyzer.
+
+Al primo /analyze il processo pagherebbe: inizializzazione delle librerie
+native (Essentia, FFT), costruzione degli algoritmi, JIT numba dove c'è, e
+lettura dei reference model. Qui si fa tutto all'avvio su un segnale sintetico
+breve, nello stesso ordine della pipeline reale:
+
+- reference model -> cache del core
+- ogni blocco V3 (stessi _safe_block dell'orchestratore)
+- analyze_track legacy (+ waveform bands)
+
+Ogni step ha il suo tempo in ms; gli errori non bloccano l'avvio ma finiscono
+nel risultato (e quindi in /readyz).
+
+Gli algoritmi Essentia costruiti qui tornano nel pool del processo a fine
+warm-up (es_pool.checkout): li riprendono i thread che servono /analyze, e
+nel prefork i worker li ereditano dal master. es_algorithms in /readyz conta
+le istanze disponibili nel pool del processo.
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from tekkin_analyzer_core import _waveform_bands, analyze_track, preload_reference_models
+from tekkin_analyzer_v3.analyze_v3 import V3_BLOCKS, _safe_block
+from tekkin_analyzer_v3.utils.es_pool import checkout, pool_size
+
+WARMUP_SR = 44100
+WARMUP_SECONDS = 6.0  # abbastanza per finestre short-term, tempo e HPCP
+
+
+def synthetic_stereo(sr: int = WARMUP_SR, seconds: float = WARMUP_SECONDS) -> np.ndarray:
+    """Kick a 125 BPM + accordo + rumore, (n, 2) float32."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sr * seconds)) / sr
+    beat = (t * 125.0 / 60.0) % 1.0
+    kick = np.sin(2 * np.pi * (50 + 100 * np.exp(-beat * 30)) * beat) * np.exp(-beat * 8)
+    chord = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 261.6, 329.6)) * 0.08
+    left = 0.5 * kick + chord + 0.01 * rng.standard_normal(t.size)
+    right = 0.5 * kick + chord + 0.01 * rng.standard_normal(t.size)
+    return np.stack([left, right], axis=1).astype(np.float32)
+
+
+def run_warmup(sr: int = WARMUP_SR, seconds: float = WARMUP_SECONDS) -> Dict[str, Any]:
+    """Esegue il warm-up. Ritorna {took_ms_total, steps: {nome: ms}, errors, reference_models}."""
+    t_total = time.perf_counter()
+    steps: Dict[str, int] = {}
+    errors: List[str] = []
+
+    def _step(name: str, fn) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn()
+        except Exception as e:
+            errors.append(f"{name}: {type(e).__name__}: {e}")
+            return None
+        finally:
+            steps[name] = int((time.perf_counter() - t0) * 1000)
+
+    models: List[str] = _step("reference_models", preload_reference_models) or []
+    audio = synthetic_stereo(sr, seconds)
+
+    with checkout():
+        for name, fn in V3_BLOCKS:
+            res = _step(f"v3.{name}", lambda fn=fn, name=name: _safe_block(name, fn, audio, sr))
+            if isinstance(res, dict) and res.get("ok") is False:
+                errors.append(f"v3.{name}: {res.get('error')}")
+
+        stereo_cn = np.ascontiguousarray(audio.T)
+        profile_key = models[0] if models else ""
+        _step(
+            "core.analyze_track",
+            lambda: analyze_track(
+                project_id="warmup",
+                version_id="warmup",
+                profile_key=profile_key,
+                mode="master",
+                sr=sr,
+                audio_stereo=stereo_cn,
+            ),
+        )
+        _step("core.waveform_bands", lambda: _waveform_bands(stereo_cn, sr, points=900))
+
+    return {
+        "took_ms_total": int((time.perf_counter() - t_total) * 1000),
+        "steps": steps,
+        "errors": errors,
+        "reference_models": models,
+        "es_algorithms": pool_size(),
+    }
+
+
+def format_breakdown(import_ms: Dict[str, int], warmup: Dict[str, Any] | None) -> str:
+    """Riga unica per i log: import e warm-up per step."""
+    parts: List[Tuple[str, int]] = [(f"import.{k}", v) for k, v in import_ms.items()]
+    if warmup:
+        parts.extend((k, v) for k, v in (warmup.get("steps") or {}).items())
+    return " ".join(f"{k}={v}ms" for k, v in parts)
@@ -1,10 +1,13 @@
+import argparse
+import hashlib
 import json
 import os
+import random
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
-from supabase import create_client, Client
 
 
 # Carico variabili da .env (se presente)
@@ -13,13 +16,32 @@ load_dotenv(dotenv_path=".env.local")
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-    raise RuntimeError(
-        "SUPABASE_URL o SUPABASE_SERVICE_ROLE_KEY mancanti. "
-        "Configura il file .env o le variabili di ambiente."
-    )
+REFERENCE_TABLE = "reference_tracks"
+# Chiave di idempotenza (vedi migrations/005_reference_tracks_upsert_key.sql)
+UPSERT_KEY = ("profile_key", "source", "source_id")
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_MAX_RETRIES = 3
+RETRY_BASE_DELAY_SEC = 0.5
+
+_supabase = None
+
+
+def get_supabase_client():
+    """Client Supabase creato alla prima richiesta (non all'import)."""
+    global _supabase
+    if _supabase is not None:
+        return _supabase
+
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        raise RuntimeError(
+            "SUPABASE_URL o SUPABASE_SERVICE_ROLE_KEY mancanti. "
+            "Configura il file .env o le variabili di ambiente."
+        )
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    from supabase import create_client
+
+    _supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    return _supabase
 
 
 def build_tonal_balance(reference_ai: Dict[str, Any]) -> Optional[Dict[str, float]]:
@@ -63,7 +85,21 @@ def build_spectral_features(analysis: Dict[str, Any]) -> Optional[Dict[str, floa
     return data or None
 
 
-def save_reference_track(analysis: Dict[str, Any], meta: Dict[str, Any]) -> None:
+def _local_source_id(meta: Dict[str, Any]) -> str:
+    """
+    source_id stabile per reference senza id esterno (es. source=local),
+    cosi' l'upsert resta idempotente: md5 di artista + titolo normalizzati
+    (trim + lowercase). Deve restare identico al backfill SQL di
+    migrations/005_reference_tracks_upsert_key.sql, altrimenti le righe
+    esistenti non combaciano e l'upsert inserisce duplicati.
+    """
+    artist = str(meta.get("track_artist") or "").strip(" \t\r\n").lower()
+    title = str(meta.get("track_title") or "").strip(" \t\r\n").lower()
+    digest = hashlib.md5(f"{artist}|{title}".encode("utf-8")).hexdigest()[:16]
+    return f"local:{digest}"
+
+
+def build_reference_row(analysis: Dict[str, Any], meta: Dict[str, Any]) -> Dict[str, Any]:
     """
     analysis = JSON dell'analyzer (quello loggato in [run-analyzer] Analyzer result JSON)
     meta = metadati della traccia reference, es:
@@ -91,7 +127,7 @@ def save_reference_track(analysis: Dict[str, Any], meta: Dict[str, Any]) -> None
     if not profile_key:
         raise ValueError("profile_key mancante per reference track")
 
-    row = {
+    return {
         "profile_key": profile_key,
         "genre_label": genre_label,
 
@@ -99,8 +135,9 @@ def save_reference_track(analysis: Dict[str, Any], meta: Dict[str, Any]) -> None
         "track_artist": meta.get("track_artist"),
         "label_name": meta.get("label_name"),
 
-        "source": meta.get("source", "local"),
-        "source_id": meta.get("source_id"),
+        # "source": null nel JSON vale "local": NULL non entra mai in conflitto sulla chiave di upsert
+        "source": meta.get("source") or "local",
+        "source_id": meta.get("source_id") or _local_source_id(meta),
         "source_url": meta.get("source_url"),
 
         # Loudness e tempo
@@ -122,8 +159,155 @@ def save_reference_track(analysis: Dict[str, Any], meta: Dict[str, Any]) -> None
         "analyzer_raw": analysis,
     }
 
-    resp = supabase.table("reference_tracks").insert(row).execute()
-    print("Inserted reference track:", resp.data)
+
+def _row_key(row: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(row.get(k) for k in UPSERT_KEY)
+
+
+def _upsert_rows(client, rows: List[Dict[str, Any]]):
+    return (
+        client.table(REFERENCE_TABLE)
+        .upsert(rows, on_conflict=",".join(UPSERT_KEY))
+        .execute()
+    )
+
+
+def upsert_reference_rows(
+    rows: List[Dict[str, Any]],
+    *,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    client=None,
+) -> Dict[str, Any]:
+    """
+    Upsert a blocchi su reference_tracks, idempotente per (profile_key, source, source_id).
+
+    - una richiesta per blocco di batch_size righe
+    - se un blocco fallisce, le sue righe vengono ritentate una per una
+      (max_retries tentativi con backoff esponenziale): una riga rotta
+      non fa perdere il resto del blocco
+    - righe con la stessa chiave nello stesso run: vince l'ultima
+      (Postgres rifiuta due update della stessa riga nello stesso upsert)
+
+    Ritorna un riepilogo: {"upserted", "failed": [{"key", "error"}], "requests", "seconds"}.
+    """
+    if client is None:
+        client = get_supabase_client()
+    batch_size = max(1, int(batch_size))
+
+    deduped: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for row in rows:
+        deduped[_row_key(row)] = row
+    unique_rows = list(deduped.values())
+
+    t0 = time.perf_counter()
+    upserted = 0
+    requests = 0
+    failed: List[Dict[str, Any]] = []
+
+    for i in range(0, len(unique_rows), batch_size):
+        batch = unique_rows[i : i + batch_size]
+        requests += 1
+        try:
+            _upsert_rows(client, batch)
+            upserted += len(batch)
+            print(f"[UPSERT] batch {i // batch_size + 1}: {len(batch)} righe")
+            continue
+        except Exception as e:
+            print(f"[UPSERT] batch {i // batch_size + 1} fallito ({type(e).__name__}: {e}), ritento riga per riga")
+
+        for row in batch:
+            last_error: Optional[Exception] = None
+            for attempt in range(max(1, int(max_retries))):
+                if attempt > 0:
+                    time.sleep(RETRY_BASE_DELAY_SEC * (2 ** (attempt - 1)))
+                requests += 1
+                try:
+                    _upsert_rows(client, [row])
+                    upserted += 1
+                    last_error = None
+                    break
+                except Exception as e:
+                    last_error = e
+            if last_error is not None:
+                failed.append({"key": list(_row_key(row)), "error": f"{type(last_error).__name__}: {last_error}"})
+                print(f"  ERRORE upsert {_row_key(row)}: {last_error}")
+
+    return {
+        "upserted": upserted,
+        "failed": failed,
+        "requests": requests,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+def save_reference_track(analysis: Dict[str, Any], meta: Dict[str, Any], *, client=None) -> None:
+    """Upsert di una singola reference (vedi build_reference_row per il formato)."""
+    row = build_reference_row(analysis, meta)
+    if client is None:
+        client = get_supabase_client()
+    resp = _upsert_rows(client, [row])
+    print("Upserted reference track:", resp.data)
+
+
+class LocalReferenceStore:
+    """
+    Stand-in locale del client Supabase per reference_tracks, per misurare
+    il throughput dell'ingest senza backend: stessa catena
+    client.table(...).upsert(rows, on_conflict=...).execute().
+
+    latency_ms simula il round trip per richiesta, fail_rate fa fallire
+    richieste a caso per esercitare i retry.
+    """
+
+    class _Result:
+        def __init__(self, data: List[Dict[str, Any]]):
+            self.data = data
+
+    class _Query:
+        def __init__(self, store: "LocalReferenceStore", table: str):
+            self._store = store
+            self._table = table
+            self._rows: List[Dict[str, Any]] = []
+            self._on_conflict: Tuple[str, ...] = ()
+
+        def upsert(self, rows, on_conflict: str = "", **_kwargs):
+            self._rows = list(rows) if isinstance(rows, list) else [rows]
+            self._on_conflict = tuple(k for k in on_conflict.split(",") if k)
+            return self
+
+        def execute(self):
+            return self._store._execute(self._table, self._rows, self._on_conflict)
+
+    def __init__(self, *, latency_ms: float = 0.0, fail_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = float(latency_ms)
+        self.fail_rate = float(fail_rate)
+        self.requests = 0
+        self.tables: Dict[str, Dict[Tuple[Any, ...], Dict[str, Any]]] = {}
+        self._rng = random.Random(seed)
+
+    def table(self, name: str) -> "LocalReferenceStore._Query":
+        return LocalReferenceStore._Query(self, name)
+
+    def _execute(self, table: str, rows: List[Dict[str, Any]], on_conflict: Tuple[str, ...]):
+        self.requests += 1
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+        if self.fail_rate > 0 and self._rng.random() < self.fail_rate:
+            raise RuntimeError("local store: simulated failure")
+
+        keys = on_conflict or UPSERT_KEY
+        seen = set()
+        for row in rows:
+            key = tuple(row.get(k) for k in keys)
+            if key in seen:
+                raise RuntimeError("ON CONFLICT DO UPDATE command cannot affect row a second time")
+            seen.add(key)
+
+        store = self.tables.setdefault(table, {})
+        for row in rows:
+            store[tuple(row.get(k) for k in keys)] = dict(row)
+        return LocalReferenceStore._Result(rows)
 
 
 def load_json(path: Path) -> Dict[str, Any]:
@@ -131,7 +315,22 @@ def load_json(path: Path) -> Dict[str, Any]:
         return json.load(f)
 
 
-def ingest_reference_batch(references: List[Dict[str, Any]]) -> None:
+def load_manifest(path: Path) -> List[Dict[str, Any]]:
+    """Manifest = lista JSON di {json_path, meta}."""
+    with path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError(f"manifest {path}: attesa una lista di {{json_path, meta}}")
+    return data
+
+
+def ingest_reference_batch(
+    references: List[Dict[str, Any]],
+    *,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    client=None,
+) -> Dict[str, Any]:
     """
     references è una lista di dict del tipo:
 
@@ -149,7 +348,13 @@ def ingest_reference_batch(references: List[Dict[str, Any]]) -> None:
         "analyzer_version": "v3.6"
       }
     }
+
+    Le righe vengono costruite in locale e poi scritte con upsert_reference_rows
+    (una richiesta ogni batch_size reference).
     """
+    rows: List[Dict[str, Any]] = []
+    skipped: List[Dict[str, Any]] = []
+
     for ref in references:
         json_path = Path(ref["json_path"])
         meta = ref["meta"]
@@ -158,13 +363,79 @@ def ingest_reference_batch(references: List[Dict[str, Any]]) -> None:
 
         if not json_path.exists():
             print(f"  ERRORE: file JSON non trovato: {json_path}")
+            skipped.append({"json_path": str(json_path), "error": "file JSON non trovato"})
             continue
 
-        analysis = load_json(json_path)
-        save_reference_track(analysis, meta)
+        try:
+            analysis = load_json(json_path)
+            rows.append(build_reference_row(analysis, meta))
+        except Exception as e:
+            print(f"  ERRORE: {type(e).__name__}: {e}")
+            skipped.append({"json_path": str(json_path), "error": f"{type(e).__name__}: {e}"})
+
+    summary = upsert_reference_rows(rows, batch_size=batch_size, max_retries=max_retries, client=client)
+    summary["skipped"] = skipped
+    print(
+        f"[INGEST] upserted={summary['upserted']} failed={len(summary['failed'])} "
+        f"skipped={len(skipped)} requests={summary['requests']} in {summary['seconds']}s"
+    )
+    return summary
+
+
+def _synthetic_reference_rows(n: int) -> List[Dict[str, Any]]:
+    rows = []
+    for i in range(n):
+        meta = {
+            "track_title": f"Bench {i}",
+            "track_artist": "Bench",
+            "source": "local",
+            "profile_key": "minimal_deep_tech",
+            "genre_label": "Minimal / Deep Tech",
+        }
+        analysis = {"lufs": -8.0, "bpm": 126.0, "spectral_centroid_hz": 2500.0, "reference_ai": {}}
+        rows.append(build_reference_row(analysis, meta))
+    return rows
+
+
+def run_local_benchmark(n: int, *, batch_size: int, latency_ms: float, fail_rate: float) -> None:
+    """Throughput riga-per-riga vs a blocchi sullo stand-in locale."""
+    rows = _synthetic_reference_rows(n)
+    for label, bs in (("per-row", 1), (f"batch={batch_size}", batch_size)):
+        store = LocalReferenceStore(latency_ms=latency_ms, fail_rate=fail_rate)
+        summary = upsert_reference_rows(rows, batch_size=bs, client=store)
+        # secondo giro: deve restare idempotente
+        upsert_reference_rows(rows, batch_size=bs, client=store)
+        stored = len(store.tables.get(REFERENCE_TABLE, {}))
+        rate = summary["upserted"] / summary["seconds"] if summary["seconds"] > 0 else float("inf")
+        print(
+            f"[BENCH] {label}: {summary['upserted']} righe in {summary['seconds']}s "
+            f"({rate:.1f} righe/s, {summary['requests']} richieste, failed={len(summary['failed'])}, stored={stored})"
+        )
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Ingest reference tracks in Supabase (upsert a blocchi)")
+    p.add_argument("--manifest", default=None, help="JSON con lista di {json_path, meta} (default: lista di esempio)")
+    p.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    p.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES)
+    p.add_argument("--local-benchmark", type=int, default=0, help="Benchmark su N righe sintetiche con lo stand-in locale")
+    p.add_argument("--latency-ms", type=float, default=40.0, help="Round trip simulato nel benchmark locale")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="Frazione di richieste fallite nel benchmark locale")
+    return p.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
+
+    if args.local_benchmark > 0:
+        run_local_benchmark(
+            args.local_benchmark,
+            batch_size=args.batch_size,
+            latency_ms=args.latency_ms,
+            fail_rate=args.fail_rate,
+        )
+        raise SystemExit(0)
+
     # Lista di reference da ingestare
     references_to_ingest: List[Dict[str, Any]] = [
         {
@@ -198,4 +469,11 @@ if __name__ == "__main__":
         # },
     ]
 
-    ingest_reference_batch(references_to_ingest)
+    if args.manifest:
+        references_to_ingest = load_manifest(Path(args.manifest))
+
+    ingest_reference_batch(
+        references_to_ingest,
+        batch_size=args.batch_size,
+        max_retries=args.max_retries,
+    )
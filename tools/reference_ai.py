@@ -6,7 +6,15 @@ import json
 
 import math
 
-from typing import Any, Dict, List, Tuple
+import os
+
+from dataclasses import dataclass
+
+from typing import Any, Dict, List, Optional, Tuple
+
+
+
+import numpy as np
 
 
 
@@ -55,158 +63,235 @@ def load_reference_db(path: str = "reference_db.json") -> Dict[str, Any]:
         return json.load(f)
 
 
+# Cache del reference_db su disco: path assoluto -> (firma file, db).
+# La firma (mtime_ns, size) invalida la cache quando reference_db.json cambia.
+_DB_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
 
 
+def _file_signature(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
 
-def _ensure_dict(value: Any) -> Dict[str, Any]:
-
-    return value if isinstance(value, dict) else {}
-
-
-
-
-
-def _ensure_list(value: Any) -> List[Any]:
-
-    return value if isinstance(value, list) else []
-
-
-
-
-
-def features_to_vector(features: Dict[str, float]) -> List[float]:
-
-    features_safe = _ensure_dict(features)
-
-    vec = []
-
-    for key in FEATURE_KEYS:
-
-        value = features_safe.get(key)
-
-        if value is None:
-
-            value = 0.0
-
-        vec.append(float(value))
-
-    return vec
-
-
-
-
-
-def cosine_similarity(a: List[float], b: List[float]) -> float:
 
+def get_reference_db(path: str = "reference_db.json") -> Dict[str, Any]:
     """
-
-    cos(theta) = (aÃÂ·b) / (|a| * |b|)
-
-
-
-    dove:
-
-    aÃÂ·b = somma_i (a_i * b_i)
-
-    |a| = sqrt(somma_i (a_i^2))
-
+    Come load_reference_db, ma rilegge il file solo se e' cambiato.
+    Ritorna sempre lo stesso oggetto dict finche' il file non cambia, cosi'
+    la matrice compilata (compile_reference_db) resta in cache.
+    Solleva FileNotFoundError se il file non esiste.
     """
+    abs_path = os.path.abspath(path)
+    signature = _file_signature(abs_path)
+    cached = _DB_CACHE.get(abs_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
 
-    if len(a) != len(b):
-
-        return 0.0
-
-
-
-    dot = 0.0
+    db = load_reference_db(abs_path)
+    _DB_CACHE[abs_path] = (signature, db)
+    return db
 
-    norm_a = 0.0
 
-    norm_b = 0.0
 
 
 
-    for i in range(len(a)):
-
-        dot += a[i] * b[i]
-
-        norm_a += a[i] * a[i]
+def _ensure_dict(value: Any) -> Dict[str, Any]:
 
-        norm_b += b[i] * b[i]
+    return value if isinstance(value, dict) else {}
 
 
 
-    if norm_a == 0 or norm_b == 0:
 
-        return 0.0
 
+def _ensure_list(value: Any) -> List[Any]:
 
+    return value if isinstance(value, list) else []
 
-    return dot / (math.sqrt(norm_a) * math.sqrt(norm_b))
 
 
 
 
+@dataclass
+class CompiledReferenceDB:
+    """
+    reference_db compilato per la ricerca vettoriale.
+    matrix: (n_tracks, n_features) standardizzata con mean/scale della popolazione reference,
+    norms: norma L2 di ogni riga (0 per righe tutte a media).
+    """
 
-def find_similar_tracks(
+    genres: List[str]
+    tracks: List[Dict[str, Any]]
+    matrix: np.ndarray
+    norms: np.ndarray
+    mean: np.ndarray
+    scale: np.ndarray
 
-    track_features: Dict[str, float],
 
-    reference_db: Dict[str, Any],
+# Una sola entry: (db, compilato). Teniamo il riferimento al db per confrontarlo
+# per identita' senza rischiare il riuso di id() dopo il garbage collector.
+_COMPILED_CACHE: Dict[str, Tuple[Dict[str, Any], CompiledReferenceDB]] = {}
 
-    top_n: int = 5,
 
-) -> List[Dict[str, Any]]:
-
-    target_vec = features_to_vector(track_features)
+def _features_to_array(features: Dict[str, Any]) -> np.ndarray:
+    """Vettore FEATURE_KEYS con NaN per i valori mancanti o non numerici."""
+    features_safe = _ensure_dict(features)
+    vec = np.full(len(FEATURE_KEYS), np.nan, dtype=np.float64)
+    for i, key in enumerate(FEATURE_KEYS):
+        value = features_safe.get(key)
+        if value is None:
+            continue
+        try:
+            vec[i] = float(value)
+        except (TypeError, ValueError):
+            continue
+    vec[~np.isfinite(vec)] = np.nan
+    return vec
 
 
+def _pooled_feature_stats(genres: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    mean/std per feature combinando le feature_stats dei generi
+    (varianza totale = media delle varianze + varianza delle medie).
+    """
+    n_features = len(FEATURE_KEYS)
+    mean = np.zeros(n_features, dtype=np.float64)
+    scale = np.ones(n_features, dtype=np.float64)
+
+    means: List[np.ndarray] = []
+    stds: List[np.ndarray] = []
+    for genre_data in genres.values():
+        stats = _ensure_dict(_ensure_dict(genre_data).get("feature_stats"))
+        means.append(_features_to_array(_ensure_dict(stats.get("mean"))))
+        stds.append(_features_to_array(_ensure_dict(stats.get("std"))))
+    if not means:
+        return mean, scale
+
+    m = np.vstack(means)
+    sd = np.vstack(stds)
+    for i in range(n_features):
+        ok = np.isfinite(m[:, i]) & np.isfinite(sd[:, i])
+        if not np.any(ok):
+            continue
+        mu = float(np.mean(m[ok, i]))
+        total_var = float(np.mean(sd[ok, i] ** 2) + np.var(m[ok, i]))
+        if total_var > 1e-24:
+            mean[i] = mu
+            scale[i] = math.sqrt(total_var)
+    return mean, scale
+
+
+def compile_reference_db(reference_db: Dict[str, Any]) -> CompiledReferenceDB:
+    """
+    Compila il reference_db in una matrice standardizzata (z-score per feature),
+    cosi' bpm e centroid in Hz non dominano i ratio di banda nel coseno.
+    Le feature mancanti valgono 0 (= media del reference) dopo la standardizzazione.
+    Con meno di 2 reference per feature si usano le feature_stats dei generi.
+    Il risultato e' in cache finche' viene passato lo stesso oggetto db.
+    """
+    cached = _COMPILED_CACHE.get("db")
+    if cached is not None and cached[0] is reference_db:
+        return cached[1]
 
-    all_candidates: List[Dict[str, Any]] = []
+    genres_out: List[str] = []
+    tracks_out: List[Dict[str, Any]] = []
+    rows: List[np.ndarray] = []
 
     genres = _ensure_dict(reference_db).get("genres", {})
-
     if not isinstance(genres, dict):
-
         genres = {}
 
-
-
     for genre_id, genre_data in genres.items():
-
         genre_data = _ensure_dict(genre_data)
-
         for t in _ensure_list(genre_data.get("tracks")):
-
             track_data = _ensure_dict(t)
-
             ref_features = _ensure_dict(track_data.get("features"))
-
             if not ref_features:
-
                 continue
-
-            ref_vec = features_to_vector(ref_features)
-
-            sim = cosine_similarity(target_vec, ref_vec)
-
+            genres_out.append(genre_id)
+            tracks_out.append(track_data)
+            rows.append(_features_to_array(ref_features))
+
+    n_features = len(FEATURE_KEYS)
+    raw = np.vstack(rows) if rows else np.empty((0, n_features), dtype=np.float64)
+
+    # Statistiche per feature: popolazione reference dove ci sono almeno 2 valori
+    # con varianza, altrimenti feature_stats dei generi, altrimenti raw (mean 0, scale 1).
+    mean, scale = _pooled_feature_stats(genres)
+    if raw.shape[0] > 0:
+        valid = np.isfinite(raw)
+        counts = valid.sum(axis=0)
+        filled = np.where(valid, raw, 0.0)
+        pop_mean = filled.sum(axis=0) / np.maximum(counts, 1)
+        var = np.where(valid, (raw - pop_mean) ** 2, 0.0).sum(axis=0) / np.maximum(counts, 1)
+        pop_std = np.sqrt(var)
+        use_pop = (counts >= 2) & (pop_std > 1e-12)
+        mean[use_pop] = pop_mean[use_pop]
+        scale[use_pop] = pop_std[use_pop]
+
+    matrix = (raw - mean) / scale
+    matrix[~np.isfinite(matrix)] = 0.0
+    norms = np.linalg.norm(matrix, axis=1)
+
+    compiled = CompiledReferenceDB(
+        genres=genres_out,
+        tracks=tracks_out,
+        matrix=matrix,
+        norms=norms,
+        mean=mean,
+        scale=scale,
+    )
+    _COMPILED_CACHE["db"] = (reference_db, compiled)
+    return compiled
 
 
-            all_candidates.append({
-
-                "genre": genre_id,
-
-                "similarity": sim,
-
-                "track": track_data,
+def find_similar_tracks(
 
-            })
+    track_features: Dict[str, float],
 
+    reference_db: Dict[str, Any],
 
+    top_n: int = 5,
 
-    all_candidates.sort(key=lambda x: x["similarity"], reverse=True)
+    compiled: Optional[CompiledReferenceDB] = None,
 
-    return all_candidates[:top_n]
+) -> List[Dict[str, Any]]:
+    """
+    Top-N reference per similarita' coseno sulle feature standardizzate.
+    Un solo prodotto matrice-vettore sul db compilato + argpartition.
+    """
+    if compiled is None:
+        compiled = compile_reference_db(reference_db)
+
+    n_tracks = compiled.matrix.shape[0]
+    if n_tracks == 0 or top_n <= 0:
+        return []
+
+    target = (_features_to_array(track_features) - compiled.mean) / compiled.scale
+    target[~np.isfinite(target)] = 0.0
+    target_norm = float(np.linalg.norm(target))
+
+    denom = compiled.norms * target_norm
+    dots = compiled.matrix @ target
+    sims = np.divide(dots, denom, out=np.zeros(n_tracks, dtype=np.float64), where=denom > 0)
+
+    k = min(int(top_n), n_tracks)
+    if k < n_tracks:
+        # argpartition sceglie a caso tra i pari merito al confine: si prendono
+        # tutti quelli con score >= k-esimo e si taglia dopo l'ordinamento
+        kth = sims[np.argpartition(-sims, k - 1)[k - 1]]
+        idx = np.flatnonzero(sims >= kth)
+    else:
+        idx = np.arange(n_tracks)
+    # ordine decrescente, a parita' di score mantiene l'ordine del db (come il sort stabile)
+    idx = idx[np.lexsort((idx, -sims[idx]))][:k]
+
+    return [
+        {
+            "genre": compiled.genres[i],
+            "similarity": float(sims[i]),
+            "track": compiled.tracks[i],
+        }
+        for i in idx
+    ]
 
 
 
@@ -0,0 +1,304 @@
+"""
+Loudness integrata e short-term BS.1770 in un solo passaggio.
+
+pyloudnorm rifiltra (K-weighting) e ricalcola tutti i blocchi di gating per ogni
+finestra short-term: su una traccia di 6 minuti con hop 1 s sono ~360 passaggi
+completi di filtro su finestre da 3 s.
+
+Qui il segnale viene K-pesato una sola volta (stessi filtri del Meter, in un
+unico sosfilt) e le energie dei blocchi da 400 ms di ogni finestra si leggono
+da somme cumulative dei quadrati. `Meter.integrated_loudness(finestra)` filtra
+ogni finestra partendo da stato zero: per linearità l'uscita della finestra è
+l'uscita globale meno la risposta a ingresso nullo (ZIR) dello stato dei filtri
+all'inizio della finestra. Lo stato si registra durante il filtraggio unico
+(segmenti tra gli inizi delle finestre, stato portato da uno all'altro) e la
+ZIR è una combinazione delle risposte dei singoli elementi di stato, calcolate
+una volta: nessun rifiltraggio per finestra. La correzione serve solo sulla
+testa (finché la ZIR non si è estinta).
+
+Il gating (assoluto -70 LUFS, relativo -10 LU) replica riga per riga quello di
+pyloudnorm, inclusi i casi limite (-inf con finestre mute).
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+import warnings
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy.signal import sosfilt
+
+_CHANNEL_GAINS = np.array([1.0, 1.0, 1.0, 1.41, 1.41])
+_ABS_GATE_LUFS = -70.0
+
+# soglia sotto cui la risposta a ingresso nullo dei filtri è trascurabile
+_ZIR_EPS = 1e-16
+# finestre corrette in testa per batch (memoria ~ batch * canali * testa)
+_HEAD_BATCH = 64
+
+
+def _as_2d(data: np.ndarray) -> np.ndarray:
+    x = np.asarray(data, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, None]
+    return x
+
+
+def _filter_stages(meter):
+    return list(meter._filters.values())
+
+
+def _sos_matrix(stages) -> np.ndarray:
+    """
+    Catena di IIRfilter.apply_filter (passband_gain * lfilter(b, a, x)) come
+    sezioni del second'ordine: il guadagno entra nel numeratore.
+    """
+    rows = []
+    for stage in stages:
+        b = np.atleast_1d(np.asarray(stage.b, dtype=np.float64))
+        a = np.atleast_1d(np.asarray(stage.a, dtype=np.float64))
+        if b.size > 3 or a.size > 3:
+            raise ValueError("filtro di loudness di ordine > 2 non supportato")
+        b = np.pad(b, (0, 3 - b.size))
+        a = np.pad(a, (0, 3 - a.size))
+        rows.append(np.concatenate([stage.passband_gain * b / a[0], a / a[0]]))
+    return np.asarray(rows, dtype=np.float64)
+
+
+def _settle_samples(stages, max_len: int) -> int:
+    """Campioni dopo cui lo stato iniziale dei filtri non pesa più sull'uscita."""
+    radius = 0.0
+    for stage in stages:
+        a = np.atleast_1d(np.asarray(stage.a, dtype=np.float64))
+        if a.size > 1:
+            radius = max(radius, float(np.max(np.abs(np.roots(a)))))
+    if radius <= 0.0:
+        return 0
+    if radius >= 1.0:
+        return max_len
+    # margine x2 per i poli doppi (passa-alto K-weighting con Q = 0.5)
+    n = 2 * int(math.ceil(math.log(_ZIR_EPS) / math.log(radius)))
+    return int(min(max_len, n))
+
+
+def _block_bounds(meter, length: int) -> Tuple[np.ndarray, np.ndarray]:
+    # stessi limiti (in campioni) calcolati da Meter.integrated_loudness
+    rate = meter.rate
+    t_g = meter.block_size
+    step = 1.0 - float(getattr(meter, "overlap", 0.75))
+    duration = length / rate
+    num_blocks = int(np.round(((duration - t_g) / (t_g * step)))) + 1
+    lows = np.array([int(t_g * (j * step) * rate) for j in range(num_blocks)], dtype=np.int64)
+    highs = np.array([int(t_g * (j * step + 1) * rate) for j in range(num_blocks)], dtype=np.int64)
+    # np.sum su uno slice oltre la fine si ferma all'ultimo campione
+    return np.minimum(lows, length), np.minimum(highs, length)
+
+
+def _gated_loudness(z: np.ndarray) -> np.ndarray:
+    """
+    z: (finestre, canali, blocchi) mean-square K-pesati.
+    Ritorna la loudness integrata (gating BS.1770) per ogni finestra.
+    """
+    n_ch = z.shape[1]
+    gains = _CHANNEL_GAINS[:n_ch][None, :, None]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            power = np.sum(gains * z, axis=1)
+            block_lufs = -0.691 + 10.0 * np.log10(power)
+
+            abs_mask = block_lufs >= _ABS_GATE_LUFS
+            abs_count = abs_mask.sum(axis=1)
+            z_abs = np.sum(z * abs_mask[:, None, :], axis=2) / abs_count[:, None]
+            gamma_r = -0.691 + 10.0 * np.log10(np.sum(_CHANNEL_GAINS[:n_ch] * z_abs, axis=1)) - 10.0
+
+            rel_mask = (block_lufs > gamma_r[:, None]) & (block_lufs > _ABS_GATE_LUFS)
+            rel_count = rel_mask.sum(axis=1)
+            z_rel = np.sum(z * rel_mask[:, None, :], axis=2) / rel_count[:, None]
+            z_rel = np.nan_to_num(z_rel)
+            return -0.691 + 10.0 * np.log10(np.sum(_CHANNEL_GAINS[:n_ch] * z_rel, axis=1))
+
+
+class KWeightedSignal:
+    """
+    Segnale K-pesato una volta sola, da cui si ricava la loudness gated di
+    qualunque finestra [start, start + length). `cuts`: inizi delle finestre
+    noti in anticipo, dove registrare lo stato dei filtri durante il
+    filtraggio; gli altri si ricavano rifiltrando dal punto noto precedente.
+    """
+
+    def __init__(self, meter, data: np.ndarray, cuts: Optional[Iterable[int]] = None):
+        self.meter = meter
+        self.raw = _as_2d(data)
+        self.n_samples, self.n_channels = self.raw.shape
+        stages = _filter_stages(meter)
+        self._sos = _sos_matrix(stages)
+        self._settle = _settle_samples(stages, self.n_samples)
+        # stato dei filtri all'inizio di ogni finestra nota: (sezioni, 2, canali),
+        # forma di zi per sosfilt lungo l'asse 0
+        self._states: Dict[int, np.ndarray] = {}
+        self._known: List[int] = []
+        self._weighted = self._filter_once(cuts)
+        # somme cumulative dei quadrati, calcolate in posto (niente copie del segnale)
+        self._csum = np.zeros((self.n_samples + 1, self.n_channels), dtype=np.float64)
+        np.square(self._weighted, out=self._csum[1:])
+        np.cumsum(self._csum[1:], axis=0, out=self._csum[1:])
+        self._zir_basis: Optional[np.ndarray] = None
+
+    def _filter_once(self, cuts: Optional[Iterable[int]]) -> np.ndarray:
+        """sosfilt sull'intero segnale, a segmenti tra i cuts con lo stato portato."""
+        x = self.raw
+        zi = np.zeros((self._sos.shape[0], 2, self.n_channels), dtype=np.float64)
+        self._remember(0, zi)
+        points = sorted({int(c) for c in (cuts if cuts is not None else ()) if 0 < int(c) < self.n_samples})
+        out = np.empty_like(x)
+        prev = 0
+        for c in points + [self.n_samples]:
+            out[prev:c], zi = sosfilt(self._sos, x[prev:c], axis=0, zi=zi)
+            if c < self.n_samples:
+                self._remember(c, zi)
+            prev = c
+        return out
+
+    def _remember(self, pos: int, state: np.ndarray) -> None:
+        self._states[pos] = state
+        bisect.insort(self._known, pos)
+
+    def _states_at(self, starts: np.ndarray) -> np.ndarray:
+        """Stato dei filtri all'inizio di ogni finestra: (finestre, sezioni, 2, canali)."""
+        for p in np.unique(starts).tolist():
+            if p in self._states:
+                continue
+            # dal punto noto precedente (le finestre ordinate rifiltrano solo i buchi)
+            c = self._known[bisect.bisect_right(self._known, p) - 1]
+            _, zi = sosfilt(self._sos, self.raw[c:p], axis=0, zi=self._states[c])
+            self._remember(p, zi)
+        return np.stack([self._states[p] for p in starts.tolist()])
+
+    def _zir(self, head: int) -> np.ndarray:
+        """Risposte a ingresso nullo di ogni elemento di stato: (sezioni * 2, head)."""
+        if self._zir_basis is None or self._zir_basis.shape[1] != head:
+            n_sec = self._sos.shape[0]
+            basis = np.empty((n_sec, 2, head), dtype=np.float64)
+            zeros = np.zeros(head, dtype=np.float64)
+            for k in range(n_sec):
+                for j in range(2):
+                    zi = np.zeros((n_sec, 2), dtype=np.float64)
+                    zi[k, j] = 1.0
+                    basis[k, j], _ = sosfilt(self._sos, zeros, zi=zi)
+            self._zir_basis = basis.reshape(n_sec * 2, head)
+        return self._zir_basis
+
+    def _window_sums(self, starts: np.ndarray, length: int, lows: np.ndarray, highs: np.ndarray) -> np.ndarray:
+        """Somme dei quadrati per blocco: (finestre, canali, blocchi)."""
+        cs = self._csum
+        head = min(self._settle, length)
+        lo_abs = starts[:, None] + lows[None, :]
+        hi_abs = starts[:, None] + highs[None, :]
+        sums = np.moveaxis(cs[hi_abs] - cs[lo_abs], 2, 1)  # (finestre, canali, blocchi)
+
+        if head <= 0:
+            return sums
+
+        # testa di ogni finestra come la filtra pyloudnorm (da stato zero):
+        # uscita globale meno la ZIR dello stato all'inizio della finestra
+        touched = lows < head
+        if not np.any(touched):
+            return sums
+        block_idx = np.nonzero(touched)[0]
+        lo_t = lows[touched]
+        hi_t = highs[touched]
+        lo_in = np.minimum(lo_t, head)
+        hi_in = np.minimum(hi_t, head)
+        basis = self._zir(head)
+        offsets = np.arange(head)
+        for b0 in range(0, starts.size, _HEAD_BATCH):
+            st = starts[b0:b0 + _HEAD_BATCH]
+            states = np.moveaxis(self._states_at(st), 3, 1)  # (w, canali, sezioni, 2)
+            zir = states.reshape(st.size, self.n_channels, -1) @ basis  # (w, canali, head)
+            seg = self._weighted[st[:, None] + offsets[None, :]]  # (w, head, canali)
+            seg -= np.moveaxis(zir, 2, 1)
+            head_cs = np.zeros((st.size, head + 1, self.n_channels), dtype=np.float64)
+            np.square(seg, out=head_cs[:, 1:])
+            np.cumsum(head_cs[:, 1:], axis=1, out=head_cs[:, 1:])
+
+            # parte del blocco dentro la testa: somme corrette; oltre la testa: somme globali
+            part_head = head_cs[:, hi_in] - head_cs[:, lo_in]  # (w, blocchi, canali)
+            tail_lo = st[:, None] + np.maximum(lo_t, head)[None, :]
+            tail_hi = st[:, None] + np.maximum(hi_t, head)[None, :]
+            part_tail = cs[tail_hi] - cs[tail_lo]
+            # indici avanzati separati dallo slice: il risultato è (w, blocchi, canali)
+            sums[b0:b0 + st.size, :, block_idx] = np.moveaxis(part_head + part_tail, 2, 1)
+        return sums
+
+    def loudness(self, starts: Iterable[int], length: int) -> np.ndarray:
+        """
+        Loudness integrata gated di finestre lunghe `length` campioni che
+        partono da `starts`. Finestre più corte del blocco di gating -> nan
+        (pyloudnorm solleverebbe ValueError).
+        """
+        starts = np.asarray(list(starts) if not isinstance(starts, np.ndarray) else starts, dtype=np.int64)
+        out = np.full(starts.shape, np.nan, dtype=np.float64)
+        if starts.size == 0 or length < self.meter.block_size * self.meter.rate:
+            return out
+        lows, highs = _block_bounds(self.meter, int(length))
+        t_g_rate = self.meter.block_size * self.meter.rate
+        sums = self._window_sums(starts, int(length), lows, highs)
+        out[:] = _gated_loudness(sums / t_g_rate)
+        return out
+
+    def integrated(self) -> float:
+        """Equivalente a meter.integrated_loudness(data) sull'intero segnale."""
+        return float(self.loudness(np.zeros(1, dtype=np.int64), self.n_samples)[0])
+
+
+def window_peaks(data: np.ndarray, starts: np.ndarray, length: int) -> np.ndarray:
+    """
+    max(|x|) di ogni finestra [start, start + length), su tutti i canali,
+    senza rileggere i campioni sovrapposti (massimi per chunk + massimo scorrevole).
+    """
+    x = _as_2d(data)
+    starts = np.asarray(starts, dtype=np.int64)
+    if starts.size == 0:
+        return np.zeros(0, dtype=np.float64)
+    chunk = math.gcd(int(length), *[int(s) for s in np.unique(np.diff(starts))]) if starts.size > 1 else int(length)
+    chunk = math.gcd(chunk, int(starts[0])) if starts[0] else chunk
+    chunk = max(1, chunk)
+    end = int(starts[-1]) + int(length)
+    n_chunks = end // chunk
+    chunk_max = np.max(np.abs(x[: n_chunks * chunk]).reshape(n_chunks, chunk, -1), axis=(1, 2))
+    per_win = int(length) // chunk
+    sliding = np.lib.stride_tricks.sliding_window_view(chunk_max, per_win)
+    return np.max(sliding[starts // chunk], axis=1)
+
+
+def short_term_series(
+    meter,
+    data: np.ndarray,
+    window_sec: float = 3.0,
+    hop_sec: float = 1.0,
+    silence_floor: Optional[float] = None,
+) -> Tuple[float, np.ndarray]:
+    """
+    Loudness integrata + serie short-term (finestre complete, hop fisso).
+
+    Ritorna (integrated_lufs, valori) dove valori ha una voce per finestra;
+    le finestre con picco sotto `silence_floor` valgono nan.
+    """
+    n_samples = _as_2d(data).shape[0]
+    frame_len = int(window_sec * meter.rate)
+    hop_len = int(hop_sec * meter.rate)
+    if frame_len <= 0 or hop_len <= 0 or n_samples < frame_len:
+        return KWeightedSignal(meter, data).integrated(), np.zeros(0, dtype=np.float64)
+    starts = np.arange(0, n_samples - frame_len + 1, hop_len, dtype=np.int64)
+    signal = KWeightedSignal(meter, data, cuts=starts)
+    integrated = signal.integrated()
+    values = np.full(starts.shape, np.nan, dtype=np.float64)
+    keep = np.ones(starts.shape, dtype=bool)
+    if silence_floor is not None:
+        keep = window_peaks(signal.raw, starts, frame_len) >= silence_floor
+    if np.any(keep):
+        values[keep] = signal.loudness(starts[keep], frame_len)
+    return integrated, values
@@ -2,8 +2,9 @@ import math
 import numpy as np
 import librosa
 import pyloudnorm as pyln  # devi installarlo
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
+from short_term_loudness import KWeightedSignal
 from tekkin_analyzer_v1_models import (
     AnalyzerV1Result,
     AnalyzerV1Metrics,
@@ -32,24 +33,81 @@ def rms(signal: np.ndarray) -> float:
     return float(np.sqrt(np.mean(signal**2)))
 
 
-def bandpass_mag(y: np.ndarray, sr: int, fmin: float, fmax: float) -> float:
-    """Energia media di banda usando STFT."""
-    S = np.abs(librosa.stft(y, n_fft=2048, hop_length=512))**2
-    freqs = librosa.fft_frequencies(sr=sr, n_fft=2048)
-    band_idx = (freqs >= fmin) & (freqs < fmax)
-    if not np.any(band_idx):
+STFT_N_FFT = 2048
+STFT_HOP = 512
+
+
+class MeanPowerSpectrum:
+    """
+    |STFT|^2 medio sui frame (n_fft=2048, hop=512) di un segnale, per bin.
+
+    La media di banda su (bin, frame) e' la media sui bin delle medie per bin,
+    perche' ogni bin ha lo stesso numero di frame: basta tenere il vettore
+    per-bin e la STFT completa si calcola una sola volta.
+    """
+
+    def __init__(self, y: np.ndarray, sr: int):
+        S = librosa.stft(y, n_fft=STFT_N_FFT, hop_length=STFT_HOP)
+        self.power = np.mean(np.abs(S) ** 2, axis=-1, dtype=np.float64)
+        self.freqs = librosa.fft_frequencies(sr=sr, n_fft=STFT_N_FFT)
+
+    def band_mean(self, fmin: float, fmax: float) -> Optional[float]:
+        mask = (self.freqs >= fmin) & (self.freqs < fmax)
+        if not np.any(mask):
+            return None
+        return float(np.mean(self.power[..., mask]))
+
+
+class SpectrogramCache:
+    """
+    Cache per-analisi degli spettri: uno per segnale (mix, mid, side),
+    condiviso da tutte le query di banda.
+
+    La chiave comprende l'identità dell'array: un segnale diverso passato con
+    la stessa etichetta ha il suo spettro invece di ricevere quello del primo.
+    La cache tiene un riferimento all'array, quindi l'id non viene riusato.
+    """
+
+    def __init__(self, sr: int):
+        self.sr = sr
+        self._spectra: Dict[Tuple[str, int], Tuple[np.ndarray, MeanPowerSpectrum]] = {}
+
+    def get(self, key: str, y: np.ndarray) -> MeanPowerSpectrum:
+        entry = self._spectra.get((key, id(y)))
+        if entry is None:
+            entry = (y, MeanPowerSpectrum(y, self.sr))
+            self._spectra[(key, id(y))] = entry
+        return entry[1]
+
+
+def bandpass_mag(
+    y: np.ndarray,
+    sr: int,
+    fmin: float,
+    fmax: float,
+    cache: Optional[SpectrogramCache] = None,
+    key: str = "mix",
+) -> float:
+    """Energia media di banda usando STFT (letta da cache se presente)."""
+    spec = cache.get(key, y) if cache is not None else MeanPowerSpectrum(y, sr)
+    band_power = spec.band_mean(fmin, fmax)
+    if band_power is None:
         return -120.0
-    band_power = np.mean(S[band_idx])
     return db_safe(band_power)
 
 
-def _band_rms(signal: np.ndarray, sr: int, fmin: float, fmax: float) -> float:
-    S = np.abs(librosa.stft(signal, n_fft=2048, hop_length=512))
-    freqs = librosa.fft_frequencies(sr=sr, n_fft=2048)
-    mask = (freqs >= fmin) & (freqs < fmax)
-    if not np.any(mask):
+def _band_rms(
+    signal: np.ndarray,
+    sr: int,
+    fmin: float,
+    fmax: float,
+    cache: Optional[SpectrogramCache] = None,
+    key: str = "mix",
+) -> float:
+    spec = cache.get(key, signal) if cache is not None else MeanPowerSpectrum(signal, sr)
+    band_power = spec.band_mean(fmin, fmax)
+    if band_power is None:
         return 1e-6
-    band_power = np.mean(S[mask, :] ** 2)
     return math.sqrt(max(band_power, 1e-12))
 
 
@@ -63,17 +121,23 @@ def _clamp_db(value: float, min_db: float = -24.0, max_db: float = 24.0) -> floa
 
 def analyze_loudness(y: np.ndarray, sr: int) -> LoudnessMetrics:
     meter = pyln.Meter(sr)  # ITU-R BS.1770
-    loudness = meter.integrated_loudness(y)
-    # short-term loudness in finestre
+    # segnale K-pesato una volta sola: integrata e blocchi short-term
+    # derivano dalle stesse somme cumulative
+    # short-term loudness in finestre da 3 s (l'ultima può essere parziale)
     block_size = int(sr * 3.0)  # 3 s
+    starts = np.arange(0, len(y), block_size, dtype=np.int64)
+    signal = KWeightedSignal(meter, y, cuts=starts)
+    loudness = signal.integrated()
     short_terms = []
-    for start in range(0, len(y), block_size):
-        end = start + block_size
-        if end - start < block_size // 2:
-            break
-        block = y[start:end]
-        st = meter.integrated_loudness(block)
-        short_terms.append(st)
+    if starts.size:
+        full = starts[starts + block_size <= len(y)]
+        short_terms.extend(float(v) for v in signal.loudness(full, block_size))
+        tail_start = int(starts[-1])
+        tail_len = len(y) - tail_start
+        if tail_len < block_size:
+            # coda più corta del blocco di gating: pyloudnorm la rifiuta (nan)
+            tail = signal.loudness([tail_start], tail_len)
+            short_terms.extend(float(v) for v in tail if not np.isnan(v))
 
     if short_terms:
         st_min = float(np.min(short_terms))
@@ -100,7 +164,9 @@ def analyze_loudness(y: np.ndarray, sr: int) -> LoudnessMetrics:
 # 2) STEMS BALANCE (macro, versione semplificata V1)
 # -------------------------------------------------------------------
 
-def analyze_stems_balance(y: np.ndarray, sr: int) -> StemsBalanceMetrics:
+def analyze_stems_balance(
+    y: np.ndarray, sr: int, cache: Optional[SpectrogramCache] = None
+) -> StemsBalanceMetrics:
     """
     V1: niente demix complesso, solo proxy.
 
@@ -112,16 +178,19 @@ def analyze_stems_balance(y: np.ndarray, sr: int) -> StemsBalanceMetrics:
     sostituire con un modello di source separation (es. Demucs)
     e poi misurare i livelli RMS degli stem.
     """
+    if cache is None:
+        cache = SpectrogramCache(sr)
+
     mix_rms_val = rms(y)
     mix_rms_db = db_safe(mix_rms_val)
 
-    low_rms = _band_rms(y, sr, 20, 120)
-    kick_rms = _band_rms(y, sr, 40, 120)
-    lowmid_rms = _band_rms(y, sr, 120, 400)
-    mid_rms = _band_rms(y, sr, 400, 2000)
-    high_rms = _band_rms(y, sr, 2000, 8000)
-    clamp_rms = _band_rms(y, sr, 800, 4000)
-    clap_rms = _band_rms(y, sr, 1000, 8000)
+    low_rms = _band_rms(y, sr, 20, 120, cache)
+    kick_rms = _band_rms(y, sr, 40, 120, cache)
+    lowmid_rms = _band_rms(y, sr, 120, 400, cache)
+    mid_rms = _band_rms(y, sr, 400, 2000, cache)
+    high_rms = _band_rms(y, sr, 2000, 8000, cache)
+    clamp_rms = _band_rms(y, sr, 800, 4000, cache)
+    clap_rms = _band_rms(y, sr, 1000, 8000, cache)
 
     kick_db = db_safe(kick_rms)
     bass_db = db_safe(lowmid_rms)
@@ -166,13 +235,18 @@ def analyze_stems_balance(y: np.ndarray, sr: int) -> StemsBalanceMetrics:
 # 3) SPETTRO
 # -------------------------------------------------------------------
 
-def analyze_spectrum(y: np.ndarray, sr: int, profile: str) -> SpectrumMetrics:
+def analyze_spectrum(
+    y: np.ndarray, sr: int, profile: str, cache: Optional[SpectrogramCache] = None
+) -> SpectrumMetrics:
+    if cache is None:
+        cache = SpectrogramCache(sr)
+
     # energia per bande
-    low = bandpass_mag(y, sr, 20, 120)
-    lowmid = bandpass_mag(y, sr, 120, 400)
-    mid = bandpass_mag(y, sr, 400, 2000)
-    high = bandpass_mag(y, sr, 2000, 10000)
-    air = bandpass_mag(y, sr, 10000, 16000)
+    low = bandpass_mag(y, sr, 20, 120, cache)
+    lowmid = bandpass_mag(y, sr, 120, 400, cache)
+    mid = bandpass_mag(y, sr, 400, 2000, cache)
+    high = bandpass_mag(y, sr, 2000, 10000, cache)
+    air = bandpass_mag(y, sr, 10000, 16000, cache)
 
     # Reference molto semplice, hardcoded per iniziare.
     # In produzione puoi sostituire con valori calcolati da dataset.
@@ -211,7 +285,9 @@ def analyze_spectrum(y: np.ndarray, sr: int, profile: str) -> SpectrumMetrics:
 # 4) STEREO
 # -------------------------------------------------------------------
 
-def analyze_stereo(y: np.ndarray, sr: int) -> StereoMetrics:
+def analyze_stereo(
+    y: np.ndarray, sr: int, cache: Optional[SpectrogramCache] = None
+) -> StereoMetrics:
     # Se stereo: shape (2, n), se mono diventa (1, n)
     if y.ndim == 1:
         # mono: side = 0, correlation = 1
@@ -239,9 +315,12 @@ def analyze_stereo(y: np.ndarray, sr: int) -> StereoMetrics:
     M = (L + R) / 2.0
     S = (L - R) / 2.0
 
+    if cache is None:
+        cache = SpectrogramCache(sr)
+
     def side_mid_band_db(fmin: float, fmax: float) -> float:
-        m_band = bandpass_mag(M, sr, fmin, fmax)
-        s_band = bandpass_mag(S, sr, fmin, fmax)
+        m_band = bandpass_mag(M, sr, fmin, fmax, cache, key="mid")
+        s_band = bandpass_mag(S, sr, fmin, fmax, cache, key="side")
         return float(s_band - m_band)
 
     low_sm = side_mid_band_db(20, 120)
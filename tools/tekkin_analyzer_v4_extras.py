@@ -7,6 +7,10 @@ from typing import Any, Dict, List, Union
 
 import numpy as np
 
+from tekkin_analyzer_v3.utils.chroma import analyze_chroma, hpcp_stats
+from tekkin_analyzer_v3.utils.es_pool import algorithm
+from tekkin_analyzer_v3.utils.tempo import estimate_tempo
+
 # -----------------------------------------------------------------------------
 # Optional Essentia
 # -----------------------------------------------------------------------------
@@ -39,6 +43,9 @@ HOP_LENGTH = 1024
 
 MAX_ANALYSIS_SECONDS = 240.0
 
+# Profili di tonalità stimati dallo stesso HPCP (il primo è quello principale)
+TONAL_KEY_PROFILES = ("bgate", "temperley", "edma")
+
 # Stereo width thresholds (dB)
 WIDTH_TOO_WIDE_DB = 7.0
 WIDTH_TOO_MONO_DB = -4.0
@@ -255,7 +262,14 @@ def _default_rhythm_block() -> Dict[str, Any]:
 
 
 def _default_tonal_block() -> Dict[str, Any]:
-    return {"key": None, "scale": None, "key_conf": None, "tonal_strength": None, "hpcp_stats": None}
+    return {
+        "key": None,
+        "scale": None,
+        "key_conf": None,
+        "tonal_strength": None,
+        "hpcp_stats": None,
+        "key_alternatives": None,
+    }
 
 
 def _default_loudness_block() -> Dict[str, Any]:
@@ -304,61 +318,34 @@ def _extract_rhythm_block(signal: np.ndarray, sr: int) -> Dict[str, Any]:
         return block
 
     trimmed = _trim_to_max_duration(signal, sr, MAX_ANALYSIS_SECONDS)
-    rhythm_extractor = es.RhythmExtractor2013(method="multifeature")
-    result = rhythm_extractor(trimmed)
+    tempo = estimate_tempo(trimmed, sr)
 
-    bpm_value = _safe_float(result[0]) if len(result) > 0 else None
+    bpm_value = _safe_float(tempo["bpm"])
     if bpm_value is not None and bpm_value > 0:
         block["bpm"] = float(bpm_value)
 
-    conf_raw = _safe_float(result[2]) if len(result) > 2 else None
-    block["bpm_conf"] = _bounded_confidence((conf_raw / 5.0) if conf_raw is not None else 0.0)
+    block["bpm_conf"] = _bounded_confidence(tempo["confidence_unit"] or 0.0)
 
-    block["beats"] = _sequence_to_float_list(result[1]) if len(result) > 1 else None
-    block["tempo_curve"] = _sequence_to_float_list(result[3]) if len(result) > 3 else None
+    block["beats"] = _sequence_to_float_list(tempo["beats"])
+    raw = tempo.get("raw")
+    # la curva di tempo esiste solo con RhythmExtractor2013 (engine accurate)
+    block["tempo_curve"] = _sequence_to_float_list(raw[3]) if raw is not None and len(raw) > 3 else None
     return block
 
 
-def _collect_hpcp_stats(signal: np.ndarray, sr: int) -> dict[str, list[float]] | None:
-    if es is None or signal.size == 0 or sr <= 0:
-        return None
-
-    freq_bins = np.linspace(0, sr / 2, N_FFT // 2 + 1).astype(np.float32)
-    hpcp_algo = es.HPCP(sampleRate=sr, size=12)
-    windowing = es.Windowing(type="hann")
-    spectrum = es.Spectrum(size=N_FFT)
-
-    collected: List[np.ndarray] = []
-    for frame in es.FrameGenerator(signal, frameSize=N_FFT, hopSize=HOP_LENGTH):
-        frame_arr = np.asarray(frame, dtype=np.float32)
-        if frame_arr.size < N_FFT:
-            frame_arr = np.pad(frame_arr, (0, N_FFT - frame_arr.size))
-        mag = np.asarray(spectrum(windowing(frame_arr)), dtype=np.float32)
-        if mag.size != freq_bins.size:
-            continue
-        raw = hpcp_algo(mag, freq_bins)
-        arr = np.asarray(raw, dtype=np.float32)
-        if arr.size == 0:
-            continue
-        collected.append(arr)
-
-    if not collected:
-        return None
-
-    stack = np.vstack(collected)
-    return {
-        "mean": [float(v) for v in stack.mean(axis=0)],
-        "std": [float(v) for v in stack.std(axis=0)],
-    }
-
-
 def _extract_tonal_block(signal: np.ndarray, sr: int) -> Dict[str, Any]:
     block = _default_tonal_block()
     if es is None or signal.size == 0 or sr <= 0:
         return block
 
-    key_extractor = es.KeyExtractor()
-    key, scale, strength = key_extractor(signal)
+    # un solo passaggio HPCP: tonalità (profilo default + alternativi) e stats
+    chroma = analyze_chroma(signal, sr, profiles=TONAL_KEY_PROFILES)
+    block["hpcp_stats"] = hpcp_stats(chroma.hpcp)
+
+    primary = chroma.key(TONAL_KEY_PROFILES[0])
+    if primary is None:
+        return block
+    key, scale, strength = primary
     if not key:
         return block
 
@@ -371,7 +358,11 @@ def _extract_tonal_block(signal: np.ndarray, sr: int) -> Dict[str, Any]:
         block["key_conf"] = _bounded_confidence(float(strength))
         block["tonal_strength"] = float(strength)
 
-    block["hpcp_stats"] = _collect_hpcp_stats(signal, sr)
+    block["key_alternatives"] = {
+        profile: {"key": k, "scale": sc, "strength": float(st)}
+        for profile, (k, sc, st) in chroma.keys.items()
+        if profile != TONAL_KEY_PROFILES[0]
+    }
     return block
 
 
@@ -382,7 +373,7 @@ def _extract_loudness_block(signal: np.ndarray, sr: int, stereo_signal: np.ndarr
 
     trimmed = _trim_to_max_duration(signal, sr, MAX_ANALYSIS_SECONDS).astype(np.float32, copy=False)
 
-    ebu = es.LoudnessEBUR128(sampleRate=sr)
+    ebu = algorithm("LoudnessEBUR128", sampleRate=sr)
     raw = ebu(trimmed)
 
     # Compat: diverse build possono ritornare tuple in ordini diversi
@@ -442,7 +433,7 @@ def _extract_loudness_block(signal: np.ndarray, sr: int, stereo_signal: np.ndarr
     block["short_lufs_mean"] = s_stats.get("mean")
 
     try:
-        tp = es.TruePeakDetector(sampleRate=sr)
+        tp = algorithm("TruePeakDetector", sampleRate=sr)
         if stereo_signal is not None and isinstance(stereo_signal, np.ndarray) and stereo_signal.ndim == 2 and stereo_signal.shape[0] >= 2:
             L = np.ascontiguousarray(stereo_signal[0], dtype=np.float32)
             R = np.ascontiguousarray(stereo_signal[1], dtype=np.float32)
@@ -468,11 +459,11 @@ def _extract_spectral_block(signal: np.ndarray, sr: int) -> Dict[str, Any]:
     bins = frame_size // 2 + 1
     freq_bins = np.linspace(0, sr / 2, bins).astype(np.float32)
 
-    windowing = es.Windowing(type="hann")
-    spectrum = es.Spectrum(size=frame_size)
+    windowing = algorithm("Windowing", type="hann")
+    spectrum = algorithm("Spectrum", size=frame_size)
 
     # MFCC direttamente sullo spettro (mag), non su MelBands
-    mfcc_algo = es.MFCC(numberCoefficients=13, inputSize=bins)
+    mfcc_algo = algorithm("MFCC", numberCoefficients=13, inputSize=bins)
 
     centroids = 0.0
     rolloff_total = 0.0
@@ -700,6 +691,7 @@ def build_essentia_features(
     sr: int,
     y_stereo: np.ndarray | None,
     sr_stereo: int | None,
+    include_loudness: bool = True,
 ) -> Dict[str, Any]:
     stereo_signal = _prepare_stereo_signal(y_stereo, y_mono)
     stereo_sr = sr_stereo if sr_stereo and sr_stereo > 0 else sr
@@ -735,10 +727,11 @@ def build_essentia_features(
     except Exception as exc:
         _log(f"[PY-ANALYZER] tonal failed: {exc}")
 
-    try:
-        pack["loudness"] = _extract_loudness_block(signal, sr, stereo_signal=stereo_signal)
-    except Exception as exc:
-        _log(f"[PY-ANALYZER] loudness failed: {exc}")
+    if include_loudness:
+        try:
+            pack["loudness"] = _extract_loudness_block(signal, sr, stereo_signal=stereo_signal)
+        except Exception as exc:
+            _log(f"[PY-ANALYZER] loudness failed: {exc}")
 
     return pack
 
@@ -751,7 +744,13 @@ def analyze_v4_extras(
     y_stereo: np.ndarray,
     sr: int,
     loudness_stats: dict[str, float] | None = None,
+    include_loudness: bool = True,
 ) -> Dict[str, Any]:
+    """
+    include_loudness=False salta EBU R128 + true peak Essentia: per chi ha già
+    misurato la loudness sullo stesso buffer (es. analyze_master_web) e la
+    passa in loudness_stats (short_lufs_min/max/std per i warning).
+    """
     duration = float(len(y_mono) / sr) if sr > 0 else 0.0
 
     essentia_features = build_essentia_features(
@@ -759,6 +758,7 @@ def analyze_v4_extras(
         sr=sr,
         y_stereo=y_stereo,
         sr_stereo=sr,
+        include_loudness=include_loudness,
     )
 
     rhythm_block = essentia_features.get("rhythm", {}) or {}
@@ -782,7 +782,7 @@ def analyze_v4_extras(
         spectral_flatness=spectral_flatness,
         crest_db=crest_db,
         stereo_width=stereo_width,
-        loudness_block=loudness_block if isinstance(loudness_block, dict) else None,
+        loudness_block=loudness_block if include_loudness and isinstance(loudness_block, dict) else None,
         loudness_stats=loudness_stats,
     )
 
@@ -803,7 +803,7 @@ def analyze_v4_extras(
 
     # loudness compact + arrays
     loudness_out: Dict[str, Any] = {}
-    if isinstance(loudness_block, dict):
+    if include_loudness and isinstance(loudness_block, dict):
         loudness_out["integrated_lufs"] = None if loudness_block.get("integrated_lufs") is None else round(float(loudness_block["integrated_lufs"]), 3)
         loudness_out["lra"] = None if loudness_block.get("lra") is None else round(float(loudness_block["lra"]), 3)
         loudness_out["true_peak_db"] = None if loudness_block.get("true_peak_db") is None else round(float(loudness_block["true_peak_db"]), 3)
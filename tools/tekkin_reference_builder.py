@@ -16,7 +16,7 @@ import argparse
 import json
 from pathlib import Path
 
-from tools.analyze_master_web import analyze_to_text, extract_metrics_from_report, PROFILES
+from tools.analyze_master_web import analyze_metrics, PROFILES
 from tools.tekkin_analyzer_v4_extras import analyze_v4_extras  # type: ignore
 
 
@@ -58,30 +58,35 @@ def analyze_file_for_model(profile_key: str, path: Path) -> Optional[TrackFeatur
         print(f"[ref-builder] Errore caricando {path}: {e!r}")
         return None
 
+    # un solo buffer decodificato: meters master-web + extras v4 sullo stesso mid
     try:
-        analysis = analyze_to_text(
-            lang="it",
+        analysis = analyze_metrics(
             profile_key=profile_key,
             mode="master",
             file_path=str(path),
-            enable_plots=False,
-            plots_dir="plots",
-            emoji=False,
-            return_struct=True,
             preloaded_audio=y_stereo.T,
             preloaded_sr=sr,
+            return_intermediates=True,
         )
     except Exception as e:
-        print(f"[ref-builder] Errore in analyze_to_text per {path}: {e!r}")
+        print(f"[ref-builder] Errore in analyze_metrics per {path}: {e!r}")
         return None
 
-    report = analysis.get("report", "") or ""
+    meters = analysis.get("meters") or {}
     band_norm = analysis.get("band_norm")
-
-    lufs, _overall = extract_metrics_from_report(report, "it")
+    lufs = meters.get("integrated_lufs")
+    shared = analysis.get("intermediates") or {}
+    mid_mono = shared.get("mid_mono", y_mono)
 
     try:
-        extras = analyze_v4_extras(y_mono, y_stereo, sr)
+        # loudness già misurata sopra: niente secondo passaggio EBU R128
+        extras = analyze_v4_extras(
+            mid_mono,
+            y_stereo,
+            sr,
+            loudness_stats=meters,
+            include_loudness=False,
+        )
     except Exception as e:
         print(f"[ref-builder] Errore in analyze_v4_extras per {path}: {e!r}")
         return None